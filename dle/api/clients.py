@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest
+
+from asgiref.sync import sync_to_async
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch_django.settings import get_client, get_connection_settings
+
+
+@lru_cache(maxsize=None)
+def get_sync_client() -> Elasticsearch:
+    """One client, and so one connection pool, per worker process
+    elasticsearch_django's get_client builds a new client on every call"""
+    return get_client()
+
+
+@lru_cache(maxsize=None)
+def get_async_client() -> AsyncElasticsearch:
+    """One async client per ASGI worker process, its connections are opened in the worker's event loop"""
+    conn_settings = get_connection_settings("default")
+    if isinstance(conn_settings, (str, list)):
+        return AsyncElasticsearch(conn_settings)
+    return AsyncElasticsearch(**conn_settings)
+
+
+async def es_request(request: HttpRequest, method: str, **kwargs):
+    """Calls an Elasticsearch API, e.g. es_request(request, "search", index=...), from an async view
+    Under ASGI it goes through the async client. Under WSGI each request runs the view in its own short lived
+    event loop, which the async client's connections can't outlive, so the pooled sync client is called
+    in a thread instead.
+    """
+    if isinstance(request, ASGIRequest):
+        return await getattr(get_async_client(), method)(**kwargs)
+    return await sync_to_async(getattr(get_sync_client(), method), thread_sensitive=False)(**kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_vectorize_executor() -> ThreadPoolExecutor:
+    """Runs the model inference of the vectorize endpoint off the event loop, with at most
+    VECTORIZE_WORKERS texts encoded at the same time"""
+    return ThreadPoolExecutor(
+        max_workers=settings.VECTORIZE_WORKERS, thread_name_prefix="vectorize"
+    )
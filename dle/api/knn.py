@@ -0,0 +1,172 @@
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpRequest
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from data.models import ProductSection
+from search.utils.vector_index import LocalVectorIndex
+
+from .clients import es_request
+
+
+# the search filters, as fields of the productsection index, and as ProductSection lookups for the local index
+FILTER_LOOKUPS = {
+    "drug_label_source": "label_product__drug_label__source",
+    "drug_label_generic_name.keyword": "label_product__drug_label__generic_name",
+    "drug_label_marketer.keyword": "label_product__drug_label__marketer",
+    "drug_label_product_name.keyword": "label_product__drug_label__product_name",
+    "section_name.keyword": "section_name",
+    "drug_label_id": "label_product__drug_label_id",
+}
+
+# the local index of this worker process and the mtime of its ids file, see get_local_index
+local_index = (None, None)
+local_index_lock = threading.Lock()
+
+
+def get_local_index() -> LocalVectorIndex:
+    """The index at LOCAL_VECTOR_INDEX_DIR, reloaded once `build_vector_index` has replaced it"""
+    global local_index
+    mtime = os.stat(settings.LOCAL_VECTOR_INDEX_DIR / "ids.npy").st_mtime_ns
+    with local_index_lock:
+        if local_index[1] != mtime:
+            local_index = (LocalVectorIndex(settings.LOCAL_VECTOR_INDEX_DIR), mtime)
+        return local_index[0]
+
+
+def section_fields(section: ProductSection, result_fields: list) -> dict:
+    """The result_fields of a section, in the shape of the fields of an Elasticsearch hit"""
+    drug_label = section.label_product.drug_label
+    document = {
+        "id": str(section.id),
+        "label_product_id": section.label_product_id,
+        "drug_label_id": drug_label.id,
+        "drug_label_product_name": drug_label.product_name,
+        "drug_label_source": drug_label.source,
+        "drug_label_generic_name": drug_label.generic_name,
+        "drug_label_version_date": drug_label.version_date.isoformat(),
+        "drug_label_source_product_number": drug_label.source_product_number,
+        "drug_label_marketer": drug_label.marketer,
+        "drug_label_link": drug_label.link,
+        "section_name": section.section_name,
+        "section_text": section.section_text,
+    }
+    return {
+        name: [value]
+        for name, value in document.items()
+        if any(fnmatch.fnmatch(name, pattern) for pattern in result_fields)
+    }
+
+
+def local_knn_search(
+    vector: list,
+    k: int,
+    size: int,
+    from_: int,
+    filters: list,
+    result_fields: list,
+    excludes: list = (),
+) -> dict:
+    """kNN search of the local index, answered like Elasticsearch would
+    The hits' fields are read from Postgres, which is the only other service it needs.
+    """
+    allowed_ids = None
+    if filters or excludes:
+        sections = ProductSection.objects.filter(
+            **{FILTER_LOOKUPS[field]: value for field, value in filters}
+        )
+        for field, value in excludes:
+            sections = sections.exclude(**{FILTER_LOOKUPS[field]: value})
+        allowed_ids = sections.values_list("id", flat=True)
+    [neighbours] = get_local_index().search(
+        np.array([vector]), k, settings.LOCAL_VECTOR_INDEX_N_PROBE, allowed_ids
+    )
+    page = neighbours[from_ : from_ + size]
+    sections = ProductSection.objects.select_related("label_product__drug_label").in_bulk(
+        [section_id for section_id, _ in page]
+    )
+    return {
+        "took": 0,
+        "timed_out": False,
+        "hits": {
+            "total": {"value": len(neighbours)},
+            "max_score": neighbours[0][1] if neighbours else None,
+            "hits": [
+                {
+                    "_id": str(section_id),
+                    "_score": score,
+                    "fields": section_fields(sections[section_id], result_fields),
+                }
+                for section_id, score in page
+                if section_id in sections
+            ],
+        },
+    }
+
+
+async def knn_search(
+    request: HttpRequest,
+    vector: list,
+    size: int,
+    from_: int,
+    num_candidates: int,
+    filters: list,
+    result_fields: list,
+    excludes: list = (),
+) -> dict:
+    """Semantic search of the sections nearest the vector, with the backend set by VECTOR_SEARCH_BACKEND
+    - elasticsearch: the kNN search of the productsection index
+    - local: the memory-mapped index `build_vector_index` writes, without Elasticsearch
+    Both answer with an Elasticsearch search response, hits carrying the result_fields as `fields`.
+    Args:
+        filters: (field, value) pairs of FILTER_LOOKUPS fields the sections must match
+        excludes: (field, value) pairs of FILTER_LOOKUPS fields the sections must not match
+    """
+    # the k nearest sections are the results up to the end of the page
+    k = from_ + size
+    if settings.VECTOR_SEARCH_BACKEND == "local":
+        return await sync_to_async(local_knn_search)(
+            vector, k, size, from_, filters, result_fields, excludes
+        )
+    knn = {
+        "field": "text_embedding",
+        "query_vector": vector,
+        "k": k,
+        "num_candidates": max(num_candidates, k),
+        "filter": {
+            "bool": {
+                "filter": [{"term": {field: value}} for field, value in filters],
+                "must_not": [{"term": {field: value}} for field, value in excludes],
+            }
+        },
+    }
+    return await es_request(
+        request,
+        "search",
+        index="productsection",
+        knn=knn,
+        fields=result_fields,
+        source=False,
+        from_=from_,
+        size=size,
+    )
+
+
+def similar_sections_cache_key(
+    section: ProductSection, generation: int, filters: list, excludes: list, size: int
+) -> str:
+    """Changes with the section's vector, and with the index generation, so re-vectorizing the section or
+    indexing sections invalidates its similar sections"""
+    digest = hashlib.sha256(
+        json.dumps(
+            [section.bert_vector, settings.VECTOR_SEARCH_BACKEND, filters, excludes, size]
+        ).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"similar_sections:{section.id}:{generation}:{digest}"
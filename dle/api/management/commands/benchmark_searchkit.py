@@ -0,0 +1,161 @@
+import json
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from asgiref.sync import async_to_sync
+
+from api.views import searchkit
+from search.management.commands.performance_tests import SEARCH_TEXTS_ONE_WORD
+from search.search_constants import FACET_FIELDS
+
+
+logger = logging.getLogger(__name__)
+
+# what es_search.js asks for
+RESULT_ATTRIBUTES = [
+    "id",
+    "label_product_id",
+    "section_name",
+    "section_text",
+    "drug_label_product_name",
+    "drug_label_generic_name",
+    "drug_label_source",
+    "drug_label_link",
+    "drug_label_version_date",
+    "drug_label_source_product_number",
+    "drug_label_id",
+    "drug_label_marketer",
+]
+SEARCH_ATTRIBUTES = [
+    "drug_label_product_name",
+    "section_name",
+    "section_text",
+    "drug_label_generic_name",
+    "drug_label_source",
+    "drug_label_marketer",
+    "drug_label_source_product_number",
+]
+
+
+def searchkit_body(query: str, size: int) -> bytes:
+    """An msearch body like the ones Searchkit sends for a match search"""
+    search = {
+        "query": {"bool": {"must": {"multi_match": {"query": query, "fields": SEARCH_ATTRIBUTES}}}},
+        "aggs": {field: {"terms": {"field": field, "size": 10}} for field in FACET_FIELDS},
+        "size": size,
+        "from": 0,
+        "_source": {"includes": RESULT_ATTRIBUTES},
+        "highlight": {
+            "pre_tags": ["<em>"],
+            "post_tags": ["</em>"],
+            "fields": {"section_text": {"number_of_fragments": 5, "fragment_size": 300}},
+        },
+    }
+    lines = [json.dumps({"index": "productsection"}), json.dumps(search)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def without_took(content: bytes) -> dict:
+    """The parsed response, less the timings that change between two runs of the same search"""
+    res = json.loads(content)
+    res.pop("took", None)
+    for response in res.get("responses", []):
+        response.pop("took", None)
+    return res
+
+
+# runs with `python manage.py benchmark_searchkit`
+# add `--queries kidney,heart` to search other words, comma separated
+# add `--size 100` to return more hits per search
+# add `--repeat 5` to run each search more times
+class Command(BaseCommand):
+    help = (
+        "Compares the searchkit endpoint through the elasticsearch client, as a proxy, "
+        "and as a proxy with the response cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queries",
+            type=str,
+            help="Comma separated search words. Default is the one word searches of performance_tests",
+            default=",".join(SEARCH_TEXTS_ONE_WORD),
+        )
+        parser.add_argument("--size", type=int, help="Hits per search. Default is 20", default=20)
+        parser.add_argument(
+            "--repeat", type=int, help="Times each search is run. Default is 3", default=3
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        queries = [q.strip() for q in options["queries"].split(",") if q.strip()]
+        if not queries:
+            raise CommandError("No queries to search")
+
+        factory = RequestFactory()
+        totals = {}
+        contents = {}
+        # with the cache, the first run of each search is a miss and the others are hits
+        modes = {"client": (False, 0), "proxy": (True, 0), "cached": (True, 60)}
+        for mode, (proxy, cache_ttl) in modes.items():
+            totals[mode] = {"latency": 0.0, "cpu": 0.0, "bytes": 0, "requests": 0}
+            with override_settings(SEARCHKIT_PROXY=proxy, SEARCHKIT_CACHE_TTL=cache_ttl):
+                for query in queries:
+                    body = searchkit_body(query, options["size"])
+                    for _ in range(options["repeat"]):
+                        request = factory.post(
+                            "/api/v1/searchkit/_msearch",
+                            data=body,
+                            content_type="application/x-ndjson",
+                        )
+                        start, start_cpu = time.perf_counter(), time.process_time()
+                        response = async_to_sync(searchkit)(request)
+                        if response.streaming:
+                            content = b"".join(response.streaming_content)
+                        else:
+                            content = response.content
+                        latency = time.perf_counter() - start
+                        cpu = time.process_time() - start_cpu
+
+                        if response.status_code != 200:
+                            raise CommandError(
+                                f"{mode} {query!r}: {response.status_code} {content[:200]}"
+                            )
+                        contents[(mode, query)] = content
+                        totals[mode]["latency"] += latency
+                        totals[mode]["cpu"] += cpu
+                        totals[mode]["bytes"] += len(content)
+                        totals[mode]["requests"] += 1
+                        logger.info(
+                            f"{mode} {query!r}: {len(content)} bytes, "
+                            f"latency {latency * 1000:.1f}ms, cpu {cpu * 1000:.1f}ms"
+                        )
+
+        for mode, total in totals.items():
+            requests = max(total["requests"], 1)
+            self.stdout.write(
+                f"{mode}: {total['requests']} requests, {total['bytes'] // requests} bytes, "
+                f"latency {total['latency'] * 1000 / requests:.1f}ms, "
+                f"cpu {total['cpu'] * 1000 / requests:.1f}ms per request"
+            )
+
+        mismatches = 0
+        for query in queries:
+            expected = without_took(contents[("client", query)])
+            for mode in ["proxy", "cached"]:
+                if without_took(contents[(mode, query)]) != expected:
+                    mismatches += 1
+                    logger.error(self.style.ERROR(f"{mode} {query!r}: responses differ"))
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
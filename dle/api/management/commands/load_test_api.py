@@ -0,0 +1,114 @@
+import json
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import requests
+
+from .benchmark_searchkit import searchkit_body
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_request(endpoint: str, query: str) -> dict:
+    """The requests.request arguments for one call to an API endpoint"""
+    if endpoint == "search":
+        return {"method": "GET", "url": "/api/v1/search", "params": {"q": query}}
+    if endpoint == "search_label":
+        return {"method": "GET", "url": "/api/v1/search_label", "params": {"q": query}}
+    if endpoint == "searchkit":
+        return {
+            "method": "POST",
+            "url": "/api/v1/searchkit/_msearch",
+            "data": searchkit_body(query, 20),
+            "headers": {"Content-Type": "application/x-ndjson"},
+        }
+    if endpoint == "vectorize":
+        return {"method": "POST", "url": "/api/v1/vectorize", "data": json.dumps({"query": query})}
+    raise CommandError("'endpoint' must be search, search_label, searchkit or vectorize")
+
+
+# runs with `python manage.py load_test_api --url http://localhost:8000`
+# run it against the WSGI deployment, then the ASGI one (ASGI=True), and compare the two
+# add `--endpoint searchkit` to load another endpoint: search, search_label, searchkit or vectorize
+# add `--concurrency 100` to have more requests in flight
+# add `--requests 2000` to send more requests
+class Command(BaseCommand):
+    help = "Measures the throughput and latency of an API endpoint of a running server"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            type=str,
+            help="Base URL of the server. Default is API_ENDPOINT",
+            default=settings.API_ENDPOINT,
+        )
+        parser.add_argument(
+            "--endpoint", type=str, help="Endpoint to load. Default is search", default="search"
+        )
+        parser.add_argument(
+            "--query", type=str, help="Search text. Default is 'kidney'", default="kidney"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, help="Requests in flight. Default is 50", default=50
+        )
+        parser.add_argument(
+            "--requests", type=int, help="Requests to send. Default is 500", default=500
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            help="Seconds before a request fails. Default is 60",
+            default=60,
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        request_args = build_request(options["endpoint"], options["query"])
+        request_args["url"] = options["url"].rstrip("/") + request_args["url"]
+        # one session, and so one keep-alive connection, per client thread
+        sessions = threading.local()
+
+        def send(_):
+            if not hasattr(sessions, "session"):
+                sessions.session = requests.Session()
+            start = time.perf_counter()
+            try:
+                res = sessions.session.request(timeout=options["timeout"], **request_args)
+                ok = res.status_code == 200
+            except requests.RequestException as e:
+                logger.debug(repr(e))
+                ok = False
+            return ok, time.perf_counter() - start
+
+        logger.info(self.style.SUCCESS("start process"))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(send, range(options["requests"])))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for ok, latency in results if ok)
+        errors = len(results) - len(latencies)
+        if not latencies:
+            raise CommandError(f"All {errors} requests failed")
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        self.stdout.write(
+            f"{options['endpoint']}: {len(results)} requests, {options['concurrency']} concurrent, "
+            f"{errors} errors, {len(latencies) / elapsed:.1f} requests/s"
+        )
+        self.stdout.write(
+            f"latency p50 {percentiles[49] * 1000:.0f}ms, p95 {percentiles[94] * 1000:.0f}ms, "
+            f"p99 {percentiles[98] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms"
+        )
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Iterator, NamedTuple, Optional
+
+from django.http import HttpResponse
+
+
+class CachedResponse(NamedTuple):
+    status: int
+    content_type: str
+    content_encoding: Optional[str]
+    content: bytes
+    expires_at: float
+
+    def to_response(self) -> HttpResponse:
+        response = HttpResponse(self.content, status=self.status, content_type=self.content_type)
+        if self.content_encoding:
+            response["Content-Encoding"] = self.content_encoding
+        return response
+
+
+class ResponseCache:
+    """Msearch responses of one worker process, keyed by `msearch_cache_key`
+    - entries expire ttl seconds after they are stored
+    - once the entries take more than max_bytes, the least recently used ones are evicted
+    - hits, misses and evictions are counted for `stats`
+    """
+
+    def __init__(self, ttl: float, max_bytes: int, max_entry_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(
+        self,
+        key: str,
+        status: int,
+        content_type: str,
+        content_encoding: Optional[str],
+        content: bytes,
+    ) -> None:
+        if len(content) > self.max_entry_bytes:
+            return
+        entry = CachedResponse(
+            status, content_type, content_encoding, content, time.monotonic() + self.ttl
+        )
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self.size -= len(self.entries.pop(key).content)
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+def msearch_cache_key(body: bytes, generations: dict, gzip: bool) -> str:
+    """Hash of the msearch body with each line re-serialized with sorted keys, so bodies that only differ in
+    key order or whitespace share a key, and of the generations of the indices it searches"""
+    lines = []
+    for line in body.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            lines.append(json.dumps(json.loads(line), sort_keys=True, separators=(",", ":")))
+        except ValueError:
+            lines.append(line.decode("utf-8", "replace"))
+    digest = hashlib.sha256()
+    digest.update(json.dumps([sorted(generations.items()), gzip, lines]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def caching_stream(
+    chunks: Iterator[bytes],
+    cache: ResponseCache,
+    key: str,
+    status: int,
+    content_type: str,
+    content_encoding: Optional[str],
+) -> Iterator[bytes]:
+    """Passes the chunks of a response on, and caches the response once it's complete
+    Stops collecting them once the response is too large to cache."""
+    collected = []
+    size = 0
+    try:
+        for chunk in chunks:
+            if collected is not None:
+                size += len(chunk)
+                if size <= cache.max_entry_bytes:
+                    collected.append(chunk)
+                else:
+                    collected = None
+            yield chunk
+    finally:
+        # the client may go away before the end, the upstream response is closed either way
+        chunks.close()
+    if collected is not None:
+        cache.set(key, status, content_type, content_encoding, b"".join(collected))
+
+
+async def acaching_stream(
+    chunks: AsyncIterator[bytes],
+    cache: ResponseCache,
+    key: str,
+    status: int,
+    content_type: str,
+    content_encoding: Optional[str],
+) -> AsyncIterator[bytes]:
+    """`caching_stream` for async iterators"""
+    collected = []
+    size = 0
+    try:
+        async for chunk in chunks:
+            if collected is not None:
+                size += len(chunk)
+                if size <= cache.max_entry_bytes:
+                    collected.append(chunk)
+                else:
+                    collected = None
+            yield chunk
+    finally:
+        # the client may go away before the end, the upstream response is closed either way
+        await chunks.aclose()
+    if collected is not None:
+        cache.set(key, status, content_type, content_encoding, b"".join(collected))
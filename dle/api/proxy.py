@@ -0,0 +1,116 @@
+import json
+import ssl
+from functools import lru_cache
+from typing import AsyncIterator, Iterator
+
+from django.conf import settings
+
+import urllib3
+from asgiref.sync import sync_to_async
+from urllib3.util.ssl_ import create_urllib3_context
+
+
+class MsearchRejected(ValueError):
+    """The msearch body can't be forwarded to Elasticsearch"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_msearch(body: bytes, allowed_indices: list, max_size: int) -> set:
+    """Checks an msearch NDJSON body before it's forwarded, without parsing the searches.
+    Only the header lines are parsed, each must name its indices and they must be in allowed_indices.
+    Raises:
+        MsearchRejected: with status 413 if the body is larger than max_size, else 400
+    Returns:
+        set: the indices searched
+    """
+    indices = set()
+    if max_size and len(body) > max_size:
+        raise MsearchRejected(f"Request body is larger than {max_size} bytes", status=413)
+    lines = [line for line in body.split(b"\n") if line.strip()]
+    if not lines or len(lines) % 2:
+        raise MsearchRejected("Expected pairs of header and search lines")
+    for header_line in lines[::2]:
+        try:
+            header = json.loads(header_line)
+        except ValueError:
+            raise MsearchRejected("Header line is not valid JSON")
+        index = header.get("index") if isinstance(header, dict) else None
+        if isinstance(index, str):
+            index = index.split(",")
+        if not index or not isinstance(index, list):
+            raise MsearchRejected("Each search must name its index")
+        for name in index:
+            if name not in allowed_indices:
+                raise MsearchRejected(f"Index {name!r} is not searchable")
+            indices.add(name)
+    return indices
+
+
+@lru_cache(maxsize=None)
+def get_pool() -> urllib3.PoolManager:
+    """The connection pool shared by all the searchkit requests of a worker process,
+    configured like the elasticsearch-django default connection"""
+    connection = settings.SEARCH_SETTINGS["connections"]["default"]
+    pool_options = {
+        "maxsize": settings.SEARCHKIT_POOL_SIZE,
+        # wait for a free connection rather than opening connections the pool can't keep
+        "block": True,
+        "timeout": urllib3.Timeout(
+            connect=settings.SEARCHKIT_CONNECT_TIMEOUT, read=settings.SEARCHKIT_READ_TIMEOUT
+        ),
+        "retries": False,
+    }
+    if connection["hosts"].startswith("https"):
+        ssl_context = create_urllib3_context(cert_reqs=ssl.CERT_REQUIRED)
+        if isinstance(connection.get("ssl_version"), ssl.TLSVersion):
+            ssl_context.minimum_version = connection["ssl_version"]
+        ssl_context.load_verify_locations(cafile=connection["ca_certs"])
+        pool_options["ssl_context"] = ssl_context
+    return urllib3.PoolManager(**pool_options)
+
+
+@lru_cache(maxsize=None)
+def get_auth_headers() -> dict:
+    user, password = settings.SEARCH_SETTINGS["connections"]["default"]["http_auth"]
+    return urllib3.make_headers(basic_auth=f"{user}:{password}")
+
+
+def forward_msearch(body: bytes, accept_encoding: str = "") -> urllib3.HTTPResponse:
+    """Posts an msearch NDJSON body to Elasticsearch as is.
+    The response is not read, stream it with `stream_response`.
+    Args:
+        body (bytes): a body accepted by validate_msearch
+        accept_encoding (str): the client's Accept-Encoding, a gzip response is passed through compressed
+    """
+    headers = {"Content-Type": "application/x-ndjson", **get_auth_headers()}
+    if "gzip" in accept_encoding:
+        headers["Accept-Encoding"] = "gzip"
+    url = settings.SEARCH_SETTINGS["connections"]["default"]["hosts"].rstrip("/") + "/_msearch"
+    return get_pool().request("POST", url, body=body, headers=headers, preload_content=False)
+
+
+def stream_response(response: urllib3.HTTPResponse, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """The raw bytes of an Elasticsearch response, its connection goes back to the pool once they are read
+    or the client goes away"""
+    try:
+        yield from response.stream(chunk_size, decode_content=False)
+    finally:
+        if not response.isclosed():
+            # the rest of the response is still on the connection, so it can't be reused
+            response.close()
+        response.release_conn()
+
+
+async def astream_response(
+    response: urllib3.HTTPResponse, chunk_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """`stream_response` for ASGI, each chunk is read in a thread so the event loop isn't blocked"""
+    chunks = stream_response(response, chunk_size)
+    try:
+        while chunk := await sync_to_async(next, thread_sensitive=False)(chunks, None):
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=False)()
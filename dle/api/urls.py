@@ -9,7 +9,9 @@ urlpatterns = [
     path("v1/searchkit/_msearch", views.searchkit, name="searchkit"),
     # This is used so we can reverse it in search/views.py for the search.html context
     path("v1/searchkit", views.searchkit, name="searchkit_root"),
+    path("v1/searchkit/cache_stats", views.searchkit_cache_stats, name="searchkit_cache_stats"),
     path("v1/vectorize", views.vectorize, name="vectorize"),
     path("v1/search", views.search, name="search"),
-    path("v1/search_label", views.search_label, name="search_label")
+    path("v1/search_label", views.search_label, name="search_label"),
+    path("v1/sections/<int:section_id>/similar", views.similar_sections, name="similar_sections")
 ]
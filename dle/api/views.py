@@ -1,30 +1,185 @@
+import asyncio
 import json
+import threading
 
-from django.http import HttpRequest, JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
 
-from elasticsearch_django.settings import get_client
+from asgiref.sync import sync_to_async
 from sentence_transformers import SentenceTransformer
 
-from data.models import DrugLabel
+from data.models import DrugLabel, IndexGeneration, ProductSection
 from data.util import compute_section_embedding
+from search.utils.vector_index import LOCAL_INDEX_NAME
 
 from .apps import ApiConfig
+from .clients import es_request, get_vectorize_executor
+from .knn import knn_search, similar_sections_cache_key
+from .msearch_cache import ResponseCache, acaching_stream, caching_stream, msearch_cache_key
+from .proxy import (
+    MsearchRejected,
+    astream_response,
+    forward_msearch,
+    stream_response,
+    validate_msearch,
+)
 
 
+# fields of a productsection document returned by the search endpoints, everything but text_embedding
+# the vector is also excluded from _source in the mapping, it's 768 floats per hit that no client shows
+RESULT_FIELDS = ["id", "label_product_id", "section_*", "drug_label_*"]
+
+
+def get_result_fields(fields: list) -> list:
+    """The fields to return for the requested ones, with "*" expanded to RESULT_FIELDS and without the vector"""
+    result_fields = []
+    for field in fields:
+        if field == "*":
+            result_fields += RESULT_FIELDS
+        elif field != "text_embedding":
+            result_fields.append(field)
+    return result_fields
+
+
+# field the search endpoint collapses the sections on with collapse=true, so each hit is a distinct label
+COLLAPSE_FIELD = "drug_label_id"
+
+
+def get_collapse(result_fields: list, sections: int) -> dict:
+    """One hit per label, with its best sections up to `sections` as the "sections" inner hits"""
+    return {
+        "field": COLLAPSE_FIELD,
+        "inner_hits": {
+            "name": "sections",
+            "size": sections,
+            "fields": result_fields,
+            "_source": False,
+        },
+    }
+
+
+def format_hit(hit: dict) -> dict:
+    """The score and the first value of each field of an Elasticsearch hit"""
+    fields = hit.get("fields", {})
+    for field in fields:
+        fields[field] = fields[field][0]
+    return {
+        "score": hit["_score"],
+        "fields": fields
+    }
+
+
+def async_csrf_exempt(view_func):
+    """csrf_exempt for async views, Django 4.2's csrf_exempt wraps them in a sync function"""
+    view_func.csrf_exempt = True
+    return view_func
+
+
+# texts waiting for or being vectorized, see VECTORIZE_QUEUE_SIZE
+vectorize_slots = threading.BoundedSemaphore(settings.VECTORIZE_QUEUE_SIZE)
+# searchkit responses of this worker process, see SEARCHKIT_CACHE_TTL
+msearch_cache = ResponseCache(
+    ttl=settings.SEARCHKIT_CACHE_TTL,
+    max_bytes=settings.SEARCHKIT_CACHE_MAX_BYTES,
+    max_entry_bytes=settings.SEARCHKIT_CACHE_MAX_ENTRY_BYTES,
+)
+
+
+# The API views are async, so under ASGI (ASGI=True in the entrypoint) a worker serves many requests while
+# they wait on Elasticsearch. Under WSGI, Django runs each of them in its own event loop.
 #TODO figure out how to use CSRF in the template
-@csrf_exempt
-def searchkit(request: HttpRequest) -> JsonResponse:
-    """Core search API which gets proxied to Elasticsearch"""
-    es = get_client()
-    print(request.body)
-    res = es.msearch(searches=request.body)
+@async_csrf_exempt
+async def searchkit(request: HttpRequest) -> JsonResponse | StreamingHttpResponse:
+    """Core search API which gets proxied to Elasticsearch
+    With SEARCHKIT_PROXY, the msearch body is forwarded and the response streamed back as raw bytes,
+    so the hits (section texts, vectors) are never decoded and re-encoded here
+    With SEARCHKIT_CACHE_TTL, identical searches of an index that hasn't changed since are answered from
+    msearch_cache, e.g. when InstantSearch refreshes the facets or the user goes back
+    """
+    try:
+        indices = validate_msearch(
+            request.body, settings.SEARCHKIT_INDICES, settings.SEARCHKIT_MAX_BODY_SIZE
+        )
+    except MsearchRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    cache_key = None
+    if settings.SEARCHKIT_CACHE_TTL:
+        generations = IndexGeneration.objects.filter(index_name__in=indices)
+        cache_key = msearch_cache_key(
+            request.body,
+            {
+                name: generation
+                async for name, generation in generations.values_list("index_name", "generation")
+            },
+            gzip=settings.SEARCHKIT_PROXY and "gzip" in accept_encoding,
+        )
+        cached = msearch_cache.get(cache_key)
+        if cached is not None:
+            return cached.to_response()
+
+    if settings.SEARCHKIT_PROXY:
+        res = await sync_to_async(forward_msearch, thread_sensitive=False)(
+            request.body, accept_encoding
+        )
+        content_type = res.headers.get("Content-Type", "application/json")
+        content_encoding = res.headers.get("Content-Encoding")
+        # Django buffers a streaming response whose iterator doesn't match the server, sync for WSGI
+        if isinstance(request, ASGIRequest):
+            content = astream_response(res)
+            if cache_key and res.status == 200:
+                content = acaching_stream(
+                    content, msearch_cache, cache_key, res.status, content_type, content_encoding
+                )
+        else:
+            content = stream_response(res)
+            if cache_key and res.status == 200:
+                content = caching_stream(
+                    content, msearch_cache, cache_key, res.status, content_type, content_encoding
+                )
+        response = StreamingHttpResponse(content, status=res.status, content_type=content_type)
+        if content_encoding:
+            response["Content-Encoding"] = content_encoding
+        return response
+
+    res = await es_request(request, "msearch", searches=request.body)
     # res is returned as an elastic_transport.ObjectApiResponse
-    return JsonResponse(dict(res))
+    response = JsonResponse(dict(res))
+    if cache_key:
+        msearch_cache.set(
+            cache_key, response.status_code, response["Content-Type"], None, response.content
+        )
+    return response
+
+
+async def searchkit_cache_stats(request: HttpRequest) -> JsonResponse:
+    """Hits and misses of the searchkit response cache of the worker process that answers"""
+    return JsonResponse(msearch_cache.stats())
+
 
-@csrf_exempt
-def vectorize(request: HttpRequest) -> JsonResponse:
-    """Vectorize a search query"""
+async def embed_query(query: str) -> list | None:
+    """The vector of a search query, or None if VECTORIZE_QUEUE_SIZE queries are already waiting
+    The model runs in the vectorize executor, and queries beyond the queue size are turned away
+    rather than queued behind it
+    """
+    if not vectorize_slots.acquire(blocking=False):
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            get_vectorize_executor(),
+            compute_section_embedding,
+            query,
+            ApiConfig.pubmedbert_model,
+        )
+    finally:
+        vectorize_slots.release()
+
+@async_csrf_exempt
+async def vectorize(request: HttpRequest) -> JsonResponse:
+    """Vectorize a search query, see embed_query"""
     data = json.loads(request.body)
     query = data.get("query", "")
     status = "Failed"
@@ -32,7 +187,9 @@ def vectorize(request: HttpRequest) -> JsonResponse:
         "query": query
     }
     if query:
-        vector = compute_section_embedding(text=query, model=ApiConfig.pubmedbert_model)
+        vector = await embed_query(query)
+        if vector is None:
+            return JsonResponse({"query": query, "status": "Busy", "vector": []}, status=503)
         if len(vector) == 768:
             status = "Success"
             res["vector"] = vector
@@ -78,11 +235,17 @@ def get_simple_query_string(query: str | None, fields: list, filters: list = [],
             })
     return res
 
-@csrf_exempt
-def search(request: HttpRequest) -> JsonResponse:
+@async_csrf_exempt
+async def search(request: HttpRequest) -> JsonResponse:
     """Wrapper endpoint for a search against Elasticsearch.
     GET requests are proxied to Elasticsearch.
     Uses BM25 scoring for now.
+    With collapse=true, each hit is a label rather than a section, with its best sections (at most `sections`,
+    default 3) in the hit's "sections", and total counts labels. Elasticsearch collapses the hits in the same
+    query, so a page of distinct labels costs about as much as a page of sections.
+    With semantic=true, the sections are the nearest neighbours of the vectorized query instead, from the
+    VECTOR_SEARCH_BACKEND (see api.knn), which can be a local index when Elasticsearch isn't available.
+    Semantic results aren't collapsed.
     """
     # Can only filter on fields indexed as keyword
     # drug_label_source is indexed directly as keyword, everything else is indexed as text with the sub-field keyword
@@ -116,18 +279,47 @@ def search(request: HttpRequest) -> JsonResponse:
     print(filters)
 
     default_operator = request.GET.get("default_operator", "AND")
+    collapse = request.GET.get("collapse", "false").lower() == "true"
+    sections = int(request.GET.get("sections", 3))
+    semantic = request.GET.get("semantic", "false").lower() == "true"
 
     formatted_query = get_simple_query_string(query=q, fields=fields, default_operator=default_operator, filters=filters)
     print(formatted_query)
 
-    es = get_client()
-    res = es.search(
-        index="productsection",
-        body=formatted_query,
-        fields=fields,
-        from_=from_,
-        size=size,
-    )
+    result_fields = get_result_fields(fields)
+    if semantic:
+        vector = await embed_query(q) if q else []
+        if vector is None:
+            return JsonResponse({"error": "Too many queries are being vectorized"}, status=503)
+        if len(vector) != 768:
+            return JsonResponse({"error": "Semantic search needs a query"}, status=400)
+        res = await knn_search(
+            request,
+            vector,
+            size=int(size),
+            from_=int(from_),
+            num_candidates=int(request.GET.get("num_candidates", 100)),
+            filters=filters,
+            result_fields=result_fields,
+        )
+        collapse = False
+    elif collapse:
+        formatted_query["collapse"] = get_collapse(result_fields, sections)
+        # hits.total still counts the sections, the labels are counted alongside
+        formatted_query["aggs"] = {"labels": {"cardinality": {"field": COLLAPSE_FIELD}}}
+
+    if not semantic:
+        # the fields are read with the fields API, so the _source of each hit doesn't need to be sent at all
+        res = await es_request(
+            request,
+            "search",
+            index="productsection",
+            body=formatted_query,
+            fields=result_fields,
+            source=False,
+            from_=from_,
+            size=size,
+        )
     formatted_res = {
         "took": res["took"],
         "timed_out": res["timed_out"],
@@ -136,27 +328,85 @@ def search(request: HttpRequest) -> JsonResponse:
             "max_score": res["hits"]["max_score"],
         }
     }
+    if collapse:
+        formatted_res["hits"]["total_sections"] = formatted_res["hits"]["total"]
+        formatted_res["hits"]["total"] = res["aggregations"]["labels"]["value"]
     formatted_res["hits"]["hits"] = []
     for hit in res["hits"]["hits"]:
-        fields = hit["fields"]
-        del fields["text_embedding"]
-        for field in fields:
-            fields[field] = fields[field][0]
-        formatted_hit = {
-            "score": hit["_score"],
-            "fields": fields
-        }
+        formatted_hit = format_hit(hit)
+        if collapse:
+            formatted_hit["sections"] = [
+                format_hit(section) for section in hit["inner_hits"]["sections"]["hits"]["hits"]
+            ]
         formatted_res["hits"]["hits"].append(formatted_hit)
 
     return JsonResponse(formatted_res)
 
-@csrf_exempt
-def search_label(request: HttpRequest) -> JsonResponse:
+
+async def similar_sections(request: HttpRequest, section_id: int) -> JsonResponse:
+    """The sections nearest a section, by the kNN search of its stored vector, so nothing is vectorized
+    By default they are sections of the same metacategory (section_name) in other labels, e.g. the
+    Indications of the other agencies' labels of a drug. section_name=any searches all the metacategories,
+    and agency restricts them to an agency's labels.
+    Results are cached for SIMILAR_SECTIONS_CACHE_TIMEOUT seconds, keyed by the vector and the index generation,
+    so they're recomputed once the section is re-vectorized or sections are indexed.
+    """
+    try:
+        section = await ProductSection.objects.select_related("label_product").aget(id=section_id)
+    except ProductSection.DoesNotExist:
+        return JsonResponse({"error": "Section not found"}, status=404)
+    if not section.bert_vector:
+        return JsonResponse({"error": "Section has not been vectorized"}, status=404)
+
+    section_name = request.GET.get("section_name", section.section_name)
+    agency = request.GET.get("agency", "")
+    size = int(request.GET.get("size", 10))
+    filters = []
+    if section_name != "any":
+        filters.append(["section_name.keyword", section_name])
+    if agency:
+        filters.append(["drug_label_source", agency])
+    excludes = [["drug_label_id", section.label_product.drug_label_id]]
+
+    index_name = LOCAL_INDEX_NAME if settings.VECTOR_SEARCH_BACKEND == "local" else "productsection"
+    generation = (
+        await IndexGeneration.objects.filter(index_name=index_name)
+        .values_list("generation", flat=True)
+        .afirst()
+    )
+    key = similar_sections_cache_key(section, generation or 0, filters, excludes, size)
+    res = await cache.aget(key)
+    if res is None:
+        hits = await knn_search(
+            request,
+            json.loads(section.bert_vector),
+            size=size,
+            from_=0,
+            num_candidates=int(request.GET.get("num_candidates", 100)),
+            filters=filters,
+            result_fields=RESULT_FIELDS,
+            excludes=excludes,
+        )
+        res = {
+            "section": {
+                "id": section.id,
+                "section_name": section.section_name,
+                "drug_label_id": section.label_product.drug_label_id,
+            },
+            "took": hits["took"],
+            "hits": [format_hit(hit) for hit in hits["hits"]["hits"]],
+        }
+        if settings.SIMILAR_SECTIONS_CACHE_TIMEOUT:
+            await cache.aset(key, res, timeout=settings.SIMILAR_SECTIONS_CACHE_TIMEOUT)
+    return JsonResponse(res)
+
+@async_csrf_exempt
+async def search_label(request: HttpRequest) -> JsonResponse:
     """Searches Django for a DrugLabel"""
     q = request.GET.get("q", "")
     print(f"query: {q}")
     labels = DrugLabel.objects.filter(product_name__icontains=q)
 
     return JsonResponse({
-        "labels": [dl.as_dict() for dl in labels]
+        "labels": [dl.as_dict() async for dl in labels]
     })
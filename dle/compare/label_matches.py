@@ -0,0 +1,257 @@
+import json
+import logging
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Q
+
+import numpy as np
+
+from data.constants import METACATEGORIES_MAP
+from data.models import DrugLabel, ProductSection
+from search.utils.knn import normalize, top_k
+
+from .models import LabelMatch
+
+
+logger = logging.getLogger(__name__)
+
+# the indication sections of every agency, a label's indication vector is the mean of their vectors
+INDICATION_SECTION_NAMES = sorted(
+    {name for names in METACATEGORIES_MAP["Indication and usage"].values() for name in names}
+)
+# share of the generic name overlap in a match's score, the rest is the indication vectors' similarity
+NAME_WEIGHT = 0.6
+
+# salt forms, hydrates, dosage forms and the like that don't tell two medicines apart
+IGNORED_NAME_TOKENS = set(
+    """
+    acetate and anhydrous besilate besylate bromide calcium capsule capsules chloride citrate dihydrate
+    disodium for fumarate hcl hemihydrate hydrobromide hydrochloride injection maleate magnesium mesilate
+    mesylate monohydrate of oral origin phosphate potassium rdna sodium solution succinate sulfate sulphate
+    tablet tablets tartrate trihydrate with
+    """.split()
+)
+# names the agencies use for the same substance, mapped to the one the FDA uses
+NAME_SYNONYMS = {
+    "adrenaline": "epinephrine",
+    "frusemide": "furosemide",
+    "lignocaine": "lidocaine",
+    "noradrenaline": "norepinephrine",
+    "paracetamol": "acetaminophen",
+    "salbutamol": "albuterol",
+}
+
+
+class MatchLabel(NamedTuple):
+    id: int
+    source: str
+    name_tokens: frozenset
+
+
+def normalize_generic_name(generic_name: str) -> Tuple[str, ...]:
+    """The sorted distinct words of a generic name, without case, accents, punctuation, salts or doses
+    e.g. "Metformin Hydrochloride 500 mg" and "metformin" are both ("metformin",)
+    """
+    text = unicodedata.normalize("NFKD", generic_name).encode("ascii", "ignore").decode()
+    words = [NAME_SYNONYMS.get(word, word) for word in re.findall(r"[a-z]+", text.lower())]
+    words = [word for word in words if len(word) > 2 and word not in {"mcg", "mg", "ml"}]
+    tokens = [word for word in words if word not in IGNORED_NAME_TOKENS]
+    # a name that is only a salt, e.g. potassium chloride, keeps its salt words
+    return tuple(sorted(set(tokens or words)))
+
+
+def name_score(tokens1: frozenset, tokens2: frozenset) -> float:
+    """Jaccard similarity of two normalized generic names, 1.0 when they are the same"""
+    if not tokens1 or not tokens2:
+        return 0.0
+    return len(tokens1 & tokens2) / len(tokens1 | tokens2)
+
+
+def match_score(name: float, vector: Optional[float]) -> float:
+    """A pair's score, a label without indication vectors only matches by name"""
+    return NAME_WEIGHT * name + (1 - NAME_WEIGHT) * max(vector or 0.0, 0.0)
+
+
+def indication_vectors() -> Dict[int, np.ndarray]:
+    """The unit length mean of the bert_vectors of each label's indication sections"""
+    sections = ProductSection.objects.filter(
+        section_name__in=INDICATION_SECTION_NAMES, bert_vector__isnull=False
+    )
+    sums = {}
+    for label_id, bert_vector in sections.values_list(
+        "label_product__drug_label_id", "bert_vector"
+    ).iterator(chunk_size=5000):
+        vector = normalize(np.array([json.loads(bert_vector)], dtype=np.float32))[0]
+        sums[label_id] = sums[label_id] + vector if label_id in sums else vector
+    return {label_id: normalize(vector[np.newaxis])[0] for label_id, vector in sums.items()}
+
+
+def score_matches(
+    targets: List[MatchLabel],
+    candidates: List[MatchLabel],
+    vectors: Dict[int, np.ndarray],
+    k: int,
+    min_score: float,
+    batch_size: int = 256,
+) -> Dict[int, List[Tuple[int, float, Optional[float], float]]]:
+    """The k best candidates of another agency for each target, by generic name and indication vectors
+    A target is scored against the candidates sharing a word of its generic name, and the k candidates
+    with the nearest indication vectors, so a medicine named differently by two agencies is still found.
+    Args:
+        vectors: the indication_vectors of the labels, labels without one only match by name
+    Returns:
+        (match id, name score, vector score, score) of at least min_score per target id, best first
+    """
+    by_token = defaultdict(list)
+    for i, candidate in enumerate(candidates):
+        for token in candidate.name_tokens:
+            by_token[token].append(i)
+    vector_rows = [i for i, candidate in enumerate(candidates) if candidate.id in vectors]
+    dims = len(next(iter(vectors.values()))) if vectors else 0
+    candidate_vectors = np.array(
+        [vectors[candidates[i].id] for i in vector_rows], dtype=np.float32
+    ).reshape(len(vector_rows), dims)
+    candidate_sources = np.array([candidates[i].source for i in vector_rows])
+
+    matches = {}
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start : start + batch_size]
+        nearest = [()] * len(batch)
+        with_vectors = [j for j, target in enumerate(batch) if target.id in vectors]
+        if with_vectors and vector_rows:
+            scores = np.array([vectors[batch[j].id] for j in with_vectors]) @ candidate_vectors.T
+            # a label is only matched with the labels of other agencies
+            sources = np.array([batch[j].source for j in with_vectors])
+            scores[sources[:, np.newaxis] == candidate_sources] = -np.inf
+            best_scores, best_rows = top_k(scores, np.array(vector_rows), k)
+            for j, row_scores, rows in zip(with_vectors, best_scores, best_rows):
+                nearest[j] = [row for row, score in zip(rows, row_scores) if score > -np.inf]
+
+        for target, nearest_rows in zip(batch, nearest):
+            rows = {i for token in target.name_tokens for i in by_token[token]}
+            rows.update(nearest_rows)
+            target_vector = vectors.get(target.id)
+            pairs = []
+            for i in rows:
+                candidate = candidates[i]
+                if candidate.source == target.source or candidate.id == target.id:
+                    continue
+                name = name_score(target.name_tokens, candidate.name_tokens)
+                vector = None
+                if target_vector is not None and candidate.id in vectors:
+                    vector = float(target_vector @ vectors[candidate.id])
+                score = match_score(name, vector)
+                if score >= min_score:
+                    pairs.append((candidate.id, name, vector, score))
+            pairs.sort(key=lambda pair: (-pair[3], pair[0]))
+            matches[target.id] = pairs[:k]
+    return matches
+
+
+def latest_versions(labels: Iterable[tuple]) -> Dict[tuple, int]:
+    """The id of the latest version of each (source, source_product_number) product
+    Args:
+        labels: (id, source, source_product_number, version_date) rows
+    """
+    latest = {}
+    for label_id, source, product_number, version_date in sorted(labels, key=lambda row: row[3]):
+        latest[(source, product_number)] = label_id
+    return latest
+
+
+def refresh_label_matches(
+    target_ids: Iterable[int], top: int = 5, min_score: float = 0.35
+) -> Tuple[int, int]:
+    """Replaces the stored matches of the target labels, and adds the targets to the matches of the
+    labels they match, so loading new labels doesn't need the other labels to be rescored.
+    Matches are the latest version of each product of another agency; since the scores are symmetric,
+    a pair scored from either side has the same score.
+    Labels users uploaded as My Labels are private to the user, they are neither matched nor a match.
+    Returns:
+        the number of labels whose matches were replaced, and the number that gained a target as a match
+    """
+    rows = list(
+        DrugLabel.objects.filter(mylabel__isnull=True).values_list(
+            "id", "source", "source_product_number", "version_date", "generic_name"
+        )
+    )
+    labels = {
+        row[0]: MatchLabel(row[0], row[1], frozenset(normalize_generic_name(row[4])))
+        for row in rows
+    }
+    latest = latest_versions(row[:4] for row in rows)
+    candidates = [labels[label_id] for label_id in latest.values()]
+    targets = [labels[label_id] for label_id in set(target_ids) if label_id in labels]
+    vectors = indication_vectors()
+    logger.info(f"scoring {len(targets)} labels against {len(candidates)} products")
+
+    # more than top per target, for the labels that a target is among the best matches of
+    matches = score_matches(targets, candidates, vectors, top * 4, min_score)
+
+    target_set = {target.id for target in targets}
+    candidate_set = {candidate.id for candidate in candidates}
+    reverse = defaultdict(list)
+    for target_id, pairs in matches.items():
+        if target_id not in candidate_set:
+            continue
+        for match_id, name, vector, score in pairs:
+            # the matches of a target are replaced with its own best ones below
+            if match_id not in target_set:
+                reverse[match_id].append((target_id, name, vector, score))
+
+    # labels replaced by a newer version of their product are no longer offered as a match
+    products = {(row[1], row[2]) for row in rows if row[0] in target_set}
+    superseded = [
+        row[0]
+        for row in rows
+        if (row[1], row[2]) in products and latest[(row[1], row[2])] != row[0]
+    ]
+
+    with transaction.atomic():
+        LabelMatch.objects.filter(
+            Q(drug_label__mylabel__isnull=False) | Q(match__mylabel__isnull=False)
+        ).delete()
+        LabelMatch.objects.filter(match_id__in=superseded).delete()
+        LabelMatch.objects.filter(drug_label_id__in=target_set).delete()
+        LabelMatch.objects.bulk_create(
+            [
+                LabelMatch(
+                    drug_label_id=target_id,
+                    match_id=match_id,
+                    name_score=name,
+                    vector_score=vector,
+                    score=score,
+                )
+                for target_id, pairs in matches.items()
+                for match_id, name, vector, score in pairs[:top]
+            ],
+            batch_size=1000,
+        )
+        LabelMatch.objects.bulk_create(
+            [
+                LabelMatch(
+                    drug_label_id=label_id,
+                    match_id=match_id,
+                    name_score=name,
+                    vector_score=vector,
+                    score=score,
+                )
+                for label_id, pairs in reverse.items()
+                for match_id, name, vector, score in pairs
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["drug_label", "match"],
+            update_fields=["name_score", "vector_score", "score", "updated_at"],
+        )
+        # the labels that gained matches keep their top best
+        for label_id in reverse:
+            extra = LabelMatch.objects.filter(drug_label_id=label_id).order_by(
+                "-score", "match_id"
+            )[top:]
+            LabelMatch.objects.filter(id__in=list(extra.values_list("id", flat=True))).delete()
+    return len(matches), len(reverse)
@@ -0,0 +1,184 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gensim.parsing.preprocessing import remove_stopwords
+
+from compare.util import get_diff_for_diff_products
+from data.constants import METACATEGORIES_MAP
+from data.models import ProductSection
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_get_diff_match_tuples(text_arr, common_index_list, value):
+    """get_diff_match_tuples before it used a set"""
+    data = []
+    isCommon = False
+    arr = []
+    length = len(text_arr)
+    for i in range(length):
+        if i in common_index_list:
+            if not isCommon:
+                arr_text = ""
+                for j in arr:
+                    arr_text += text_arr[j] + " "
+                data.append((0, arr_text))
+                isCommon = True
+                arr = []
+        else:
+            if isCommon:
+                arr_text = ""
+                for j in arr:
+                    arr_text += text_arr[j] + " "
+                data.append((value, arr_text))
+                isCommon = False
+                arr = []
+        arr.append(i)
+
+    arr_text = ""
+    for j in arr:
+        arr_text += text_arr[j] + " "
+    data.append((value if isCommon else 0, arr_text))
+    return data
+
+
+def legacy_get_diff_for_diff_products(text1, text2):
+    """get_diff_for_diff_products before the suffix automaton, extending a phrase from every pair of
+    occurrences of each common word"""
+    text1_arr = text1.split(" ")
+    text2_arr = text2.split(" ")
+    text1_dict = {value: key for value, key in enumerate(text1_arr)}
+    text2_dict = {value: key for value, key in enumerate(text2_arr)}
+
+    # texts with stop word removed (swr)
+    text1_swr_arr = remove_stopwords(text1).split(" ")
+    text2_swr_arr = remove_stopwords(text2).split(" ")
+    common_words = set(text1_swr_arr).intersection(text2_swr_arr)
+
+    # get indeces of common words/phrases
+    common_phrases1 = []
+    common_phrases2 = []
+    for word in common_words:
+        listOfKeys1 = [key for (key, value) in text1_dict.items() if value == word]
+        listOfKeys2 = [key for (key, value) in text2_dict.items() if value == word]
+
+        for i in listOfKeys1:
+            for j in listOfKeys2:
+                phrase1 = [i]
+                phrase2 = [j]
+                index1 = i + 1
+                index2 = j + 1
+
+                while index1 < len(text1_arr) and index2 < len(text2_arr):
+                    if text1_arr[index1] == text2_arr[index2]:
+                        phrase1.append(index1)
+                        phrase2.append(index2)
+                        index1 += 1
+                        index2 += 1
+                    else:
+                        break
+
+                index1 = i - 1
+                index2 = j - 1
+                while index1 >= 0 and index2 >= 0:
+                    if text1_arr[index1] == text2_arr[index2]:
+                        phrase1 = [index1] + phrase1
+                        phrase2 = [index2] + phrase2
+                        index1 -= 1
+                        index2 -= 1
+                    else:
+                        break
+
+                # only append if common phrase is more one word long
+                if len(phrase1) > 1:
+                    common_phrases1.append(phrase1)
+                    common_phrases2.append(phrase2)
+
+    flat_common_phrases1 = [item for sublist in common_phrases1 for item in sublist]
+    flat_common_phrases2 = [item for sublist in common_phrases2 for item in sublist]
+
+    diff1 = legacy_get_diff_match_tuples(text1_arr, flat_common_phrases1, -1)
+    diff2 = legacy_get_diff_match_tuples(text2_arr, flat_common_phrases2, 1)
+    return (diff1, diff2)
+
+
+# runs with `python manage.py benchmark_compare_products`
+# add `--metacategory "Warning and Precautions"` to compare other sections
+# add `--pairs 50` to compare more section pairs
+# add `--max_words 0` to not skip long sections, the previous implementation can take minutes on them
+class Command(BaseCommand):
+    help = "Compares get_diff_for_diff_products with the previous implementation on FDA vs EMA sections"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--metacategory",
+            type=str,
+            help="Metacategory of the sections to compare. Default is 'Adverse Reactions'",
+            default="Adverse Reactions",
+        )
+        parser.add_argument(
+            "--pairs", type=int, help="Number of FDA / EMA section pairs. Default is 20", default=20
+        )
+        parser.add_argument(
+            "--max_words",
+            type=int,
+            help="Skip sections longer than this, 0 for no limit. Default is 5000",
+            default=5000,
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if options["metacategory"] not in METACATEGORIES_MAP:
+            raise CommandError(f"Unknown metacategory {options['metacategory']}")
+        names = METACATEGORIES_MAP[options["metacategory"]]
+        texts = {}
+        for source in ["FDA", "EMA"]:
+            sections = ProductSection.objects.filter(
+                label_product__drug_label__source=source, section_name__in=names[source]
+            ).order_by("id")
+            texts[source] = []
+            for text in sections.values_list("section_text", flat=True).iterator():
+                if options["max_words"] and text.count(" ") >= options["max_words"]:
+                    continue
+                texts[source].append(text)
+                if len(texts[source]) >= options["pairs"]:
+                    break
+        pairs = list(zip(texts["FDA"], texts["EMA"]))
+        if not pairs:
+            raise CommandError("No FDA and EMA sections to compare")
+
+        legacy_total, new_total, mismatches = 0, 0, 0
+        for n, (text1, text2) in enumerate(pairs):
+            start = time.perf_counter()
+            expected = legacy_get_diff_for_diff_products(text1, text2)
+            legacy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = get_diff_for_diff_products(text1, text2)
+            new_time = time.perf_counter() - start
+
+            legacy_total += legacy_time
+            new_total += new_time
+            words = (text1.count(" ") + 1, text2.count(" ") + 1)
+            logger.info(f"pair {n}, {words} words: {legacy_time:.3f}s -> {new_time:.4f}s")
+            if result != expected:
+                mismatches += 1
+                logger.error(self.style.ERROR(f"pair {n}: diff differs"))
+
+        self.stdout.write(
+            f"pairs: {len(pairs)}, {legacy_total:.2f}s -> {new_total:.3f}s "
+            f"({legacy_total / max(new_total, 1e-9):.0f}x)"
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
@@ -0,0 +1,80 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from compare.label_matches import refresh_label_matches
+from data.models import SOURCES, DrugLabel
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py precompute_label_matches`
+# add `--agencies EMA,TGA` to only match the labels of some agencies
+# add `--updated_since 2023-05-01T00:00:00` to only match the labels saved since then
+# add `--top 10` to store more matches per label
+# add `--verbosity 2` for info output
+# add `--verbosity 3` for debug output
+class Command(BaseCommand):
+    """Fills the LabelMatch table the compare pickers suggest labels from: for each label, the latest
+    labels of other agencies with the same generic name or the most similar indications.
+    With `--updated_since` only the new labels are scored, and added to the matches of the labels they
+    match, so the command can run after each load. `ingest` runs it for the labels it loads.
+    """
+
+    help = "Precomputes the labels of other agencies that match each drug label"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--agencies",
+            type=str,
+            help="Comma separated agencies, e.g. 'EMA,TGA'. Default is all of them",
+            default=",".join(agency for agency, _ in SOURCES),
+        )
+        parser.add_argument(
+            "--updated_since",
+            type=str,
+            help="Only labels saved since this ISO datetime. Default is all labels",
+            default="",
+        )
+        parser.add_argument(
+            "--top", type=int, help="Matches stored per label. Default is 5", default=5
+        )
+        parser.add_argument(
+            "--min_score",
+            type=float,
+            help="Lowest score of a stored match, from 0 to 1. Default is 0.35",
+            default=0.35,
+        )
+
+    def handle(self, *args, **options):
+        # basic logging config is in settings.py
+        # verbosity is 1 by default, gives critical, error and warning output
+        # `--verbosity 2` gives info output
+        # `--verbosity 3` gives debug output
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if options["top"] < 1:
+            raise CommandError("'top' must be at least 1")
+        agencies = [a.strip() for a in options["agencies"].split(",") if a.strip()]
+        labels = DrugLabel.objects.filter(source__in=agencies)
+        if options["updated_since"]:
+            updated_since = parse_datetime(options["updated_since"])
+            if updated_since is None:
+                raise CommandError("'updated_since' must be an ISO datetime")
+            labels = labels.filter(updated_at__gte=updated_since)
+
+        logger.info(self.style.SUCCESS("start process"))
+        num_matched, num_updated = refresh_label_matches(
+            labels.values_list("id", flat=True), options["top"], options["min_score"]
+        )
+        logger.info(
+            f"matched {num_matched} labels, added them to the matches of {num_updated} other labels"
+        )
+        logger.info(self.style.SUCCESS("process complete"))
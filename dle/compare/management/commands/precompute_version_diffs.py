@@ -0,0 +1,92 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from compare.util import get_cached_diffs_for_diff_versions, get_version_sections
+from data.models import SOURCES, DrugLabel
+from data.services import get_label_sections
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py precompute_version_diffs`
+# add `--agencies EMA,TGA` to only precompute the diffs of some agencies
+# add `--updated_since 2023-05-01T00:00:00` to only precompute the diffs of products with labels saved since then
+# add `--verbosity 2` for info output
+# add `--verbosity 3` for debug output
+class Command(BaseCommand):
+    """Fills the SectionDiff cache for `compare_versions` with the diffs between consecutive versions of each
+    product (same source and source_product_number, ordered by version_date).
+    Diffs that are already cached are only looked up, so the command can be re-run at any time.
+    `ingest` runs it for the products it loads, the diffs of other pairs are computed on first view.
+    """
+
+    help = "Precomputes the section diffs between consecutive versions of each drug label"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--agencies",
+            type=str,
+            help="Comma separated agencies, e.g. 'EMA,TGA'. Default is all of them",
+            default=",".join(agency for agency, _ in SOURCES),
+        )
+        parser.add_argument(
+            "--updated_since",
+            type=str,
+            help="Only products with a label saved since this ISO datetime. Default is all products",
+            default="",
+        )
+
+    def handle(self, *args, **options):
+        # basic logging config is in settings.py
+        # verbosity is 1 by default, gives critical, error and warning output
+        # `--verbosity 2` gives info output
+        # `--verbosity 3` gives debug output
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        agencies = [a.strip() for a in options["agencies"].split(",") if a.strip()]
+        labels = DrugLabel.objects.filter(source__in=agencies)
+        if options["updated_since"]:
+            updated_since = parse_datetime(options["updated_since"])
+            if updated_since is None:
+                raise CommandError("'updated_since' must be an ISO datetime")
+            labels = labels.filter(updated_at__gte=updated_since)
+
+        logger.info(self.style.SUCCESS("start process"))
+        products = labels.values_list("source", "source_product_number").distinct()
+        num_pairs = 0
+        num_sections = 0
+        for source, source_product_number in products.iterator():
+            versions = list(
+                DrugLabel.objects.filter(
+                    source=source, source_product_number=source_product_number
+                ).order_by("version_date")
+            )
+            label_sections = get_label_sections(versions)
+            for drug_label1, drug_label2 in zip(versions, versions[1:]):
+                sections = get_version_sections(
+                    label_sections[drug_label1.id], label_sections[drug_label2.id]
+                ).values()
+                try:
+                    get_cached_diffs_for_diff_versions(
+                        [(sec["section_text1"], sec["section_text2"]) for sec in sections]
+                    )
+                except Exception as e:
+                    logger.error(
+                        self.style.ERROR(
+                            f"Failed to diff {drug_label1.id} and {drug_label2.id}: {repr(e)}"
+                        )
+                    )
+                    continue
+                num_pairs += 1
+                num_sections += len(sections)
+
+        logger.info(f"diffed {num_pairs} version pairs, {num_sections} sections")
+        logger.info(self.style.SUCCESS("process complete"))
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectionDiff',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('text1_sha256', models.CharField(max_length=64)),
+                ('text2_sha256', models.CharField(max_length=64)),
+                ('diff', models.BinaryField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sectiondiff',
+            constraint=models.UniqueConstraint(fields=('text1_sha256', 'text2_sha256'), name='unique_section_diff'),
+        ),
+    ]
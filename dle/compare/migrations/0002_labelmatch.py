@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0018_indexgeneration'),
+        ('compare', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabelMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name_score', models.FloatField()),
+                ('vector_score', models.FloatField(null=True)),
+                ('score', models.FloatField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('drug_label', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='label_matches', to='data.druglabel')),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='data.druglabel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['drug_label', '-score'], name='label_match_score')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='labelmatch',
+            constraint=models.UniqueConstraint(fields=('drug_label', 'match'), name='unique_label_match'),
+        ),
+    ]
@@ -1,3 +1,53 @@
-# from django.db import models
+from django.db import models
 
-# from data.models import *
+from data.models import DrugLabel
+
+
+class SectionDiff(models.Model):
+    """Cached diff of two section texts for `compare_versions`
+    - keyed by the sha256 of the two section texts, so the diff is shared by every pair of labels with the
+      same sections and never goes stale: a changed section has a new key
+    - `diff` is the zlib compressed JSON of the (diff1, diff2) pair returned by `get_diff_for_diff_versions`
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    text1_sha256 = models.CharField(max_length=64)
+    text2_sha256 = models.CharField(max_length=64)
+    diff = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["text1_sha256", "text2_sha256"], name="unique_section_diff"
+            ),
+        ]
+
+    def __str__(self):
+        return f"SectionDiff {self.text1_sha256[:8]} -> {self.text2_sha256[:8]}"
+
+
+class LabelMatch(models.Model):
+    """A label of another agency that is likely the same medicine, suggested by the compare pickers
+    Stored by `precompute_label_matches`, see compare.label_matches
+    - name_score: overlap of the normalized generic names, 1.0 when they are the same
+    - vector_score: cosine similarity of the two labels' indication sections, null if one has none vectorized
+    - score: the two combined, a label's matches are ranked by it
+    """
+
+    drug_label = models.ForeignKey(
+        DrugLabel, on_delete=models.CASCADE, related_name="label_matches"
+    )
+    match = models.ForeignKey(DrugLabel, on_delete=models.CASCADE, related_name="+")
+    name_score = models.FloatField()
+    vector_score = models.FloatField(null=True)
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["drug_label", "match"], name="unique_label_match"),
+        ]
+        indexes = [models.Index(fields=["drug_label", "-score"], name="label_match_score")]
+
+    def __str__(self):
+        return f"LabelMatch {self.drug_label_id} -> {self.match_id} ({self.score:.2f})"
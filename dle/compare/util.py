@@ -1,6 +1,15 @@
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+
+import bleach
 import diff_match_patch as dmp_module
 from gensim.parsing.preprocessing import remove_stopwords
 
+from .models import SectionDiff
+
 
 # Sorting of FDA sections/subsections as they appear on
 # an FDA Prescribing Information
@@ -46,6 +55,8 @@ SECTIONS_ORDER = [
 
 def get_diff_for_diff_versions(text1, text2):
     dmp = dmp_module.diff_match_patch()
+    # past the timeout diff_main returns a valid but coarser diff, so a pathological pair can't pin a worker
+    dmp.Diff_Timeout = settings.COMPARE_DIFF_TIMEOUT
     diff = dmp.diff_main(text1, text2)
     dmp.diff_cleanupSemantic(diff)
 
@@ -60,90 +71,199 @@ def get_diff_for_diff_versions(text1, text2):
     return (diff1, diff2)
 
 
+def get_version_sections(sections1, sections2):
+    """The sections of two versions of a label, by section name
+    Args:
+        sections1, sections2: {section_name: section_text} of each label, see data.services.get_label_sections
+    Returns: dict of {section_name: {"section_name", "section_text1", "section_text2"}}, a section missing from
+        one of the labels has "No text found for this section." as its text
+    """
+    sections_dict = {}
+    for section_name, section_text in sections1.items():
+        sections_dict[section_name] = {
+            "section_name": section_name,
+            "section_text1": section_text,
+            "section_text2": "No text found for this section.",
+        }
+
+    for section_name, section_text in sections2.items():
+        if section_name in sections_dict.keys():
+            sections_dict[section_name]["section_text2"] = section_text
+        else:
+            sections_dict[section_name] = {
+                "section_name": section_name,
+                "section_text1": "No text found for this section.",
+                "section_text2": section_text,
+            }
+    return sections_dict
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack_diff(diff1, diff2):
+    """Compress a (diff1, diff2) pair for SectionDiff.diff"""
+    return zlib.compress(json.dumps([diff1, diff2], separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_diff(data):
+    """Inverse of pack_diff, JSON has no tuples so the (op, text) tuples are rebuilt"""
+    diff1, diff2 = json.loads(zlib.decompress(bytes(data)))
+    return [tuple(t) for t in diff1], [tuple(t) for t in diff2]
+
+
+def diff_texts_match(diff1, diff2):
+    """True if the diffed texts were the same, i.e. the diff has no insertions or deletions"""
+    return all(op == 0 for op, _ in diff1) and all(op == 0 for op, _ in diff2)
+
+
+def get_cached_diffs_for_diff_versions(text_pairs):
+    """get_diff_for_diff_versions of the bleach cleaned texts, for a list of (text1, text2) section texts
+    The diffs are looked up in SectionDiff with one query, only the missing ones are computed and saved.
+    Returns: list of (diff1, diff2), in the order of text_pairs
+    """
+    keys = [(text_sha256(text1), text_sha256(text2)) for text1, text2 in text_pairs]
+    cached = {}
+    if settings.COMPARE_DIFF_CACHE and keys:
+        rows = SectionDiff.objects.filter(
+            text1_sha256__in={k[0] for k in keys}, text2_sha256__in={k[1] for k in keys}
+        ).values_list("text1_sha256", "text2_sha256", "diff")
+        cached = {(sha1, sha2): unpack_diff(diff) for sha1, sha2, diff in rows}
+
+    diffs, new_diffs = [], {}
+    for key, (text1, text2) in zip(keys, text_pairs):
+        if key not in cached:
+            cached[key] = get_diff_for_diff_versions(
+                bleach.clean(text1, strip=True), bleach.clean(text2, strip=True)
+            )
+            new_diffs[key] = cached[key]
+        diffs.append(cached[key])
+
+    if settings.COMPARE_DIFF_CACHE and new_diffs:
+        # another request may have saved the same diff in the meantime
+        SectionDiff.objects.bulk_create(
+            [
+                SectionDiff(text1_sha256=sha1, text2_sha256=sha2, diff=pack_diff(*diff))
+                for (sha1, sha2), diff in new_diffs.items()
+            ],
+            ignore_conflicts=True,
+        )
+    return diffs
+
+
 def get_diff_match_tuples(text_arr, common_index_list, value):
+    common_indices = set(common_index_list)
     data = []
     isCommon = False
-    arr = []
+    # start of the current run of common / not common words
+    start = 0
     length = len(text_arr)
     for i in range(length):
-        if i in common_index_list:
-            if not isCommon:
-                arr_text = ""
-                for j in arr:
-                    arr_text += text_arr[j] + " "
-                data.append((0, arr_text))
-                isCommon = True
-                arr = []
-        else:
-            if isCommon:
-                arr_text = ""
-                for j in arr:
-                    arr_text += text_arr[j] + " "
-                data.append((value, arr_text))
-                isCommon = False
-                arr = []
-        arr.append(i)
-
-    arr_text = ""
-    for j in arr:
-        arr_text += text_arr[j] + " "
+        if (i in common_indices) != isCommon:
+            # the run of common words is marked with `value`, the rest with 0
+            arr_text = "".join(word + " " for word in text_arr[start:i])
+            data.append((value if isCommon else 0, arr_text))
+            isCommon = not isCommon
+            start = i
+
+    arr_text = "".join(word + " " for word in text_arr[start:])
     data.append((value if isCommon else 0, arr_text))
     return data
 
 
+class SuffixAutomaton:
+    """Suffix automaton of a sequence of words, recognises every substring of it.
+    Built in linear time, see https://cp-algorithms.com/string/suffix-automaton.html
+    """
+
+    def __init__(self, words):
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        last = 0
+        for word in words:
+            cur = self._add_state(self.length[last] + 1)
+            p = last
+            while p != -1 and word not in self.next[p]:
+                self.next[p][word] = cur
+                p = self.link[p]
+            if p == -1:
+                self.link[cur] = 0
+            else:
+                q = self.next[p][word]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = self._add_state(self.length[p] + 1)
+                    self.next[clone] = dict(self.next[q])
+                    self.link[clone] = self.link[q]
+                    while p != -1 and self.next[p].get(word) == q:
+                        self.next[p][word] = clone
+                        p = self.link[p]
+                    self.link[q] = clone
+                    self.link[cur] = clone
+            last = cur
+
+    def _add_state(self, length):
+        self.next.append({})
+        self.link.append(-1)
+        self.length.append(length)
+        return len(self.length) - 1
+
+    def match_lengths(self, words):
+        """For each position of words, the length of the longest run of words ending there that is also
+        in the automaton's sequence"""
+        lengths = []
+        state, length = 0, 0
+        for word in words:
+            while state and word not in self.next[state]:
+                state = self.link[state]
+                length = self.length[state]
+            if word in self.next[state]:
+                state = self.next[state][word]
+                length += 1
+            else:
+                state, length = 0, 0
+            lengths.append(length)
+        return lengths
+
+
+def get_common_phrase_indices(text1_arr, text2_arr, seed_words):
+    """Indices of the words of text1_arr in a phrase of 2 or more words that is also in text2_arr,
+    and that has at least one word of seed_words.
+    Runs in linear time: the suffix automaton of text2_arr gives the longest common phrase ending at each
+    word of text1_arr, and every shorter common phrase ending there is inside it.
+    """
+    lengths = SuffixAutomaton(text2_arr).match_lengths(text1_arr)
+    # number of seed words before each index
+    seeds_before = [0]
+    for word in text1_arr:
+        seeds_before.append(seeds_before[-1] + (word in seed_words))
+
+    common_indices = set()
+    covered_until = 0
+    for end, length in enumerate(lengths):
+        start = end - length + 1
+        if length > 1 and seeds_before[end + 1] > seeds_before[start]:
+            common_indices.update(range(max(start, covered_until), end + 1))
+            covered_until = end + 1
+    return common_indices
+
+
 def get_diff_for_diff_products(text1, text2):
     text1_arr = text1.split(" ")
     text2_arr = text2.split(" ")
-    text1_dict = {value: key for value, key in enumerate(text1_arr)}
-    text2_dict = {value: key for value, key in enumerate(text2_arr)}
 
     # texts with stop word removed (swr)
     text1_swr_arr = remove_stopwords(text1).split(" ")
     text2_swr_arr = remove_stopwords(text2).split(" ")
     common_words = set(text1_swr_arr).intersection(text2_swr_arr)
 
-    # get indeces of common words/phrases
-    common_phrases1 = []
-    common_phrases2 = []
-    for word in common_words:
-        listOfKeys1 = [key for (key, value) in text1_dict.items() if value == word]
-        listOfKeys2 = [key for (key, value) in text2_dict.items() if value == word]
-
-        for i in listOfKeys1:
-            for j in listOfKeys2:
-                phrase1 = [i]
-                phrase2 = [j]
-                index1 = i + 1
-                index2 = j + 1
-
-                while index1 < len(text1_arr) and index2 < len(text2_arr):
-                    if text1_arr[index1] == text2_arr[index2]:
-                        phrase1.append(index1)
-                        phrase2.append(index2)
-                        index1 += 1
-                        index2 += 1
-                    else:
-                        break
-
-                index1 = i - 1
-                index2 = j - 1
-                while index1 >= 0 and index2 >= 0:
-                    if text1_arr[index1] == text2_arr[index2]:
-                        phrase1 = [index1] + phrase1
-                        phrase2 = [index2] + phrase2
-                        index1 -= 1
-                        index2 -= 1
-                    else:
-                        break
-
-                # only append if common phrase is more one word long
-                if len(phrase1) > 1:
-                    common_phrases1.append(phrase1)
-                    common_phrases2.append(phrase2)
-
-    flat_common_phrases1 = [item for sublist in common_phrases1 for item in sublist]
-    flat_common_phrases2 = [item for sublist in common_phrases2 for item in sublist]
-
-    diff1 = get_diff_match_tuples(text1_arr, flat_common_phrases1, -1)
-    diff2 = get_diff_match_tuples(text2_arr, flat_common_phrases2, 1)
+    # common phrases are runs of 2 or more words in both texts with at least one common word
+    common_phrases1 = get_common_phrase_indices(text1_arr, text2_arr, common_words)
+    common_phrases2 = get_common_phrase_indices(text2_arr, text1_arr, common_words)
+
+    diff1 = get_diff_match_tuples(text1_arr, common_phrases1, -1)
+    diff2 = get_diff_match_tuples(text2_arr, common_phrases2, 1)
     return (diff1, diff2)
@@ -1,16 +1,22 @@
-from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpRequest, HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import render
 
 import bleach
 
-from data.models import *
+from data.services import get_labels_or_404, get_rendered_sections, order_sections
 from data.util import *
 
 from .models import *
 from .util import *
 
 
+def render_compare_section(search_text):
+    def render_section(drug_label, text):
+        return highlight_query_string(bleach.clean(text, strip=True), search_text)
+
+    return render_section
+
+
 def compare_labels(request: HttpRequest) -> HttpResponse:
     """Compare 2 or 3 different drug labels view
     Args:
@@ -18,90 +24,39 @@ def compare_labels(request: HttpRequest) -> HttpResponse:
     Returns:
         HttpResponse: Side-by-side view of 2 or 3 drug labels for each section
     """
-    drug_label1 = get_object_or_404(DrugLabel, id=request.GET["first-label"])
-    drug_label2 = get_object_or_404(DrugLabel, id=request.GET["second-label"])
+    drug_label_ids = [request.GET["first-label"], request.GET["second-label"]]
+    if "third-label" in request.GET:
+        drug_label_ids.append(request.GET["third-label"])
+    drug_labels = get_labels_or_404(drug_label_ids)
     search_text = request.GET["search_text"]
 
-    try:
-        label_product1 = LabelProduct.objects.filter(drug_label=drug_label1).first()
-        dl1_sections = ProductSection.objects.filter(label_product=label_product1)
-    except ObjectDoesNotExist:
-        dl1_sections = []
-
-    try:
-        label_product2 = LabelProduct.objects.filter(drug_label=drug_label2).first()
-        dl2_sections = ProductSection.objects.filter(label_product=label_product2)
-    except ObjectDoesNotExist:
-        dl2_sections = []
+    context = {f"dl{n}": dl for n, dl in enumerate(drug_labels, start=1)}
+    # the cleaned and highlighted sections are cached per label and search text
+    label_sections = get_rendered_sections(
+        drug_labels, f"compare:{search_text}", render_compare_section(search_text)
+    )
 
-    context = {"dl1": drug_label1, "dl2": drug_label2}
     sections_dict = {}
-
-    for section in dl1_sections:
-        text = bleach.clean(section.section_text, strip=True)
-        sections_dict[section.section_name] = {
-            "section_name": section.section_name,
-            "section_text1": highlight_query_string(text, search_text),
-            "section_text2": "No text found for this section.",
-            "isCommon": "not-common-section",
-        }
-
-    for section in dl2_sections:
-        text = bleach.clean(section.section_text, strip=True)
-        if section.section_name in sections_dict.keys():
-            sections_dict[section.section_name]["section_text2"] = highlight_query_string(
-                text, search_text
-            )
-            sections_dict[section.section_name]["isCommon"] = "common-section"
-        else:
-            sections_dict[section.section_name] = {
-                "section_name": section.section_name,
-                "section_text1": "No text found for this section.",
-                "section_text2": highlight_query_string(text, search_text),
-                "isCommon": "not-common-section",
-            }
-
-    if "third-label" in request.GET:
-        drug_label3 = get_object_or_404(DrugLabel, id=request.GET["third-label"])
-        try:
-            label_product3 = LabelProduct.objects.filter(drug_label=drug_label3).first()
-            dl3_sections = ProductSection.objects.filter(label_product=label_product3)
-            context["dl3"] = drug_label3
-
-            for section_name in sections_dict.keys():
-                sections_dict[section_name]["section_text3"] = "No text found for this section."
-
-            for section in dl3_sections:
-                text = bleach.clean(section.section_text, strip=True)
-                if section.section_name in sections_dict.keys():
-                    sections_dict[section.section_name]["section_text3"] = highlight_query_string(
-                        text, search_text
-                    )
-                    sections_dict[section.section_name]["isCommon"] = "common-section"
-                else:
-                    sections_dict[section.section_name] = {
-                        "section_name": section.section_name,
-                        "section_text1": "No text found for this section.",
-                        "section_text2": "No text found for this section.",
-                        "section_text3": highlight_query_string(text, search_text),
-                        "isCommon": "not-common-section",
-                    }
-
-        except ObjectDoesNotExist:
-            dl3_sections = []
+    for n, dl in enumerate(drug_labels, start=1):
+        for section_name, text in label_sections[dl.id].items():
+            if section_name in sections_dict.keys():
+                sections_dict[section_name][f"section_text{n}"] = text
+                sections_dict[section_name]["isCommon"] = "common-section"
+            else:
+                sections_dict[section_name] = {
+                    "section_name": section_name,
+                    **{
+                        f"section_text{i}": "No text found for this section."
+                        for i in range(1, len(drug_labels) + 1)
+                    },
+                    f"section_text{n}": text,
+                    "isCommon": "not-common-section",
+                }
 
     section_names_list = list(sections_dict.keys())
     section_names_list.sort()
     context["section_names"] = section_names_list
-    context["sections"] = []
-
-    for sec_name in SECTIONS_ORDER:
-        if sec_name in sections_dict.keys():
-            context["sections"].append(sections_dict[sec_name])
-
-    for key, val in sections_dict.items():
-        if key not in SECTIONS_ORDER:
-            context["sections"].append(val)
+    context["sections"] = order_sections(sections_dict)
 
     return render(request, "compare/compare_labels.html", context)
 
@@ -113,68 +68,33 @@ def compare_versions(request):
     Returns:
         HttpResponse: Side-by-side view diff view of 2 labels
     """
-    # get DrugLabel matching product_name and version_date
-    drug_label1 = get_object_or_404(DrugLabel, id=request.GET["first-label"])
-    drug_label2 = get_object_or_404(DrugLabel, id=request.GET["second-label"])
-
-    try:
-        label_product1 = LabelProduct.objects.filter(drug_label=drug_label1).first()
-        dl1_sections = ProductSection.objects.filter(label_product=label_product1)
-    except ObjectDoesNotExist:
-        dl1_sections = []
-
-    try:
-        label_product2 = LabelProduct.objects.filter(drug_label=drug_label2).first()
-        dl2_sections = ProductSection.objects.filter(label_product=label_product2)
-    except ObjectDoesNotExist:
-        dl2_sections = []
+    drug_label1, drug_label2 = get_labels_or_404(
+        [request.GET["first-label"], request.GET["second-label"]]
+    )
 
     context = {"dl1": drug_label1, "dl2": drug_label2}
-    sections_dict = {}
-
-    for section in dl1_sections:
-        sections_dict[section.section_name] = {
-            "section_name": section.section_name,
-            "section_text1": section.section_text,
-            "section_text2": "No text found for this section.",
-        }
-
-    for section in dl2_sections:
-        if section.section_name in sections_dict.keys():
-            sections_dict[section.section_name]["section_text2"] = section.section_text
-        else:
-            sections_dict[section.section_name] = {
-                "section_name": section.section_name,
-                "section_text1": "No text found for this section.",
-                "section_text2": section.section_text,
-            }
+    label_sections = get_rendered_sections([drug_label1, drug_label2])
+    sections_dict = get_version_sections(
+        label_sections[drug_label1.id], label_sections[drug_label2.id]
+    )
 
     # compare each section and insert data in context.sections
-    for sec_name in sections_dict.keys():
-        text1 = bleach.clean(sections_dict[sec_name]["section_text1"], strip=True)
-        text2 = bleach.clean(sections_dict[sec_name]["section_text2"], strip=True)
-
-        diff1, diff2 = get_diff_for_diff_versions(text1, text2)
-        sections_dict[sec_name]["section_text1"] = diff1
-        sections_dict[sec_name]["section_text2"] = diff2
+    # the diffs are cached, see `precompute_version_diffs`
+    text_pairs = [(sec["section_text1"], sec["section_text2"]) for sec in sections_dict.values()]
+    diffs = get_cached_diffs_for_diff_versions(text_pairs)
+    for sec, (diff1, diff2) in zip(sections_dict.values(), diffs):
+        sec["section_text1"] = diff1
+        sec["section_text2"] = diff2
 
         # compare if sections are exact match (maybe not necessary to highlight all sections)
-        if text1 == text2:
-            sections_dict[sec_name]["textMatches"] = "matching-section"
+        if diff_texts_match(diff1, diff2):
+            sec["textMatches"] = "matching-section"
         else:
-            sections_dict[sec_name]["textMatches"] = "diff-section"
+            sec["textMatches"] = "diff-section"
 
     section_names_list = list(sections_dict.keys())
     section_names_list.sort()
     context["section_names"] = section_names_list
-    context["sections"] = []
-
-    for sec_name in SECTIONS_ORDER:
-        if sec_name in sections_dict.keys():
-            context["sections"].append(sections_dict[sec_name])
-
-    for key, val in sections_dict.items():
-        if key not in SECTIONS_ORDER:
-            context["sections"].append(val)
+    context["sections"] = order_sections(sections_dict)
 
     return render(request, "compare/compare_versions.html", context)
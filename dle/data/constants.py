@@ -1,5 +1,111 @@
 LASTEST_DRUG_LABELS_TABLE = "latest_drug_labels"
 
+# Canonical section names the loaders fix parsed PDF headers to, see data/section_matcher.py
+EMA_SECTION_NAMES = [
+    "Clinical Particulars",
+    "Contraindications",
+    "Date Of First Authorisation/Renewal Of The Authorisation",
+    "Date Of Revision Of The Text",
+    "Effects On Ability To Drive And Use Machines",
+    "Fertility, Pregnancy And Lactation",
+    "Incompatibilities",
+    "Interaction With Other Medicinal Products And Other Forms Of Interaction",
+    "List Of Excipients",
+    "Marketing Authorisation Holder",
+    "Marketing Authorisation Number",
+    "Name Of The Medicinal Product",
+    "Nature And Contents Of Container",
+    "Overdose",
+    "Pharmaceutical Form",
+    "Pharmaceutical Particulars",
+    "Pharmacodynamic Properties",
+    "Pharmacokinetic Properties",
+    "Pharmacological Properties",
+    "Posology And Method Of Administration",
+    "Preclinical Safety Data",
+    "Pregnancy And Lactation",
+    "Qualitative And Quantitative Composition",
+    "Shelf Life",
+    "Special Precautions For Disposal",
+    "Special Precautions For Disposal And Other Handling",
+    "Special Precautions For Storage",
+    "Special Warnings And Precautions For Use",
+    "Therapeutic Indications",
+    "Undesirable Effects",
+]
+# note: maybe we should manually merge these pairs (EMA and TGA):
+#   FERTILITY, PREGNANCY AND LACTATION
+#   PREGNANCY AND LACTATION
+#   SPECIAL PRECAUTIONS FOR DISPOSAL AND OTHER HANDLING
+#   SPECIAL PRECAUTIONS FOR DISPOSAL
+# but not doing so lets the similarity computation do its thing
+TGA_SECTION_NAMES = [
+    "Clinical Particulars",
+    "Contraindications",
+    "Date Of First Approval",
+    "Date Of Revision",
+    "Effects On Ability To Drive And Use Machines",
+    "Fertility, Pregnancy And Lactation",
+    "Incompatibilities",
+    "Interaction With Other Medicinal Products And Other Forms Of Interaction",
+    "List Of Excipients",
+    "Marketing Authorisation Holder",
+    "Marketing Authorisation Number",
+    "Name Of The Medicinal Product",
+    "Nature And Contents Of Container",
+    "Overdose",
+    "Pharmaceutical Form",
+    "Pharmaceutical Particulars",
+    "Pharmacodynamic Properties",
+    "Pharmacokinetic Properties",
+    "Pharmacological Properties",
+    "Posology And Method Of Administration",
+    "Preclinical Safety Data",
+    "Pregnancy And Lactation",
+    "Qualitative And Quantitative Composition",
+    "Shelf Life",
+    "Special Precautions For Disposal",
+    "Special Precautions For Disposal And Other Handling",
+    "Special Precautions For Storage",
+    "Special Warnings And Precautions For Use",
+    "Therapeutic Indications",
+    "Undesirable Effects",
+    "Description",
+    "Pharmacology",
+    "Indications",
+    "Precautions",
+    "Interaction With Other Medicines",
+    "Name and address of the sponsor",
+    "Correction to the Medicine Schedule",
+    "Dosage and Administration",
+    "Date Of Most Recent Amendment",
+]
+HC_SECTION_NAMES = [
+    "Indications",
+    "Indications and Clinical Use",
+    "Contraindications",
+    "Serious Warnings and Precautions Box",
+    "Dosage And Administration",
+    "Overdosage",
+    "Dosage Forms, Strenths, Composition, and Packaging",
+    "Warnings and Precautions",
+    "Warnings",
+    "Precautions",
+    "Adverse Reactions",
+    "Drug Interactions",
+    "Clinical Pharmacology",
+    "Storage, Stability and Disposal",
+    "Special Handling Instructions",
+    "Pharmaceutical Information",
+    "Clinical Trials",
+    "Microbiology",
+    "Non-clinical Toxicology",
+    "Supporting Product Monographs",
+    "Summary Product Information",
+    "Toxicology",
+    "Description",
+]
+
 # Metacategories for mapping sections across countries
 # Format:
 # {"metacategory1": {"EMA": [sections], "FDA": [sections], "TGA": [sections], "HC": [sections]},
@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+
+
+class QueryHighlighter:
+    """Highlights the terms of a search query in section texts.
+    Built once per query (see `get_highlighter`) and reused for every section:
+    - terms are matched literally and case insensitively, so regex metacharacters in a query are just text
+    - the text is lowercased once and each distinct term is found with str.find, overlapping occurrences
+      included; CPython's literal search is faster than one scan with a regex alternation of the terms
+    - overlapping and adjacent matches are merged, so each highlighted span is wrapped once
+    - the output is assembled with one join
+    """
+
+    def __init__(self, terms: tuple[str, ...]):
+        # longest first, so the alternation of the fallback pattern prefers the longest term
+        self.terms = sorted({term.lower() for term in terms if term}, key=len, reverse=True)
+        self.term_set = set(self.terms)
+        self.pattern = None
+        if self.terms:
+            alternation = "|".join(re.escape(term) for term in self.terms)
+            self.pattern = re.compile(f"(?=({alternation}))", re.IGNORECASE)
+
+    def spans(self, text: str) -> list[tuple[int, int]]:
+        """The merged (start, end) spans of the terms in the text"""
+        if not self.terms:
+            return []
+        text_lower = text.lower()
+        matches = []
+        if len(text_lower) == len(text):
+            for term in self.terms:
+                start = text_lower.find(term)
+                while start != -1:
+                    matches.append((start, start + len(term)))
+                    start = text_lower.find(term, start + 1)
+            matches.sort()
+        else:
+            # lowercasing changed the length of some characters, so positions in text_lower are not
+            # positions in text; the lookahead gives the longest term starting at each position
+            matches = [match.span(1) for match in self.pattern.finditer(text)]
+
+        spans = []
+        for start, end in matches:
+            if spans and start <= spans[-1][1]:
+                if end > spans[-1][1]:
+                    spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+        return spans
+
+    def highlight(self, text: str, before: str, after: str) -> tuple[str, bool]:
+        """Wraps each span of the terms in before / after
+        Returns: the highlighted text, and True if a term was found
+        """
+        spans = self.spans(text)
+        if not spans:
+            return text, False
+        parts = []
+        last = 0
+        for start, end in spans:
+            parts += [text[last:start], before, text[start:end], after]
+            last = end
+        parts.append(text[last:])
+        return "".join(parts), True
+
+    def find_token(self, text: str) -> tuple[int, int] | None:
+        """The (start, end) of the first whitespace separated token that is one of the terms, ignoring case"""
+        text_lower = text.lower()
+        if len(text_lower) != len(text):
+            for match in re.finditer(r"\S+", text):
+                if match.group().lower() in self.term_set:
+                    return match.span()
+            return None
+
+        first = None
+        for term in self.terms:
+            start = text_lower.find(term)
+            while start != -1 and (first is None or start < first[0]):
+                end = start + len(term)
+                if (start == 0 or text[start - 1].isspace()) and (
+                    end == len(text) or text[end].isspace()
+                ):
+                    first = (start, end)
+                    break
+                start = text_lower.find(term, start + 1)
+        return first
+
+    def highlight_tokens(self, text: str, before: str, after: str) -> tuple[str, bool]:
+        """Wraps the whitespace separated tokens that are one of the terms, ignoring case, in before / after
+        Returns: the tokens joined with single spaces, and True if a token was highlighted
+        """
+        tokens = text.split()
+        highlighted = False
+        for index, token in enumerate(tokens):
+            if token.lower() in self.term_set:
+                tokens[index] = before + token + after
+                highlighted = True
+        return " ".join(tokens), highlighted
+
+
+@lru_cache(maxsize=256)
+def get_highlighter(terms: tuple[str, ...]) -> QueryHighlighter:
+    return QueryHighlighter(terms)
+
+
+def get_query_terms(qstring: str) -> tuple[str, ...]:
+    """Splits a query string from the search result page into the terms to highlight
+    A query in double or single quotes is one term, otherwise each word is a term
+    """
+    if len(qstring) > 1 and qstring[0] == qstring[-1] and qstring[0] in "\"'":
+        return (qstring[1:-1],)
+    return tuple(qstring.split())
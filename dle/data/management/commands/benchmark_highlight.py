@@ -0,0 +1,209 @@
+import logging
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Length
+
+from data.models import ProductSection
+from data.util import highlight_query_string
+from search.search_constants import MAX_LENGTH_SEARCH_RESULT_DISPLAY
+from search.services import build_snippet, highlight_text_by_term
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_highlight_query_string(text: str, qstring: str) -> str:
+    """
+    highlight_query_string before compile_highlight_pattern, one regex scan per query term variant
+    Args:
+        text: Section raw text from db
+        qstring: A query string from search result page (could be in single/doubl quotes)
+    Returns:
+        str: A text with the query term highlighted (put b/n <span> tags)
+    """
+    text_lower = text.lower()
+
+    # if qstring is empty, return text as is
+    if qstring == "":
+        return text
+
+    # if qstring in double quotes, find & highligh full query str
+    if qstring.startswith('"') and qstring.endswith('"'):
+        qlist = [qstring[1:-1]]
+
+    # if qstring in single quotes, find & highligh full query str
+    elif qstring.startswith("'") and qstring.endswith("'"):
+        qlist = [qstring[1:-1]]
+
+    # else highlight each word in the query str, separatly
+    else:
+        qlist = qstring.split()
+
+    # include upper, title, capitalized cases of the query strings
+    qlist += (
+        [qterm.upper() for qterm in qlist]
+        + [qterm.capitalize() for qterm in qlist]
+        + [qterm.title() for qterm in qlist]
+    )
+
+    # get (index, "qterm") tuples in the input text
+    positions = []
+    for qterm in set(qlist):
+        positions += [(_.start(), qterm) for _ in re.finditer(qterm, text_lower)]
+
+    if positions == []:
+        return text
+
+    positions.sort()
+    # iterate through positions and insert <span> tags in text
+    output_text = ""
+    length = len(positions)
+    start = 0
+    end = positions[0][0]
+
+    for i in range(length):
+        output_text += text[start:end]
+        output_text += "<span style='background-color:yellow'>"
+        output_text += positions[i][1]
+        output_text += "</span>"
+        start = end + len(positions[i][1])
+        if i < length - 1:
+            end = positions[i + 1][0]
+
+    output_text += text[start : len(text)]
+
+    return output_text
+
+
+def legacy_highlight_text_by_term(text, search_term):
+    """highlight_text_by_term before compile_highlight_pattern, comparing every token to every word"""
+    if not text:
+        return "", False
+    tokens = text.split()
+    comparison_token = set(search_term.lower().split())
+    highlighted = False
+
+    for index, token in enumerate(tokens):
+        lower_token = token.lower()
+        for comp in comparison_token:
+            if lower_token == comp:
+                tokens[index] = "<b>" + tokens[index] + "</b>"
+                highlighted = True
+
+    return " ".join(tokens), highlighted
+
+
+def legacy_build_snippet(naked_text, search_term):
+    """The snippet of build_search_result before build_snippet, highlighting 300 character windows in turn"""
+    step = MAX_LENGTH_SEARCH_RESULT_DISPLAY
+    for i in range(0, len(naked_text), step):
+        text = naked_text[i : i + step]
+        highlighted_text, did_highlight = legacy_highlight_text_by_term(text, search_term)
+        if did_highlight:
+            return highlighted_text, did_highlight
+    return naked_text[:step], False
+
+
+# the previous highlight_query_string put the query term in the span rather than the matched text,
+# so its output is compared to the new one lowercased
+# snippets are cut around the first match rather than in fixed windows, so only finding a match is compared;
+# the fixed windows can miss a match they cut in two
+CASES = {
+    "highlight_query_string": (
+        legacy_highlight_query_string,
+        highlight_query_string,
+        lambda result: result.lower(),
+    ),
+    "highlight_text_by_term": (
+        legacy_highlight_text_by_term,
+        highlight_text_by_term,
+        lambda result: result,
+    ),
+    "build_snippet": (
+        legacy_build_snippet,
+        build_snippet,
+        lambda result: result[1],
+    ),
+}
+
+
+# runs with `python manage.py benchmark_highlight`
+# add `--queries "nausea,'renal impairment'"` to highlight other queries, comma separated
+# add `--text_dir path/to/texts` to highlight text files rather than the longest sections in the database
+class Command(BaseCommand):
+    help = "Compares the highlighting of search terms in label sections with the previous implementation"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queries",
+            type=str,
+            help="Comma separated queries. Default is a few common words and phrases",
+            default="nausea,headache vomiting,'renal impairment',patients with,dose",
+        )
+        parser.add_argument(
+            "--sections",
+            type=int,
+            help="Number of sections, the longest ones. Default is 50",
+            default=50,
+        )
+        parser.add_argument(
+            "--text_dir", type=str, help="Directory of text files to highlight", default=None
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if options["text_dir"]:
+            texts = []
+            for filename in sorted(os.listdir(options["text_dir"])):
+                if filename.lower().endswith(".txt"):
+                    with open(os.path.join(options["text_dir"], filename)) as f:
+                        texts.append(f.read())
+        else:
+            sections = ProductSection.objects.annotate(text_length=Length("section_text")).order_by(
+                "-text_length"
+            )[: options["sections"]]
+            texts = list(sections.values_list("section_text", flat=True))
+        if not texts:
+            raise CommandError("No texts to highlight")
+        queries = [q.strip() for q in options["queries"].split(",") if q.strip()]
+        num_chars = sum(len(text) for text in texts)
+        self.stdout.write(f"texts: {len(texts)}, characters: {num_chars}, queries: {queries}")
+
+        num_mismatches = 0
+        for name, (legacy, new, normalize) in CASES.items():
+            legacy_time, new_time, mismatches = 0.0, 0.0, 0
+            for query in queries:
+                start = time.perf_counter()
+                expected = [legacy(text, query) for text in texts]
+                legacy_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                results = [new(text, query) for text in texts]
+                new_time += time.perf_counter() - start
+
+                for a, b in zip(expected, results):
+                    if normalize(a) != normalize(b):
+                        mismatches += 1
+                        logger.info(f"{name} differs for {query!r}")
+
+            num_mismatches += mismatches
+            speedup = legacy_time / max(new_time, 1e-9)
+            line = f"{name}: {legacy_time:.3f}s -> {new_time:.3f}s ({speedup:.1f}x)"
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f"{line}, {mismatches} mismatches"))
+            else:
+                self.stdout.write(line)
+
+        if num_mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {num_mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
@@ -0,0 +1,200 @@
+import logging
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_section_matcher import HEADER_PATTERNS
+from .load_hc_data import OTHER_FORMATTED_SECTIONS as HC_FORMATTED_SECTIONS
+from .load_tga_data import OTHER_FORMATTED_SECTIONS as TGA_FORMATTED_SECTIONS
+from .pdf_parsing_helper import (
+    ANNEX_PATTERN,
+    JoinedText,
+    filter_headers,
+    get_pdf_sections,
+    get_pdf_sections_with_format,
+    read_pdf,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_get_pdf_sections(text, pattern, headers_filter=True):
+    """get_pdf_sections before JoinedText, matching line by line"""
+    idx, headers, sections = [], [], []
+    for i, line in enumerate(text):
+        if re.match(pattern, line):
+            idx += [i]
+            headers += [line.strip()]
+
+    if headers_filter and len(headers) != 0:
+        idx, headers = filter_headers(idx, headers)
+
+    for n, h in enumerate(headers):
+        if (n + 1) < len(headers):
+            contents = text[idx[n] + 1 : idx[n + 1]]
+        else:
+            contents = text[idx[n] + 1 :]
+        sections += ["\n".join(contents)]
+
+    return headers, sections
+
+
+def legacy_get_pdf_sections_with_format(
+    text, section_format, all_matches=True, upper=False, headers_filter=False
+):
+    """The loaders' get_pdf_sections_with_format before JoinedText, matching line by line"""
+    idx, headers, sections = [], [], []
+    start_idx = 0
+    for section in section_format:
+        for i, line in enumerate(text[start_idx:], start=start_idx):
+            if re.match(section, line.upper() if upper else line):
+                start_idx = i + 1
+                idx += [i]
+                headers += [line.strip()]
+                if not all_matches:
+                    break
+
+    if headers_filter and len(headers) != 0:
+        idx, headers = filter_headers(idx, headers)
+
+    for n, h in enumerate(headers):
+        if (n + 1) < len(headers):
+            contents = text[idx[n] + 1 : idx[n + 1]]
+        else:
+            contents = text[idx[n] + 1 :]
+        sections += ["\n".join(contents)]
+
+    return headers, sections
+
+
+def legacy_annex_index(text):
+    annex_lines = [re.match(ANNEX_PATTERN, line) is not None for line in text]
+    return [i for i, v in enumerate(annex_lines) if v][:2]
+
+
+# each case: (legacy function, new function taking a JoinedText, keyword arguments)
+CASES = {
+    "EMA sections": (
+        legacy_get_pdf_sections,
+        get_pdf_sections,
+        {"pattern": HEADER_PATTERNS["EMA"][0]},
+    ),
+    "TGA sections": (
+        legacy_get_pdf_sections,
+        get_pdf_sections,
+        {"pattern": HEADER_PATTERNS["TGA"][0]},
+    ),
+    "TGA formatted sections": (
+        legacy_get_pdf_sections_with_format,
+        get_pdf_sections_with_format,
+        {"section_format": TGA_FORMATTED_SECTIONS},
+    ),
+    "HC sections": (
+        legacy_get_pdf_sections,
+        get_pdf_sections,
+        {"pattern": HEADER_PATTERNS["HC"][0]},
+    ),
+    "HC formatted sections": (
+        legacy_get_pdf_sections_with_format,
+        get_pdf_sections_with_format,
+        {
+            "section_format": HC_FORMATTED_SECTIONS,
+            "all_matches": False,
+            "upper": True,
+            "headers_filter": True,
+        },
+    ),
+    "annex": (
+        legacy_annex_index,
+        lambda text: text.match_lines(ANNEX_PATTERN, limit=2),
+        {},
+    ),
+}
+
+
+# runs with `python manage.py benchmark_pdf_sections --pdf_dir path/to/labels`
+# add `--text_dir path/to/texts` to use text files, one PDF line per line, rather than extracting PDFs
+# add `--verbosity 2` for info output
+class Command(BaseCommand):
+    help = "Compares the section splitting in pdf_parsing_helper with the previous line by line matching"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf_dir", type=str, help="Directory of label PDFs", default=None)
+        parser.add_argument(
+            "--text_dir",
+            type=str,
+            help="Directory of text files extracted from PDFs, one line per line",
+            default=None,
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            help="Number of times each case is run on each text. Default is 10",
+            default=10,
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if options["text_dir"]:
+            texts = self.read_texts(options["text_dir"])
+        elif options["pdf_dir"]:
+            texts = self.extract_texts(options["pdf_dir"])
+        else:
+            raise CommandError("Either --pdf_dir or --text_dir is required")
+        if not texts:
+            raise CommandError("No texts to benchmark with")
+        num_lines = sum(len(text) for text in texts)
+        self.stdout.write(f"texts: {len(texts)}, lines: {num_lines}")
+
+        repeat = options["repeat"]
+        num_mismatches = 0
+        for name, (legacy, new, kwargs) in CASES.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                expected = [legacy(text, **kwargs) for text in texts]
+            legacy_time = time.perf_counter() - start
+
+            # joining the text is part of the cost, so it is timed with each run
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results = [new(JoinedText(text), **kwargs) for text in texts]
+            new_time = time.perf_counter() - start
+
+            mismatches = sum(1 for a, b in zip(expected, results) if a != b)
+            num_mismatches += mismatches
+            speedup = legacy_time / max(new_time, 1e-9)
+            line = f"{name}: {legacy_time:.3f}s -> {new_time:.3f}s ({speedup:.1f}x)"
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f"{line}, {mismatches} mismatches"))
+            else:
+                self.stdout.write(line)
+
+        if num_mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {num_mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
+
+    def read_texts(self, text_dir):
+        texts = []
+        for filename in sorted(os.listdir(text_dir)):
+            if filename.lower().endswith(".txt"):
+                with open(os.path.join(text_dir, filename)) as f:
+                    texts.append(f.read().split("\n"))
+        return texts
+
+    def extract_texts(self, pdf_dir):
+        texts = []
+        for filename in sorted(os.listdir(pdf_dir)):
+            if filename.lower().endswith(".pdf"):
+                logger.info(f"reading {filename}")
+                texts.append(read_pdf(os.path.join(pdf_dir, filename), no_annex=False))
+        return texts
@@ -0,0 +1,66 @@
+import logging
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .pdf_parsing_helper import read_pdf
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py benchmark_read_pdf --pdf_dir path/to/ema/labels`
+class Command(BaseCommand):
+    help = "Compares extracting annex 1 of EMA PDFs page by page with extracting the whole file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf_dir", type=str, help="Directory of EMA label PDFs", default=None)
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if not options["pdf_dir"]:
+            raise CommandError("--pdf_dir is required")
+        filenames = [
+            f for f in sorted(os.listdir(options["pdf_dir"])) if f.lower().endswith(".pdf")
+        ]
+        if not filenames:
+            raise CommandError("No PDFs to benchmark with")
+
+        totals = {"pages": 0, "skipped": 0, "full": 0.0, "lazy": 0.0}
+        mismatches = 0
+        for filename in filenames:
+            path = os.path.join(options["pdf_dir"], filename)
+            full_stats, lazy_stats = {}, {}
+            full_text = read_pdf(path, lazy_annex=False, stats=full_stats)
+            lazy_text = read_pdf(path, lazy_annex=True, stats=lazy_stats)
+            skipped = lazy_stats["pages"] - lazy_stats["pages_extracted"]
+            saved = full_stats["seconds"] - lazy_stats["seconds"]
+            line = (
+                f"{filename}: {lazy_stats['pages_extracted']} of {lazy_stats['pages']} pages, "
+                f"skipped {skipped}, {full_stats['seconds']:.2f}s -> {lazy_stats['seconds']:.2f}s, "
+                f"saved {saved:.2f}s"
+            )
+            if full_text != lazy_text:
+                mismatches += 1
+                self.stdout.write(self.style.ERROR(f"{line}, text differs"))
+            else:
+                self.stdout.write(line)
+            totals["pages"] += lazy_stats["pages"]
+            totals["skipped"] += skipped
+            totals["full"] += full_stats["seconds"]
+            totals["lazy"] += lazy_stats["seconds"]
+
+        self.stdout.write(
+            f"total: skipped {totals['skipped']} of {totals['pages']} pages, "
+            f"{totals['full']:.2f}s -> {totals['lazy']:.2f}s"
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
@@ -0,0 +1,101 @@
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+import pdfplumber
+
+from .pdf_parsing_helper import remove_margins, remove_tables
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_remove_tables(page):
+    """remove_tables before the bboxes were indexed, checking every bbox for every object"""
+    ts = {"vertical_strategy": "lines", "horizontal_strategy": "lines"}
+    bboxes = [table.bbox for table in page.find_tables(table_settings=ts)]
+
+    def not_within_bboxes(obj):
+        # Check if the object is in any of the table's bbox.
+        def obj_in_bbox(_bbox):
+            v_mid = (obj["top"] + obj["bottom"]) / 2
+            h_mid = (obj["x0"] + obj["x1"]) / 2
+            x0, top, x1, bottom = _bbox
+            return (h_mid >= x0) and (h_mid < x1) and (v_mid >= top) and (v_mid < bottom)
+
+        return not any(obj_in_bbox(__bbox) for __bbox in bboxes)
+
+    return page.filter(not_within_bboxes)
+
+
+# runs with `python manage.py benchmark_remove_tables --pdf_dir path/to/labels`
+# add `--no_margins False` for HC-style extraction without margin cropping
+# add `--verbosity 2` to list the slowest pages
+class Command(BaseCommand):
+    help = "Compares remove_tables with the previous implementation, page by page"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pdf_dir", type=str, help="Directory of label PDFs", default=None)
+        parser.add_argument(
+            "--no_margins",
+            type=lambda v: v.lower() in ["true", "1", "yes"],
+            help="Crop the margins first, like read_pdf. Default is True",
+            default=True,
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if not options["pdf_dir"]:
+            raise CommandError("--pdf_dir is required")
+        filenames = [
+            f for f in sorted(os.listdir(options["pdf_dir"])) if f.lower().endswith(".pdf")
+        ]
+        if not filenames:
+            raise CommandError("No PDFs to benchmark with")
+
+        timings = []  # (legacy seconds, new seconds, file, page number)
+        mismatches = 0
+        for filename in filenames:
+            with pdfplumber.open(os.path.join(options["pdf_dir"], filename)) as pdf:
+                for n, page in enumerate(pdf.pages, 1):
+                    if options["no_margins"]:
+                        page = remove_margins(page)
+                    # the page's objects are parsed once, outside of the timings
+                    page.objects
+
+                    # timed up to the filtered chars, extract_text takes the same time either way
+                    start = time.perf_counter()
+                    legacy_page = legacy_remove_tables(page)
+                    legacy_page.chars
+                    legacy_time = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    new_page = remove_tables(page)
+                    new_page.chars
+                    new_time = time.perf_counter() - start
+
+                    if new_page.extract_text() != legacy_page.extract_text():
+                        mismatches += 1
+                        logger.error(self.style.ERROR(f"{filename} page {n}: text differs"))
+                    timings.append((legacy_time, new_time, filename, n))
+
+        for legacy_time, new_time, filename, n in sorted(timings, reverse=True)[:10]:
+            logger.info(f"{filename} page {n}: {legacy_time:.3f}s -> {new_time:.3f}s")
+        legacy_total = sum(t[0] for t in timings)
+        new_total = sum(t[1] for t in timings)
+        self.stdout.write(
+            f"pages: {len(timings)}, {legacy_total:.2f}s -> {new_total:.2f}s "
+            f"({legacy_total / max(new_total, 1e-9):.1f}x)"
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {mismatches}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
@@ -0,0 +1,143 @@
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Levenshtein import distance as levdistance
+
+from data.constants import EMA_SECTION_NAMES, HC_SECTION_NAMES, TGA_SECTION_NAMES
+from data.models import ProductSection
+from data.section_matcher import SectionNameMatcher
+
+from .pdf_parsing_helper import get_pdf_sections, read_pdf
+
+
+logger = logging.getLogger(__name__)
+
+SECTION_NAMES = {
+    "EMA": EMA_SECTION_NAMES,
+    "TGA": TGA_SECTION_NAMES,
+    "HC": HC_SECTION_NAMES,
+}
+# the header patterns and read_pdf options the loaders use
+HEADER_PATTERNS = {
+    "EMA": (r"^[0-9]+\.[0-9]*\s+.*[A-Z].*", {}),
+    "TGA": (r"^[0-9]+\.?[0-9]*\s+[A-Z].*", {"no_annex": False}),
+    "HC": (r"^[1-9][0-9]?\.?\s+[A-Z].*", {"no_margins": False, "no_annex": False}),
+}
+
+
+def legacy_fixed_header(centers, text):
+    """The linear scan the loaders used before SectionNameMatcher"""
+    dists = [levdistance(text.lower(), c.lower()) for c in centers]
+    ix = dists.index(min(dists))
+    if dists[ix] > 0.6 * len(text):
+        return None
+    else:
+        return centers[ix]
+
+
+# runs with `python manage.py benchmark_section_matcher --agency EMA`
+# add `--pdf_dir path/to/labels` to benchmark with the header lines of real label PDFs
+# add `--corpus_file headers.txt` to benchmark with a list of header lines, one per line
+# otherwise the section names stored in the DB are used, numbered like in the PDFs
+class Command(BaseCommand):
+    help = "Compares the section header matcher with the previous linear Levenshtein scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--agency", type=str, help="'EMA', 'TGA', or 'HC'", default="EMA")
+        parser.add_argument("--pdf_dir", type=str, help="Directory of label PDFs", default=None)
+        parser.add_argument(
+            "--corpus_file", type=str, help="File with one header per line", default=None
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            help="Number of passes over the corpus, headers repeat across labels. Default is 10",
+            default=10,
+        )
+
+    def handle(self, *args, **options):
+        agency = options["agency"]
+        if agency not in SECTION_NAMES:
+            raise CommandError("'agency' parameter must be 'EMA', 'TGA', or 'HC'")
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        if options["corpus_file"]:
+            with open(options["corpus_file"]) as f:
+                corpus = [line.rstrip("\n") for line in f if line.strip()]
+        elif options["pdf_dir"]:
+            corpus = self.get_pdf_headers(agency, options["pdf_dir"])
+        else:
+            corpus = self.get_db_headers(agency)
+        if not corpus:
+            raise CommandError("No headers to benchmark with")
+        corpus = corpus * options["repeat"]
+        logger.info(f"{len(corpus)} headers")
+
+        names = SECTION_NAMES[agency]
+        start = time.perf_counter()
+        legacy = [legacy_fixed_header(names, h) for h in corpus]
+        legacy_time = time.perf_counter() - start
+
+        # a new matcher, so the timing includes building it and filling its cache
+        start = time.perf_counter()
+        matcher = SectionNameMatcher(names)
+        matched = [matcher.match(h) for h in corpus]
+        matcher_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        uncached = [matcher._match(h) for h in corpus]
+        uncached_time = time.perf_counter() - start
+
+        mismatches = [(h, a, b) for h, a, b in zip(corpus, legacy, matched) if a != b]
+        mismatches += [(h, a, b) for h, a, b in zip(corpus, legacy, uncached) if a != b]
+        for h, a, b in mismatches[:10]:
+            logger.error(self.style.ERROR(f"mismatch for {h!r}: {a!r} != {b!r}"))
+
+        self.stdout.write(f"headers: {len(corpus)} ({len(set(corpus))} distinct)")
+        self.stdout.write(f"linear scan: {legacy_time:.3f}s")
+        self.stdout.write(
+            f"matcher: {matcher_time:.3f}s ({legacy_time / max(matcher_time, 1e-9):.1f}x)"
+        )
+        self.stdout.write(
+            f"matcher without cache: {uncached_time:.3f}s ({legacy_time / max(uncached_time, 1e-9):.1f}x)"
+        )
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"mismatches: {len(mismatches)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("results are identical"))
+
+    def get_pdf_headers(self, agency, pdf_dir):
+        """The header lines the loader would try to fix, for each PDF in pdf_dir"""
+        pattern, read_options = HEADER_PATTERNS[agency]
+        headers = []
+        for filename in sorted(os.listdir(pdf_dir)):
+            if not filename.lower().endswith(".pdf"):
+                continue
+            logger.info(f"reading {filename}")
+            text = read_pdf(os.path.join(pdf_dir, filename), **read_options)
+            pdf_headers, _ = get_pdf_sections(text, pattern=pattern)
+            headers += pdf_headers
+        return headers
+
+    def get_db_headers(self, agency):
+        """Section names stored for the agency, numbered and upper cased as they appear in the PDFs"""
+        names = list(
+            ProductSection.objects.filter(label_product__drug_label__source=agency)
+            .values_list("agency_section_name", flat=True)
+            .distinct()
+        )
+        if not names:
+            logger.warning(f"No {agency} sections in the DB, using the canonical section names")
+            names = SECTION_NAMES[agency]
+        headers = []
+        for n, name in enumerate(names, 1):
+            headers += [f"{n}. {name}", f"{n}.1 {name.upper()}", name]
+        return headers
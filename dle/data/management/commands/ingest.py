@@ -0,0 +1,373 @@
+import logging
+import os
+import queue
+import threading
+from distutils.util import strtobool
+
+from django.conf import settings
+from django.core import management
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from elasticsearch import logger as es_logger
+
+from api.apps import ApiConfig
+from data.models import DrugLabel, IngestRun, IngestStage, ProductSection
+from data.signals import label_ingested
+from data.util import vectorize_section
+from search.utils.provision_es import create_index, index_labels, index_sections
+
+
+es_logger.setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+LOADERS = {
+    "EMA": "load_ema_data",
+    "FDA": "load_fda_data",
+    "TGA": "load_tga_data",
+    "HC": "load_hc_data",
+}
+# marks the end of a queue
+DONE = None
+
+
+# runs with `python manage.py ingest`
+# add `--type full` to import the full dataset
+# add `--agencies EMA,TGA` to only run some of the loaders
+# add `--resume True` to resume the last run that did not finish, skipping the stages that are done
+# add `--verbosity 2` for info output
+# add `--verbosity 3` for debug output
+class Command(BaseCommand):
+    """Replaces running the loaders, update_latest_drug_labels, vectorize, provision_elastic,
+    precompute_version_diffs and precompute_label_matches one after another.
+    The agency loaders run concurrently, and each label is vectorized and indexed as soon as it is saved:
+    loaders -> label_ingested signal -> vectorize queue -> index queue.
+    The queues are bounded, so a slow stage holds back the stages before it rather than buffering labels.
+    Each run and stage is recorded in IngestRun / IngestStage.
+    """
+
+    help = "Loads, vectorizes and indexes data from all agencies"
+
+    def __init__(self, stdout=None, stderr=None, no_color=False, force_color=False):
+        super().__init__(stdout, stderr, no_color, force_color)
+        self.vectorize_queue = None
+        self.index_queue = None
+        self.vectorize_thread = None
+        self.index_thread = None
+        self.resumed = False
+        self.labels_loaded = {}
+        "number of labels saved by each loader; form: {loader: count}"
+        self.lock = threading.Lock()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type",
+            type=str,
+            help="'full' or 'test', passed on to the loaders",
+            default="test",
+        )
+        parser.add_argument(
+            "--agencies",
+            type=str,
+            help="Comma separated agencies to load, e.g. 'EMA,TGA'. Default is all of them",
+            default=",".join(LOADERS.keys()),
+        )
+        parser.add_argument(
+            "--vectorize",
+            type=strtobool,
+            help="Vectorize the sections of each new label. Default is True",
+            default=True,
+        )
+        parser.add_argument(
+            "--index",
+            type=strtobool,
+            help="Index the vectorized sections of each new label into Elasticsearch. Default is True",
+            default=True,
+        )
+        parser.add_argument(
+            "--queue_size",
+            type=int,
+            help="Maximum number of labels waiting between two stages. Default is 100",
+            default=100,
+        )
+        parser.add_argument(
+            "--mapping_file",
+            type=str,
+            help="Path to the mapping file, used if the index doesn't exist yet",
+            default="/app/search/mappings/provision.json",
+        )
+        parser.add_argument(
+            "--resume",
+            type=strtobool,
+            help="Resume the last run that did not finish, with its original options. Default is False",
+            default=False,
+        )
+
+    def handle(self, *args, **options):
+        # basic logging config is in settings.py
+        # verbosity is 1 by default, gives critical, error and warning output
+        # `--verbosity 2` gives info output
+        # `--verbosity 3` gives debug output
+        self.verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if self.verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif self.verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        run = None
+        if options["resume"]:
+            run = IngestRun.objects.exclude(status="done").order_by("-created_at").first()
+            if run is None:
+                logger.warning(
+                    self.style.WARNING("No unfinished run to resume, starting a new one")
+                )
+            else:
+                logger.info(f"Resuming {run}")
+                run.status = "running"
+                run.save()
+                self.resumed = True
+        if run is None:
+            run_options = {
+                "type": options["type"],
+                "agencies": [a.strip() for a in options["agencies"].split(",") if a.strip()],
+                "vectorize": bool(options["vectorize"]),
+                "index": bool(options["index"]),
+                "mapping_file": options["mapping_file"],
+            }
+            run = IngestRun.objects.create(options=run_options)
+        self.run = run
+        self.run_options = run.options
+
+        if self.run_options["type"] not in ["full", "test"]:
+            raise CommandError("'type' parameter must be 'full' or 'test'")
+        for agency in self.run_options["agencies"]:
+            if agency not in LOADERS:
+                raise CommandError(f"'agencies' must be in {', '.join(LOADERS.keys())}")
+
+        logger.info(self.style.SUCCESS("start process"))
+        logger.info(f"run: {run.id}, options: {self.run_options}")
+
+        self.vectorize_queue = queue.Queue(maxsize=options["queue_size"])
+        self.index_queue = queue.Queue(maxsize=options["queue_size"])
+
+        # start the consumers first so the loaders never wait on a queue nobody reads
+        # they always run, also when resuming, as they catch up on what the last run left behind
+        if self.run_options["index"]:
+            self.index_thread = self.start_stage("index", self.index_worker, resumable=False)
+        if self.run_options["vectorize"]:
+            self.vectorize_thread = self.start_stage(
+                "vectorize", self.vectorize_worker, resumable=False
+            )
+
+        label_ingested.connect(self.on_label_ingested, weak=False)
+        try:
+            loader_threads = [
+                self.start_stage(LOADERS[agency], self.run_loader, LOADERS[agency])
+                for agency in self.run_options["agencies"]
+            ]
+            for thread in loader_threads:
+                if thread is not None:
+                    thread.join()
+        finally:
+            label_ingested.disconnect(self.on_label_ingested)
+
+        # latest_drug_labels is rebuilt from the whole table, so it waits for all the loaders
+        latest_thread = self.start_stage(
+            "update_latest_drug_labels", self.run_command, "update_latest_drug_labels"
+        )
+        if latest_thread is not None:
+            latest_thread.join()
+
+        # cache the compare_versions diffs of the products with new labels, alongside vectorize and index
+        diffs_thread = self.start_stage("precompute_version_diffs", self.precompute_version_diffs)
+
+        # the vectorize stage passes DONE on to the index stage once it is through its queue
+        if self.vectorize_thread is not None:
+            self.put(self.vectorize_queue, DONE, self.vectorize_thread)
+            self.vectorize_thread.join()
+        elif self.index_thread is not None:
+            self.put(self.index_queue, DONE, self.index_thread)
+        # the label matches compare the indication vectors, so they wait for the vectorize stage
+        matches_thread = self.start_stage("precompute_label_matches", self.precompute_label_matches)
+        if self.index_thread is not None:
+            self.index_thread.join()
+        if diffs_thread is not None:
+            diffs_thread.join()
+        if matches_thread is not None:
+            matches_thread.join()
+
+        stages = run.stages.order_by("started_at")
+        for stage in stages:
+            logger.info(str(stage))
+        run.status = "failed" if stages.filter(status="failed").exists() else "done"
+        run.finished_at = timezone.now()
+        run.save()
+        logger.info(self.style.SUCCESS(f"process complete: {run}"))
+
+    def start_stage(self, name, target, *args, resumable=True):
+        """Start a stage in its own thread, recording it in the run ledger
+        Returns: the thread, or None if the stage is already done in a resumed run
+        """
+        stage, _ = IngestStage.objects.get_or_create(run=self.run, name=name)
+        if resumable and stage.status == "done":
+            logger.info(f"Skipping {name}, already done in run {self.run.id}")
+            return None
+        stage.status = "running"
+        stage.started_at = timezone.now()
+        stage.finished_at = None
+        stage.message = ""
+        stage.save()
+
+        def run_stage():
+            try:
+                stage.items_processed = target(*args) or 0
+                stage.status = "done"
+            except Exception as e:
+                logger.error(self.style.ERROR(f"{name} failed: {repr(e)}"))
+                logger.debug(e, exc_info=True)
+                stage.status = "failed"
+                stage.message = repr(e)
+            finally:
+                stage.finished_at = timezone.now()
+                stage.save()
+                # each thread has its own DB connection
+                connections.close_all()
+
+        thread = threading.Thread(target=run_stage, name=name)
+        thread.start()
+        return thread
+
+    def run_command(self, command_name):
+        management.call_command(command_name, verbosity=self.verbosity)
+
+    def precompute_version_diffs(self):
+        management.call_command(
+            "precompute_version_diffs",
+            agencies=",".join(self.run_options["agencies"]),
+            updated_since=self.run.created_at.isoformat(),
+            verbosity=self.verbosity,
+        )
+
+    def precompute_label_matches(self):
+        management.call_command(
+            "precompute_label_matches",
+            agencies=",".join(self.run_options["agencies"]),
+            updated_since=self.run.created_at.isoformat(),
+            verbosity=self.verbosity,
+        )
+
+    def run_loader(self, command_name):
+        management.call_command(
+            command_name, type=self.run_options["type"], verbosity=self.verbosity
+        )
+        return self.labels_loaded.get(command_name, 0)
+
+    def on_label_ingested(self, sender, drug_label, **kwargs):
+        """Called in the loader's thread each time it saves a label"""
+        loader = sender.__module__.rsplit(".", 1)[-1]
+        with self.lock:
+            self.labels_loaded[loader] = self.labels_loaded.get(loader, 0) + 1
+        if self.vectorize_thread is not None:
+            self.put(self.vectorize_queue, drug_label.id, self.vectorize_thread)
+        elif self.index_thread is not None:
+            self.put(self.index_queue, drug_label.id, self.index_thread)
+
+    def put(self, q, item, consumer):
+        """Block while the queue is full, unless its consumer has stopped"""
+        while consumer.is_alive():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        logger.warning(f"Not queueing label {item}, {consumer.name} has stopped")
+
+    def vectorize_worker(self):
+        try:
+            model = ApiConfig.pubmedbert_model
+            num_sections = 0
+            while (drug_label_id := self.vectorize_queue.get()) is not DONE:
+                num_sections += self.vectorize_label(model, drug_label_id)
+
+            # catch up on labels saved by an earlier, interrupted run or outside of `ingest`
+            sections = ProductSection.objects.filter(
+                label_product__drug_label__source__in=self.run_options["agencies"],
+                bert_vector__isnull=True,
+            )
+            drug_label_ids = sections.values_list(
+                "label_product__drug_label_id", flat=True
+            ).distinct()
+            for drug_label_id in drug_label_ids.iterator():
+                num_sections += self.vectorize_label(model, drug_label_id)
+        finally:
+            # also when vectorizing fails, else the index stage waits on its queue forever
+            if self.index_thread is not None:
+                self.put(self.index_queue, DONE, self.index_thread)
+        logger.info(f"vectorized {num_sections} sections")
+        return num_sections
+
+    def vectorize_label(self, model, drug_label_id):
+        sections = ProductSection.objects.filter(
+            label_product__drug_label_id=drug_label_id, bert_vector__isnull=True
+        )
+        num_sections = 0
+        for section in sections:
+            try:
+                vectorize_section(section, model)
+                num_sections += 1
+            except Exception as e:
+                logger.error(
+                    self.style.ERROR(f"Failed to vectorize section {section.id}: {repr(e)}")
+                )
+        if self.index_thread is not None:
+            self.put(self.index_queue, drug_label_id, self.index_thread)
+        return num_sections
+
+    def index_worker(self, batch_size=50):
+        # Index must exist to index documents
+        create_index("productsection", mapping_file=self.run_options["mapping_file"])
+        if settings.ES_LABEL_INDEX:
+            label_mapping_file = os.path.join(
+                os.path.dirname(self.run_options["mapping_file"]), "druglabel.json"
+            )
+            create_index("druglabel", mapping_file=label_mapping_file)
+        num_sections = 0
+        done = False
+        while not done:
+            # wait for one label, then index whatever else is already queued with it
+            drug_label_ids = [self.index_queue.get()]
+            while len(drug_label_ids) < batch_size:
+                try:
+                    drug_label_ids.append(self.index_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if DONE in drug_label_ids:
+                done = True
+                drug_label_ids = [i for i in drug_label_ids if i is not DONE]
+            if not drug_label_ids:
+                continue
+            sections = ProductSection.objects.filter(
+                label_product__drug_label_id__in=drug_label_ids, bert_vector__isnull=False
+            )
+            num_sections += index_sections(sections, progress_bar=False)
+            if settings.ES_LABEL_INDEX:
+                drug_labels = DrugLabel.objects.filter(id__in=drug_label_ids)
+                index_labels(drug_labels, progress_bar=False)
+
+        if self.resumed:
+            # labels the interrupted run vectorized but may not have got to index
+            sections = ProductSection.objects.filter(
+                label_product__drug_label__source__in=self.run_options["agencies"],
+                label_product__drug_label__updated_at__gte=self.run.created_at,
+                bert_vector__isnull=False,
+            )
+            num_sections += index_sections(sections, progress_bar=False)
+            if settings.ES_LABEL_INDEX:
+                drug_labels = DrugLabel.objects.filter(
+                    source__in=self.run_options["agencies"], updated_at__gte=self.run.created_at
+                )
+                index_labels(drug_labels, progress_bar=False)
+        logger.info(f"indexed {num_sections} sections")
+        return num_sections
@@ -15,14 +15,15 @@ from django.db import IntegrityError
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from Levenshtein import distance as levdistance
 from requests.exceptions import ChunkedEncodingError
 
 from data.models import DrugLabel, LabelProduct, ParsingError, ProductSection
+from data.section_matcher import EMA_SECTION_MATCHER
+from data.signals import label_ingested
 from data.util import check_recently_updated, strfdelta
 from users.models import MyLabel
 
-from .pdf_parsing_helper import get_pdf_sections, read_pdf
+from .pdf_parsing_helper import get_pdf_sections, read_pdf_cached
 
 
 logger = logging.getLogger(__name__)
@@ -48,6 +49,8 @@ class Command(BaseCommand):
         "keep track of the number of labels processed"
         self.error_urls = {}
         "dictionary to keep track of the urls that have parsing errors; form: {url: True}"
+        self.pdf_stats = {"pages": 0, "pages_extracted": 0, "seconds": 0}
+        "totals of read_pdf's stats, to report the pages skipped after annex 1"
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -104,8 +107,9 @@ class Command(BaseCommand):
         logger.info(self.style.SUCCESS("start process"))
         logger.info(f"import_type: {import_type}")
 
-        # Read ema excel into df
-        self.read_ema_excel()
+        # Read ema excel into df; the metadata isn't needed to parse a user's file
+        if import_type != "my_label":
+            self.read_ema_excel()
 
         # TODO break test, my_label, and full into separate functions rather than having all logic here
         if import_type == "test":
@@ -184,6 +188,7 @@ class Command(BaseCommand):
                 dl.raw_text = self.parse_pdf(dl.link, lp)
                 dl.save()
                 self.num_drug_labels_parsed += 1
+                label_ingested.send(sender=self.__class__, drug_label=dl)
             except IntegrityError as e:  # noqa: F841
                 logger.warning(self.style.WARNING("Label already in db"))
                 logger.debug(e, exc_info=True)
@@ -205,6 +210,7 @@ class Command(BaseCommand):
             logger.warning(self.style.WARNING(f"error parsing url: {url}"))
 
         logger.info(f"num_drug_labels_parsed: {self.num_drug_labels_parsed}")
+        self.log_pdf_stats()
         logger.info(self.style.SUCCESS("process complete"))
 
         if options["dump_json"] is True:
@@ -341,77 +347,25 @@ class Command(BaseCommand):
         logger.info(f"Parsed {pdf_url}")
         return raw_text
 
-    centers = [
-        "Clinical Particulars",
-        "Contraindications",
-        "Date Of First Authorisation/Renewal Of The Authorisation",
-        "Date Of Revision Of The Text",
-        "Effects On Ability To Drive And Use Machines",
-        "Fertility, Pregnancy And Lactation",
-        "Incompatibilities",
-        "Interaction With Other Medicinal Products And Other Forms Of Interaction",
-        "List Of Excipients",
-        "Marketing Authorisation Holder",
-        "Marketing Authorisation Number",
-        "Name Of The Medicinal Product",
-        "Nature And Contents Of Container",
-        "Overdose",
-        "Pharmaceutical Form",
-        "Pharmaceutical Particulars",
-        "Pharmacodynamic Properties",
-        "Pharmacokinetic Properties",
-        "Pharmacological Properties",
-        "Posology And Method Of Administration",
-        "Preclinical Safety Data",
-        "Pregnancy And Lactation",
-        "Qualitative And Quantitative Composition",
-        "Shelf Life",
-        "Special Precautions For Disposal",
-        "Special Precautions For Disposal And Other Handling",
-        "Special Precautions For Storage",
-        "Special Warnings And Precautions For Use",
-        "Therapeutic Indications",
-        "Undesirable Effects",
-    ]
-    # note: maybe we should manually merge these pairs:
-    #   FERTILITY, PREGNANCY AND LACTATION
-    #   PREGNANCY AND LACTATION
-    #   SPECIAL PRECAUTIONS FOR DISPOSAL AND OTHER HANDLING
-    #   SPECIAL PRECAUTIONS FOR DISPOSAL
-    # but not doing so lets the similarity computation do its thing
-
     # improved initial text parsing step so this clustering problem wasn't so messy
     def get_fixed_header(self, text):
-        # return center with the lowest edit distance,
-        #   or placeholder (last entry) if no there's good match
-        dists = [levdistance(text.lower(), c.lower()) for c in self.centers]
-        # ix = np.argmin(dists)
-        ix = dists.index(min(dists))
-        if dists[ix] > 0.6 * len(text):
-            return None
-        else:
-            return self.centers[ix]
+        # return the section name with the lowest edit distance, or None if there's no good match
+        return EMA_SECTION_MATCHER.match(text)
 
     def process_ema_file(self, ema_file, lp, pdf_url="", my_label_id=None):
         text = []
 
         try:
-            text = read_pdf(ema_file)
+            stats = {}
+            text, sha256 = read_pdf_cached(ema_file, stats=stats)
+            lp.drug_label.pdf_sha256 = sha256
+            self.add_pdf_stats(ema_file, stats)
             info = {}
             if my_label_id is None:
                 product_code = lp.drug_label.source_product_number
                 row = self.df[self.df["Product number"] == product_code]
                 info["metadata"] = row.iloc[0].apply(str).to_dict()
-            label_text = {}  # next level = product page w/ metadata
-            headers, sections = get_pdf_sections(text, pattern=r"^[0-9]+\.[0-9]*\s+.*[A-Z].*")
-            for h, s in zip(headers, sections):
-                header = self.get_fixed_header(h)
-                if (header is not None) and (len(s) > 0):
-                    logger.debug(f"Found original header ({h}) fixed to {header}")
-                    if header not in label_text.keys():
-                        label_text[header] = [s]
-                    else:
-                        label_text[header].append(s)
+            label_text = self.get_label_text(text)
             for index, key in enumerate(label_text):
                 text_block = ""
                 # label_text[key] is an array of text. Convert it to a block of text
@@ -429,6 +383,46 @@ class Command(BaseCommand):
 
         return text
 
+    def get_label_text(self, text):
+        """Split the text of a PDF into sections
+        Returns: the sections' text by section name; form: {section name: [text, ...]}
+        """
+        label_text = {}  # next level = product page w/ metadata
+        headers, sections = get_pdf_sections(text, pattern=r"^[0-9]+\.[0-9]*\s+.*[A-Z].*")
+        for h, s in zip(headers, sections):
+            header = self.get_fixed_header(h)
+            if (header is not None) and (len(s) > 0):
+                logger.debug(f"Found original header ({h}) fixed to {header}")
+                if header not in label_text.keys():
+                    label_text[header] = [s]
+                else:
+                    label_text[header].append(s)
+        return label_text
+
+    def add_pdf_stats(self, ema_file, stats):
+        skipped = stats["pages"] - stats["pages_extracted"]
+        # estimated from the time taken per extracted page
+        saved = stats["seconds"] / max(stats["pages_extracted"], 1) * skipped
+        logger.info(
+            f"{ema_file}: extracted {stats['pages_extracted']} of {stats['pages']} pages "
+            f"in {stats['seconds']:.1f}s, skipped {skipped} pages, saved ~{saved:.1f}s"
+        )
+        if stats.get("page_seconds"):
+            slowest = max(range(len(stats["page_seconds"])), key=stats["page_seconds"].__getitem__)
+            logger.debug(f"slowest page: {slowest + 1}, {stats['page_seconds'][slowest]:.2f}s")
+        for key in self.pdf_stats:
+            self.pdf_stats[key] += stats[key]
+
+    def log_pdf_stats(self):
+        if self.pdf_stats["pages"] == 0:
+            return
+        skipped = self.pdf_stats["pages"] - self.pdf_stats["pages_extracted"]
+        saved = self.pdf_stats["seconds"] / max(self.pdf_stats["pages_extracted"], 1) * skipped
+        logger.info(
+            f"pdf pages extracted: {self.pdf_stats['pages_extracted']} of {self.pdf_stats['pages']}"
+            f" in {self.pdf_stats['seconds']:.1f}s, skipped {skipped} pages, saved ~{saved:.1f}s"
+        )
+
     def read_ema_excel(self):
         """Download the EMA provided Excel file and grab the urls from there"""
         # return a list of the epar urls, e.g. ["https://www.ema.europa.eu/en/medicines/human/EPAR/lyrica"]
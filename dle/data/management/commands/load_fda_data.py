@@ -17,6 +17,7 @@ import requests
 from bs4 import BeautifulSoup
 
 from data.models import DrugLabel, LabelProduct, ParsingError, ProductSection
+from data.signals import label_ingested
 from data.util import check_recently_updated, strfdelta  # PDFParseException, convert_date_string
 from users.models import MyLabel
 
@@ -93,13 +94,6 @@ class Command(BaseCommand):
         elif verbosity == 3:
             root_logger.setLevel(logging.DEBUG)
 
-        dl_json = json.loads(requests.get(FDA_JSON_URL).text)
-        labels_json = dl_json["results"]["drug"]["label"]
-        urls = [x["file"] for x in labels_json["partitions"]]
-        json_zips = self.download_json(urls)
-        self.extract_json_zips(json_zips)
-        file_dir = self.root_dir / "record_zips"
-
         if import_type == "my_label":
             if my_label_id is None:
                 raise Exception("--my_label_id has to be set if --type is my_label")
@@ -112,6 +106,14 @@ class Command(BaseCommand):
             ml.is_successfully_parsed = True
             ml.save()
         else:
+            # The bulk archives are only needed for full / test imports, not to parse a user's file
+            dl_json = json.loads(requests.get(FDA_JSON_URL).text)
+            labels_json = dl_json["results"]["drug"]["label"]
+            urls = [x["file"] for x in labels_json["partitions"]]
+            json_zips = self.download_json(urls)
+            self.extract_json_zips(json_zips)
+            file_dir = self.root_dir / "record_zips"
+
             # Iterate the json files in the directory one by one
             for file in os.listdir(file_dir):
                 json_file = file_dir / file
@@ -385,6 +387,8 @@ class Command(BaseCommand):
                 logger.error(str(e))
             except OperationalError as e:
                 logger.error(str(e))
+        if insert:
+            label_ingested.send(sender=self.__class__, drug_label=dl)
 
     def cleanup(self, files):
         for file in files:
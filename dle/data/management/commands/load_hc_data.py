@@ -2,9 +2,9 @@ import datetime
 import json
 import logging
 import random
-import re
 import time
 from distutils.util import strtobool
+from urllib.parse import urljoin
 
 from django.conf import settings
 from django.core.files.base import ContentFile
@@ -14,19 +14,33 @@ from django.db import IntegrityError
 
 import requests
 from bs4 import BeautifulSoup
-from Levenshtein import distance as levdistance
 from psycopg import DataError
 from selenium import webdriver
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
 from data.models import DrugLabel, LabelProduct, ParsingError, ProductSection
-from data.util import PDFParseException, check_recently_updated, strfdelta
+from data.section_matcher import HC_SECTION_MATCHER
+from data.signals import label_ingested
+from data.util import (
+    PDFParseException,
+    ScrapingHandshakeException,
+    check_recently_updated,
+    strfdelta,
+)
 from users.models import MyLabel
 
-from .pdf_parsing_helper import filter_headers, get_pdf_sections, read_pdf
+from .pdf_parsing_helper import (
+    JoinedText,
+    get_pdf_sections,
+    get_pdf_sections_with_format,
+    read_pdf_cached,
+)
+from .scraping_helper import REQUEST_TIMEOUT, build_session, fetch_in_order
 
 
 logger = logging.getLogger(__name__)
@@ -61,6 +75,8 @@ OTHER_FORMATTED_SECTIONS = [
 # add `--type full` to import the full dataset
 # add `--verbosity 2` for info output
 # add `--verbosity 3` for debug output
+# add `--client selenium` to submit the search form with a headless browser instead of plain HTTP
+# add `--concurrency N` to download N pages at a time
 # support for my_labels with: --type my_label --my_label_id ml.id
 class Command(BaseCommand):
     help = "Loads data from HC"
@@ -74,7 +90,20 @@ class Command(BaseCommand):
         "dictionary to keep track of the urls that have parsing errors; form: {url: True}"
         self.options = Options()
         self.options.add_argument("--headless")
-        self.driver = webdriver.Firefox(options=self.options)
+        self._driver = None
+        "the Selenium driver is only started if the plain HTTP search fails, see `driver`"
+        self.client = "http"
+        self.concurrency = 4
+        self.session = build_session(self.concurrency)
+        self.prefetched_pages = {}
+        "drug detail pages downloaded ahead of parsing; form: {url: response}"
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            logger.info("Starting headless Firefox")
+            self._driver = webdriver.Firefox(options=self.options)
+        return self._driver
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -101,6 +130,19 @@ class Command(BaseCommand):
             help="Skip labels that have previously had parsing errors. Default is True",
             default=True,
         )
+        parser.add_argument(
+            "--client",
+            type=str,
+            help="'http' submits the search form with a plain HTTP session and falls back to "
+            "'selenium' (headless Firefox) if that fails. Default is 'http'",
+            default="http",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Number of pages to download at a time. Default is 4",
+            default=4,
+        )
 
     def handle(self, *args, **options):
         self.skip_labels_updated_within_span = datetime.timedelta(
@@ -110,6 +152,11 @@ class Command(BaseCommand):
         import_type = options["type"]
         if import_type not in ["full", "test", "my_label"]:
             raise CommandError("'type' parameter must be 'full', 'test', or 'my_label'")
+        self.client = options["client"]
+        if self.client not in ["http", "selenium"]:
+            raise CommandError("'client' parameter must be 'http' or 'selenium'")
+        self.concurrency = max(1, options["concurrency"])
+        self.session = build_session(self.concurrency)
 
         # basic logging config is in settings.py
         # verbosity is 1 by default, gives critical, error and warning output
@@ -141,195 +188,369 @@ class Command(BaseCommand):
             logger.info(self.style.SUCCESS("process complete"))
             return
 
-        # Before being able to access the drugs,
-        #  we have to do a search with "approved" status and "human" class.
-        # Then store the cookies and pass it to the requests
-        for t in self.get_backoff_time(5):
+        rows_parsed = 0
+        # Iterate all the drugs in the table, page by page
+        for rows in self.get_result_pages():
+            rows = [row for row in rows if not self.should_skip_row(row)]
+            # For test, only parse the first 3 labels that aren't skipped
+            if import_type == "test":
+                rows = rows[:3]
+            # the detail pages of the rows are downloaded in parallel up front
+            self.prefetch_detail_pages(rows)
+            # Iterate all the products in the table
+            for row in rows:
+                self.process_row(row)
+                rows_parsed += 1
+            # For test, only parse the first labels of the first page
+            if import_type == "test":
+                break
+        logger.info(f"rows_parsed: {rows_parsed}")
+
+        if self._driver is not None:
+            self._driver.quit()
+        for url in self.error_urls.keys():
+            logger.warning(self.style.WARNING(f"error parsing url: {url}"))
+        logger.info(f"num_drug_labels_parsed: {self.num_drug_labels_parsed}")
+        logger.info(self.style.SUCCESS("process complete"))
+        return
+
+    def get_result_pages(self):
+        """Yield the rows of each page of search results.
+        Before being able to access the drugs, we have to do a search with "approved" status and
+        "human" class. With the default http client the search form is submitted directly and the
+        following pages are requested from the table's ajax source; the headless browser is only
+        used if that fails.
+        """
+        if self.client == "http":
             try:
-                time.sleep(t)
-                self.driver.get(HC_SEARCH_URL)
-                time.sleep(1)
-                # Click the approve field
-                approved_status_field = self.driver.find_element(
-                    by=By.XPATH,
-                    value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[1]/div/select/option[2]",
-                )
-                approved_status_field.click()
-                # Unclick the select all field
-                select_all_status_field = self.driver.find_element(
-                    by=By.XPATH,
-                    value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[1]/div/select/option[1]",
-                )
-                ActionChains(self.driver).key_down(Keys.CONTROL).click(
-                    select_all_status_field
-                ).key_up(Keys.CONTROL).perform()
-
-                # Click the human field
-                human_class_field = self.driver.find_element(
-                    by=By.XPATH,
-                    value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[7]/div/select/option[3]",
-                )
-                human_class_field.click()
-                # Unclick the select all field
-                select_all_class_field = self.driver.find_element(
-                    by=By.XPATH,
-                    value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[7]/div/select/option[1]",
-                )
-                ActionChains(self.driver).key_down(Keys.CONTROL).click(
-                    select_all_class_field
-                ).key_up(Keys.CONTROL).perform()
-
-                # Click the search button
-                search_button = self.driver.find_element(
-                    by=By.XPATH,
-                    value="/html/body/main/div[1]/div[1]/div[3]/form/div[1]/div/input[1]",
+                soup, table_attrs = self.search_http()
+            except ScrapingHandshakeException as e:
+                logger.warning(self.style.WARNING(f"{repr(e)}, falling back to Selenium"))
+                self.client = "selenium"
+        if self.client == "http":
+            yield from self.get_result_pages_http(soup, table_attrs)
+        else:
+            yield from self.get_result_pages_selenium()
+
+    def search_http(self):
+        """Submit the search form with the shared session
+        Returns: the result page soup and the table's data-wb-tables settings
+        """
+        try:
+            response = self.session.get(HC_SEARCH_URL, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, "html.parser")
+            form = soup.select_one("main form")
+            if form is None:
+                raise ScrapingHandshakeException("Could not find the HC search form")
+            # same fields as the xpaths used by the selenium client, see search_selenium
+            fieldset = form.find_all("fieldset")[2]
+            field_divs = fieldset.find_all("div", recursive=False)
+            status_select = field_divs[0].find("select")
+            class_select = field_divs[6].find("select")
+            chosen_options = {
+                status_select.get("name"): status_select.find_all("option")[1].get("value"),
+                class_select.get("name"): class_select.find_all("option")[2].get("value"),
+            }
+        except (IndexError, AttributeError) as e:
+            raise ScrapingHandshakeException(f"Unexpected HC search form layout: {repr(e)}")
+        except requests.RequestException as e:
+            raise ScrapingHandshakeException(f"HC search form request failed: {repr(e)}")
+
+        data = []
+        for field in form.find_all(["input", "select"]):
+            name = field.get("name")
+            if not name:
+                continue
+            if field.name == "select":
+                if name in chosen_options:
+                    data.append((name, chosen_options[name]))
+                else:
+                    data += [
+                        (name, o.get("value", o.text))
+                        for o in field.find_all("option", selected=True)
+                    ]
+            elif field.get("type") in ["checkbox", "radio"]:
+                if field.has_attr("checked"):
+                    data.append((name, field.get("value", "on")))
+            elif field.get("type") != "submit":
+                data.append((name, field.get("value", "")))
+        # only send the search button, not any of the other submit buttons
+        submit = form.find("input", attrs={"type": "submit"})
+        if submit is not None and submit.get("name"):
+            data.append((submit["name"], submit.get("value", "")))
+
+        action = urljoin(response.url, form.get("action", ""))
+        try:
+            if form.get("method", "get").lower() == "post":
+                response = self.session.post(action, data=data, timeout=REQUEST_TIMEOUT)
+            else:
+                response = self.session.get(action, params=data, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, "html.parser")
+            table_attrs = json.loads(soup.find("table").get("data-wb-tables"))
+        except requests.RequestException as e:
+            raise ScrapingHandshakeException(f"HC search request failed: {repr(e)}")
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ScrapingHandshakeException(f"Unexpected HC result page: {repr(e)}")
+        logger.info(f"total results: {table_attrs.get('iDeferLoading')}")
+        return soup, table_attrs
+
+    def get_result_pages_http(self, soup, table_attrs):
+        first_rows = soup.find("table").find("tbody").find_all("tr")
+        yield first_rows
+
+        num_total_results = table_attrs["iDeferLoading"]
+        page_length = table_attrs.get("iDisplayLength", table_attrs.get("pageLength"))
+        page_length = page_length or len(first_rows)
+        ajax = table_attrs.get("ajax", table_attrs.get("sAjaxSource", HC_RESULT_URL))
+        if isinstance(ajax, dict):
+            ajax = ajax.get("url", HC_RESULT_URL)
+        ajax_url = urljoin(HC_SEARCH_URL, ajax)
+
+        def page_requests():
+            for draw, start in enumerate(range(page_length, num_total_results, page_length), 2):
+                # both the legacy and current DataTables server-side parameters
+                params = {
+                    "sEcho": draw,
+                    "iDisplayStart": start,
+                    "iDisplayLength": page_length,
+                    "draw": draw,
+                    "start": start,
+                    "length": page_length,
+                }
+                yield {"method": "GET", "url": ajax_url, "params": params}
+
+        for kwargs, response in fetch_in_order(self.session, page_requests(), self.concurrency):
+            page_url = f"{ajax_url}?start={kwargs['params']['start']}"
+            if isinstance(response, Exception) or not response.ok:
+                logger.error(self.style.ERROR(f"unable to grab url contents {page_url}"))
+                self.error_urls[page_url] = True
+                continue
+            try:
+                results = response.json()
+            except ValueError:
+                logger.error(self.style.ERROR(f"unexpected response from {page_url}"))
+                self.error_urls[page_url] = True
+                continue
+            # rebuild the table rows so get_drug_label_from_row works the same for both clients
+            rows = []
+            for cells in results.get("aaData", results.get("data", [])):
+                if isinstance(cells, dict):
+                    cells = list(cells.values())
+                html = "<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>"
+                rows.append(BeautifulSoup(html, "html.parser").find("tr"))
+            yield rows
+
+    def search_selenium(self):
+        self.driver.get(HC_SEARCH_URL)
+        wait = WebDriverWait(self.driver, 30)
+        # Click the approve field
+        approved_status_field = wait.until(
+            expected_conditions.element_to_be_clickable(
+                (
+                    By.XPATH,
+                    "/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[1]/div/select/option[2]",
                 )
-                search_button.click()
+            )
+        )
+        approved_status_field.click()
+        # Unclick the select all field
+        select_all_status_field = self.driver.find_element(
+            by=By.XPATH,
+            value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[1]/div/select/option[1]",
+        )
+        ActionChains(self.driver).key_down(Keys.CONTROL).click(select_all_status_field).key_up(
+            Keys.CONTROL
+        ).perform()
+
+        # Click the human field
+        human_class_field = self.driver.find_element(
+            by=By.XPATH,
+            value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[7]/div/select/option[3]",
+        )
+        human_class_field.click()
+        # Unclick the select all field
+        select_all_class_field = self.driver.find_element(
+            by=By.XPATH,
+            value="/html/body/main/div[1]/div[1]/div[3]/form/fieldset[3]/div[7]/div/select/option[1]",
+        )
+        ActionChains(self.driver).key_down(Keys.CONTROL).click(select_all_class_field).key_up(
+            Keys.CONTROL
+        ).perform()
+
+        # Click the search button
+        search_button = self.driver.find_element(
+            by=By.XPATH,
+            value="/html/body/main/div[1]/div[1]/div[3]/form/div[1]/div/input[1]",
+        )
+        search_button.click()
 
-                # Wait a bit for it to load
-                time.sleep(10)
+        # Wait for the results to load
+        WebDriverWait(self.driver, 60).until(
+            expected_conditions.presence_of_element_located((By.CSS_SELECTOR, "table tbody tr"))
+        )
 
+    def get_result_pages_selenium(self):
+        for t in self.get_backoff_time(5):
+            try:
+                time.sleep(t)
+                self.search_selenium()
                 # Grab the result webpage
                 soup = BeautifulSoup(self.driver.page_source, "html.parser")
                 table = soup.find("table")
                 table_attrs = json.loads(table.get("data-wb-tables"))
-                # num_displayed_results = table_attrs["iDisplayLength"]
                 num_total_results = table_attrs["iDeferLoading"]
                 # No error means success, break out of the loop
                 break
             except Exception as e:
                 logger.error(self.style.ERROR(repr(e)))
                 logger.error("Failed to get HC result. Retrying")
+        else:
+            logger.error(self.style.ERROR("Failed to get HC result"))
+            return
 
-        drug_label_parsed = 0
-        # Iterate all the drugs in the table
-        while drug_label_parsed < num_total_results:
+        rows_seen = 0
+        while rows_seen < num_total_results:
             soup = BeautifulSoup(self.driver.page_source, "html.parser")
-            table = soup.find("table")
-            table_body = table.find("tbody")
-            rows = table_body.find_all("tr")
-            # Iterate all the products in the table
-            for row in rows:
-                source_product_number = row.find_all("td")[1].text.strip()
-                # first see if it's a label with a known error; if so, skip it
-                if self.skip_errors:
-                    existing_errors = ParsingError.objects.filter(
-                        source="HC", source_product_number=source_product_number
-                    )
-                    if existing_errors.count() >= 1:
-                        logger.warning(
-                            self.style.WARNING(
-                                f"Label skipped. Known error: {existing_errors[0].error_type}"
-                            )
-                        )
-                        continue
-                # then see if it's a label we've already parsed recently; if so, skip it
-                existing_labels = DrugLabel.objects.filter(
-                    source="HC", source_product_number=source_product_number
-                ).order_by("-updated_at")
-                if existing_labels.count() >= 1:
-                    existing_label = existing_labels[0]
-                    if check_recently_updated(
-                        dl=existing_label, skip_timeframe=self.skip_labels_updated_within_span
-                    ):
-                        last_updated_ago = (
-                            datetime.datetime.now(datetime.timezone.utc) - existing_label.updated_at
-                        )
-                        logger.warning(
-                            self.style.WARNING(
-                                f"Label skipped. Updated {strfdelta(last_updated_ago)} ago, less than {self.skip_labels_updated_within_span}"
-                            )
-                        )
-                        continue
-
-                try:
-                    dl = self.get_drug_label_from_row(row)
-                    logger.debug(repr(dl))
-                    # dl.link is url of pdf
-                    # for now, assume only one LabelProduct per DrugLabel
-                    lp = LabelProduct(drug_label=dl)
-                    lp.save()
-                    if dl.link == "":
-                        raise ValueError(f"{dl.product_name} doesn't have a PDF label")
-                    dl.raw_text = self.get_and_parse_pdf(dl.link, dl.source_product_number, lp)
-                    dl.save()
-                    self.num_drug_labels_parsed += 1
-                except IntegrityError as e:
-                    logger.warning(self.style.WARNING("Label already in db"))
-                    logger.debug(e, exc_info=True)
-                except AttributeError as e:
-                    logger.warning(self.style.ERROR(repr(e)))
-                    # TODO add to error table - need the PDF url?
-                    msg = str(repr(e))
-                    parsing_error, created = ParsingError.objects.get_or_create(
-                        source="HC",
-                        message=msg,
-                        source_product_number=source_product_number,
-                        error_type="attribute_error",
-                    )
-                    if created:
-                        logger.warning(f"Created ParsingError {parsing_error}")
-                    else:
-                        logger.warning(
-                            f"Failed to create ParsingError {parsing_error} - likely already exists"
-                        )
-                except ValueError as e:
-                    # Typically ValueError("AG-TOPIRAMATE TABLETS 200 MG doesn't have a PDF label")
-                    logger.warning(self.style.WARNING(repr(e)))
-                    msg = str(repr(e))
-                    parsing_error, created = ParsingError.objects.get_or_create(
-                        source_product_number=source_product_number,
-                        message=msg,
-                        source="HC",
-                        error_type="no_pdf",
+            rows = soup.find("table").find("tbody").find_all("tr")
+            rows_seen += len(rows)
+            yield rows
+            # Click the next button
+            next_button = self.driver.find_element(by=By.ID, value="results_next")
+            if next_button is None or rows_seen >= num_total_results:
+                break
+            first_row = self.driver.find_element(by=By.CSS_SELECTOR, value="table tbody tr")
+            next_button.click()
+            # Wait for the next page to replace the rows, take awhile for it to load
+            WebDriverWait(self.driver, 60).until(expected_conditions.staleness_of(first_row))
+
+    def should_skip_row(self, row):
+        """Skip labels with a known parsing error, or that have been parsed recently"""
+        source_product_number = row.find_all("td")[1].text.strip()
+        # first see if it's a label with a known error; if so, skip it
+        if self.skip_errors:
+            existing_errors = ParsingError.objects.filter(
+                source="HC", source_product_number=source_product_number
+            )
+            if existing_errors.count() >= 1:
+                logger.warning(
+                    self.style.WARNING(
+                        f"Label skipped. Known error: {existing_errors[0].error_type}"
                     )
-                    if created:
-                        logger.warning(f"Created ParsingError {parsing_error}")
-                    else:
-                        logger.warning(
-                            f"Failed to create ParsingError {parsing_error} - likely already exists"
-                        )
-                except DataError as e:
-                    # Got one Data Error:
-                    # 2023-04-18 06:12:49,645 ERROR DataError('PostgreSQL text fields cannot contain NUL (0x00) bytes')
-                    # 2023-04-18 06:12:49,645 ERROR Failed to process /app/media/hc_dV1W8Qo.pdf, url = https://pdf.hres.ca/dpd_pm/00058978.PDF
-                    # Could try to clean it? https://stackoverflow.com/questions/57371164/django-postgres-a-string-literal-cannot-contain-nul-0x00-characters
-                    logger.error(self.style.ERROR(e))
-                    msg = str(repr(e))
-                    parsing_error, created = ParsingError.objects.get_or_create(
-                        source="HC",
-                        source_product_number=source_product_number,
-                        message=msg,
-                        error_type="data_error",
+                )
+                return True
+        # then see if it's a label we've already parsed recently; if so, skip it
+        existing_labels = DrugLabel.objects.filter(
+            source="HC", source_product_number=source_product_number
+        ).order_by("-updated_at")
+        if existing_labels.count() >= 1:
+            existing_label = existing_labels[0]
+            if check_recently_updated(
+                dl=existing_label, skip_timeframe=self.skip_labels_updated_within_span
+            ):
+                last_updated_ago = (
+                    datetime.datetime.now(datetime.timezone.utc) - existing_label.updated_at
+                )
+                logger.warning(
+                    self.style.WARNING(
+                        f"Label skipped. Updated {strfdelta(last_updated_ago)} ago, less than {self.skip_labels_updated_within_span}"
                     )
-                    if created:
-                        logger.warning(f"Created ParsingError {parsing_error}")
-                    else:
-                        logger.warning(
-                            f"Failed to create ParsingError {parsing_error} - likely already exists"
-                        )
-                time.sleep(0.5)
-                drug_label_parsed += 1
-                # For test, if it succesfully parses 3 labels, then break
-                if import_type == "test" and drug_label_parsed == 3:
-                    break
-            if import_type == "test":
-                break
-            else:
-                # Click the next button
-                next_button = self.driver.find_element(by=By.ID, value="results_next")
-                if next_button is not None and drug_label_parsed < num_total_results:
-                    next_button.click()
-                    # Wait for a bit, take awhile for it to load
-                    time.sleep(10)
-                else:
-                    break
+                )
+                return True
+        return False
 
-        for url in self.error_urls.keys():
-            logger.warning(self.style.WARNING(f"error parsing url: {url}"))
-        logger.info(f"num_drug_labels_parsed: {self.num_drug_labels_parsed}")
-        logger.info(self.style.SUCCESS("process complete"))
-        return
+    def prefetch_detail_pages(self, rows):
+        """Download the drug detail pages of a page of rows in parallel;
+        requests_with_retries picks them up from prefetched_pages.
+        """
+        urls = [url for url in map(self.detail_page_url, rows) if url is not None]
+        page_requests = ({"method": "GET", "url": url} for url in urls)
+        for kwargs, response in fetch_in_order(self.session, page_requests, self.concurrency):
+            if not isinstance(response, Exception) and response.ok:
+                self.prefetched_pages[kwargs["url"]] = response
+
+    def detail_page_url(self, row):
+        """The drug details page the row's DIN links to, None if the row has no link;
+        get_drug_label_from_row raises the error for such a row
+        """
+        try:
+            return HC_BASE_URL + row.find_all("td")[1].find("a")["href"]
+        except (IndexError, TypeError):
+            return None
+
+    def process_row(self, row):
+        source_product_number = row.find_all("td")[1].text.strip()
+        try:
+            dl = self.get_drug_label_from_row(row)
+            logger.debug(repr(dl))
+            # dl.link is url of pdf
+            # for now, assume only one LabelProduct per DrugLabel
+            lp = LabelProduct(drug_label=dl)
+            lp.save()
+            if dl.link == "":
+                raise ValueError(f"{dl.product_name} doesn't have a PDF label")
+            dl.raw_text = self.get_and_parse_pdf(dl.link, dl.source_product_number, lp)
+            dl.save()
+            self.num_drug_labels_parsed += 1
+            label_ingested.send(sender=self.__class__, drug_label=dl)
+        except IntegrityError as e:
+            logger.warning(self.style.WARNING("Label already in db"))
+            logger.debug(e, exc_info=True)
+        except AttributeError as e:
+            logger.warning(self.style.ERROR(repr(e)))
+            # TODO add to error table - need the PDF url?
+            msg = str(repr(e))
+            parsing_error, created = ParsingError.objects.get_or_create(
+                source="HC",
+                message=msg,
+                source_product_number=source_product_number,
+                error_type="attribute_error",
+            )
+            if created:
+                logger.warning(f"Created ParsingError {parsing_error}")
+            else:
+                logger.warning(
+                    f"Failed to create ParsingError {parsing_error} - likely already exists"
+                )
+        except ValueError as e:
+            # Typically ValueError("AG-TOPIRAMATE TABLETS 200 MG doesn't have a PDF label")
+            logger.warning(self.style.WARNING(repr(e)))
+            msg = str(repr(e))
+            parsing_error, created = ParsingError.objects.get_or_create(
+                source_product_number=source_product_number,
+                message=msg,
+                source="HC",
+                error_type="no_pdf",
+            )
+            if created:
+                logger.warning(f"Created ParsingError {parsing_error}")
+            else:
+                logger.warning(
+                    f"Failed to create ParsingError {parsing_error} - likely already exists"
+                )
+        except DataError as e:
+            # Got one Data Error:
+            # 2023-04-18 06:12:49,645 ERROR DataError('PostgreSQL text fields cannot contain NUL (0x00) bytes')
+            # 2023-04-18 06:12:49,645 ERROR Failed to process /app/media/hc_dV1W8Qo.pdf, url = https://pdf.hres.ca/dpd_pm/00058978.PDF
+            # Could try to clean it? https://stackoverflow.com/questions/57371164/django-postgres-a-string-literal-cannot-contain-nul-0x00-characters
+            logger.error(self.style.ERROR(e))
+            msg = str(repr(e))
+            parsing_error, created = ParsingError.objects.get_or_create(
+                source="HC",
+                source_product_number=source_product_number,
+                message=msg,
+                error_type="data_error",
+            )
+            if created:
+                logger.warning(f"Created ParsingError {parsing_error}")
+            else:
+                logger.warning(
+                    f"Failed to create ParsingError {parsing_error} - likely already exists"
+                )
+        finally:
+            # don't hold on to pages that weren't used, e.g. if the row failed before requesting its page
+            self.prefetched_pages.pop(self.detail_page_url(row), None)
 
     def get_drug_label_from_row(self, row):
         dl = DrugLabel()  # empty object to populate as we go
@@ -407,12 +628,16 @@ class Command(BaseCommand):
             yield 2**i + random.uniform(0, 1)
 
     def requests_with_retries(self, url):
+        # the page may already have been downloaded with the rest of its batch
+        response = self.prefetched_pages.pop(url, None)
+        if response is not None:
+            return response
         # have a backoff time for pulling the pdf from the website
         for t in self.get_backoff_time(5):
             try:
                 logger.info(f"time to sleep: {t}")
                 time.sleep(t)
-                response = requests.get(url)
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT)
                 break  # no Exception means we were successful
             except:
                 logger.error(f"Failed. Retry to request {url}")
@@ -437,65 +662,15 @@ class Command(BaseCommand):
         return raw_text
 
     def get_pdf_sections_with_format(self, text, section_format):
-        idx, headers, sections = [], [], []
-        start_idx = 0
-        for section in section_format:
-            for i, line in enumerate(text[start_idx:], start=start_idx):
-                if re.match(section, line.upper()):
-                    start_idx = i + 1  # +1 to start at next line
-                    idx += [i]
-                    headers += [line.strip()]
-                    break
-
-        if len(headers) != 0:
-            idx, headers = filter_headers(idx, headers)
-
-        for n, h in enumerate(headers):
-            if (n + 1) < len(headers):
-                contents = text[idx[n] + 1 : idx[n + 1]]
-            else:
-                contents = text[idx[n] + 1 :]
-            sections += ["\n".join(contents)]
-
-        return headers, sections
-
-    centers = [
-        "Indications",
-        "Indications and Clinical Use",
-        "Contraindications",
-        "Serious Warnings and Precautions Box",
-        "Dosage And Administration",
-        "Overdosage",
-        "Dosage Forms, Strenths, Composition, and Packaging",
-        "Warnings and Precautions",
-        "Warnings",
-        "Precautions",
-        "Adverse Reactions",
-        "Drug Interactions",
-        "Clinical Pharmacology",
-        "Storage, Stability and Disposal",
-        "Special Handling Instructions",
-        "Pharmaceutical Information",
-        "Clinical Trials",
-        "Microbiology",
-        "Non-clinical Toxicology",
-        "Supporting Product Monographs",
-        "Summary Product Information",
-        "Toxicology",
-        "Description",
-    ]
+        # only the first line matching each pattern after the previous header, case insensitive
+        return get_pdf_sections_with_format(
+            text, section_format, all_matches=False, upper=True, headers_filter=True
+        )
 
     # improved initial text parsing step so this clustering problem wasn't so messy
     def get_fixed_header(self, text):
-        # return center with the lowest edit distance,
-        #   or placeholder (last entry) if no there's good match
-        dists = [levdistance(text.lower(), c.lower()) for c in self.centers]
-        # ix = np.argmin(dists)
-        ix = dists.index(min(dists))
-        if dists[ix] > 0.6 * len(text):
-            return None
-        else:
-            return self.centers[ix]
+        # return the section name with the lowest edit distance, or None if there's no good match
+        return HC_SECTION_MATCHER.match(text)
 
     def fix_headers(self, headers, sections):
         label_text = {}
@@ -509,6 +684,30 @@ class Command(BaseCommand):
                     label_text[header].append(s)
         return label_text
 
+    def get_label_text(self, text):
+        """Split the text of a PDF into sections
+        Returns: the sections' text by section name; form: {section name: [text, ...]}
+        """
+        # joined once for both parsing methods
+        joined_text = JoinedText(text)
+
+        # Match headers that start with section numbers (e,g, 4.1)
+        headers, sections = get_pdf_sections(joined_text, pattern=r"^[1-9][0-9]?\.?\s+[A-Z].*")
+        label_text = self.fix_headers(headers, sections)
+
+        # With the above method, it should at least find 10 sections, if less than that,
+        #  then parse it with other method
+        if len(label_text) < 10:
+            logger.info("Failed to parse. Using another method...")
+            # Method that parses for headers with more rigid regular expressions
+            headers, sections = self.get_pdf_sections_with_format(
+                joined_text, OTHER_FORMATTED_SECTIONS
+            )
+            label_text = self.fix_headers(headers, sections)
+            if len(label_text) == 0:
+                raise PDFParseException("Failed to parse pdf with both methods")
+        return label_text
+
     def process_hc_pdf_file(
         self, hc_file, lp, source_product_number="", pdf_url="", my_label_id=None
     ):
@@ -516,28 +715,14 @@ class Command(BaseCommand):
         label_text = {}  # next level = product page w/ metadata
 
         try:
-            raw_text = read_pdf(hc_file, no_margins=False, no_annex=False)
+            raw_text, sha256 = read_pdf_cached(hc_file, no_margins=False, no_annex=False)
+            lp.drug_label.pdf_sha256 = sha256
 
             info = {}
             if my_label_id is None:
                 product_code = source_product_number
 
-            headers, sections = [], []
-            # Match headers that start with section numbers (e,g, 4.1)
-            headers, sections = get_pdf_sections(raw_text, pattern=r"^[1-9][0-9]?\.?\s+[A-Z].*")
-            label_text = self.fix_headers(headers, sections)
-
-            # With the above method, it should at least find 10 sections, if less than that,
-            #  then parse it with other method
-            if len(label_text) < 10:
-                logger.info("Failed to parse. Using another method...")
-                # Method that parses for headers with more rigid regular expressions
-                headers, sections = self.get_pdf_sections_with_format(
-                    raw_text, OTHER_FORMATTED_SECTIONS
-                )
-                label_text = self.fix_headers(headers, sections)
-                if len(label_text) == 0:
-                    raise PDFParseException("Failed to parse pdf with both methods")
+            label_text = self.get_label_text(raw_text)
 
             for index, key in enumerate(label_text):
                 text_block = ""
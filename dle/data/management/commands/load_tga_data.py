@@ -1,10 +1,10 @@
 import datetime
 import logging
 import random
-import re
 import string
 import time
 from distutils.util import strtobool
+from urllib.parse import urljoin
 
 from django.conf import settings
 from django.core.files.base import ContentFile
@@ -14,22 +14,42 @@ from django.db import IntegrityError
 
 import requests
 from bs4 import BeautifulSoup
-from Levenshtein import distance as levdistance
 from requests.exceptions import ChunkedEncodingError
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
 from data.models import DrugLabel, LabelProduct, ParsingError, ProductSection
-from data.util import PDFParseException, check_recently_updated, convert_date_string, strfdelta
+from data.section_matcher import TGA_SECTION_MATCHER
+from data.signals import label_ingested
+from data.util import (
+    PDFParseException,
+    ScrapingHandshakeException,
+    check_recently_updated,
+    convert_date_string,
+    strfdelta,
+)
 from users.models import MyLabel
 
-from .pdf_parsing_helper import get_pdf_sections, read_pdf
+from .pdf_parsing_helper import (
+    JoinedText,
+    get_pdf_sections,
+    get_pdf_sections_with_format,
+    read_pdf_cached,
+)
+from .scraping_helper import REQUEST_TIMEOUT, build_session, fetch_in_order
 
 
 logger = logging.getLogger(__name__)
 
 TGA_BASE_URL = "https://www.ebs.tga.gov.au/ebs/picmi/picmirepository.nsf/"
+TGA_DISCLAIMER_URL = TGA_BASE_URL + "/pdf?OpenAgent"
+# CSS equivalent of the xpath to the accept button: /html/body/form/div[2]/div[3]/div[1]/a[1]
+TGA_ACCEPT_BUTTON_SELECTOR = (
+    "form > div:nth-of-type(2) > div:nth-of-type(3) > div:nth-of-type(1) > a"
+)
 
 OTHER_FORMATTED_SECTIONS = [
     r"^NAME OF THE MEDICINE",
@@ -55,6 +75,8 @@ OTHER_FORMATTED_SECTIONS = [
 # add `--type full` to import the full dataset
 # add `--verbosity 2` for info output
 # add `--verbosity 3` for debug output
+# add `--client selenium` to accept the access terms with a headless browser instead of plain HTTP
+# add `--concurrency N` to download N pages / PDFs at a time
 # support for my_labels with: --type my_label --my_label_id ml.id
 class Command(BaseCommand):
     help = "Loads data from TGA"
@@ -69,12 +91,25 @@ class Command(BaseCommand):
         "dictionary to keep track of the urls that have parsing errors; form: {url: True}"
         self.options = Options()
         self.options.add_argument("--headless")
-        self.driver = webdriver.Firefox(options=self.options)
+        self._driver = None
+        "the Selenium driver is only started if the plain HTTP handshake fails, see `driver`"
+        self.client = "http"
+        self.concurrency = 4
+        self.session = build_session(self.concurrency)
+        self.prefetched_pdfs = {}
+        "PDF responses downloaded ahead of parsing; form: {pdf_url: response}"
         self.total_to_process = 0
         self.processed_with_current_cookies = 0
         self.cookies = None
         self.skip_errors = True
 
+    @property
+    def driver(self):
+        if self._driver is None:
+            logger.info("Starting headless Firefox")
+            self._driver = webdriver.Firefox(options=self.options)
+        return self._driver
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--type",
@@ -100,22 +135,66 @@ class Command(BaseCommand):
             help="Skip labels that have previously had parsing errors. Default is True",
             default=True,
         )
+        parser.add_argument(
+            "--client",
+            type=str,
+            help="'http' replays the access terms handshake with a plain HTTP session and falls back to "
+            "'selenium' (headless Firefox) if that fails. Default is 'http'",
+            default="http",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Number of pages / PDFs to download at a time. Default is 4",
+            default=4,
+        )
 
     def get_tga_cookies(self) -> dict:
         """Get cookies from TGA website
         Accept the access terms
         Store the cookies and include with BeautifulSoup requests
         """
+        if self.client == "http":
+            try:
+                return self.get_tga_cookies_http()
+            except ScrapingHandshakeException as e:
+                logger.warning(self.style.WARNING(f"{repr(e)}, falling back to Selenium"))
+                self.client = "selenium"
+        return self.get_tga_cookies_selenium()
+
+    def get_tga_cookies_http(self) -> dict:
+        """Accept the access terms by following the accept link with the shared session"""
+        self.session.cookies.clear()
+        try:
+            response = self.session.get(TGA_DISCLAIMER_URL, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, "html.parser")
+            button = soup.select_one(TGA_ACCEPT_BUTTON_SELECTOR)
+            href = button.get("href", "") if button else ""
+            if not href or href.startswith("javascript"):
+                raise ScrapingHandshakeException("Could not find the TGA access terms accept link")
+            response = self.session.get(urljoin(response.url, href), timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ScrapingHandshakeException(f"TGA access terms request failed: {repr(e)}")
+        cookies = self.session.cookies.get_dict()
+        if not cookies:
+            raise ScrapingHandshakeException("TGA access terms handshake did not set any cookies")
+        logger.info("Got or renewed cookies")
+        return cookies
+
+    def get_tga_cookies_selenium(self) -> dict:
         self.driver.delete_all_cookies()
-        self.driver.get(TGA_BASE_URL + "/pdf?OpenAgent")
-        time.sleep(1)
+        self.driver.get(TGA_DISCLAIMER_URL)
         # This is the xpath to the accept button
-        button = self.driver.find_element(
-            by=By.XPATH, value="/html/body/form/div[2]/div[3]/div[1]/a[1]"
+        button = WebDriverWait(self.driver, 30).until(
+            expected_conditions.element_to_be_clickable(
+                (By.XPATH, "/html/body/form/div[2]/div[3]/div[1]/a[1]")
+            )
         )
         self.driver.execute_script("arguments[0].click();", button)
-        # Wait a bit for it to load
-        time.sleep(5)
+        # Wait for the accept page to navigate away rather than for a fixed time
+        WebDriverWait(self.driver, 30).until(expected_conditions.staleness_of(button))
         driver_cookies = self.driver.get_cookies()
         cookies = {c["name"]: c["value"] for c in driver_cookies}
         logger.info("Got or renewed cookies")
@@ -129,6 +208,11 @@ class Command(BaseCommand):
         import_type = options["type"]
         if import_type not in ["full", "test", "my_label"]:
             raise CommandError("'type' parameter must be 'full', 'test', or 'my_label'")
+        self.client = options["client"]
+        if self.client not in ["http", "selenium"]:
+            raise CommandError("'client' parameter must be 'http' or 'selenium'")
+        self.concurrency = max(1, options["concurrency"])
+        self.session = build_session(self.concurrency)
 
         # basic logging config is in settings.py
         # verbosity is 1 by default, gives critical, error and warning output
@@ -159,7 +243,7 @@ class Command(BaseCommand):
             lp = LabelProduct(drug_label=dl)
             lp.save()
             dl.raw_text, label_text = self.process_tga_pdf_file(
-                tga_file=tga_file, my_label_id=my_label_id
+                tga_file=tga_file, my_label_id=my_label_id, dl=dl
             )
             dl.save()
             self.save_product_sections(lp, label_text)
@@ -176,126 +260,157 @@ class Command(BaseCommand):
 
         self.cookies = self.get_tga_cookies()
 
-        # Iterate all the query URLs
-        for url in urls:
+        # Grab the index webpages, `concurrency` at a time, in order
+        index_requests = ({"method": "GET", "url": url} for url in urls)
+        for kwargs, response in fetch_in_order(self.session, index_requests, self.concurrency):
+            url = kwargs["url"]
             logger.info(f"processing url: {url}")
-            # Grab the webpage
-            response = requests.get(url)
+            if isinstance(response, Exception):
+                logger.error(self.style.ERROR(f"unable to grab url contents: {repr(response)}"))
+                self.error_urls[url] = True
+                continue
             soup = BeautifulSoup(response.text, "html.parser")
             table = soup.find("table")
             table_body = table.find("tbody")
             rows = table_body.find_all("tr")
-            # Iterate all the products in the table
-            for row in rows:
+            # Iterate all the products in the table, downloading the PDFs of a batch in parallel
+            for batch_start in range(0, len(rows), self.concurrency):
                 # If we have processed a bunch of labels, get a new cookie so we don't time out
                 if self.processed_with_current_cookies >= 200:
                     new_cookies = self.get_tga_cookies()
                     self.cookies = new_cookies
                     self.processed_with_current_cookies = 0
 
-                # if the label has been parsed recently, skip
-                # Get the PDF link
-                pdf_link = None
-                try:
-                    pdf_link = TGA_BASE_URL + row.find_all("td")[1].find("a")["href"]
-                except IndexError:
-                    # Not saving to ParsingErrors, no URL to track down?
-                    logger.warning(
-                        "IndexError - could not generate PDF link to check if possible existing labels have been recently updated"
-                    )
-
-                if pdf_link:
-                    # first see if it's a label with a known error; if so, skip
-                    # TODO does version_date come into play here at all?
-                    if self.skip_errors:
-                        existing_errors = ParsingError.objects.filter(source="TGA", url=pdf_link)
-                        if existing_errors.count() >= 1:
-                            logger.warning(
-                                self.style.WARNING(
-                                    f"Label skipped. Known error: {existing_errors[0].error_type}"
-                                )
-                            )
-                            continue
-
-                    # next, see if it's a label that's been recently updated; if so, skip
-                    # possibly multiple DLs with the same link (versions), so get the newest
-                    existing_labels = DrugLabel.objects.filter(
-                        source="TGA", link=pdf_link
-                    ).order_by("-updated_at")
-                    if existing_labels.count() >= 1:
-                        existing_label = existing_labels[0]
-                        if check_recently_updated(
-                            dl=existing_label, skip_timeframe=self.skip_labels_updated_within_span
-                        ):
-                            last_updated_ago = (
-                                datetime.datetime.now(datetime.timezone.utc)
-                                - existing_label.updated_at
-                            )
-                            logger.warning(
-                                self.style.WARNING(
-                                    f"Label skipped. Updated {strfdelta(last_updated_ago)} ago, less than {self.skip_labels_updated_within_span}"
-                                )
-                            )
-                            continue
-                    else:
-                        logger.info("No existing labels with this PDF link, continuing parsing")
-
-                try:
-                    dl, label_text = self.get_drug_label_from_row(soup, row, self.cookies)
-                    logger.debug(repr(dl))
-                    # dl.link is url of pdf
-                    # for now, assume only one LabelProduct per DrugLabel
-                    lp = LabelProduct(drug_label=dl)
-                    lp.save()
-                    self.save_product_sections(lp, label_text)
-                    self.num_drug_labels_parsed += 1
-                except IntegrityError as e:
-                    logger.warning(self.style.WARNING("Label already in db"))
-                    logger.debug(e, exc_info=True)
-                except AttributeError as e:
-                    # Typically: 'Failed to parse for version date () ...'
-                    logger.warning(self.style.ERROR(repr(e)))
-                    msg = str(repr(e))
-                    # TODO make error type parsing a function
-                    error_type = None
-                    if (
-                        "Failed to parse for version date ()" in msg
-                        or "Failed to parse for version date( )" in msg
-                    ):
-                        error_type = "version_date_empty"
-                    elif "Failed to parse for version date" in msg:
-                        error_type = "version_date_parse"
-
-                    parsing_error, created = ParsingError.objects.get_or_create(
-                        url=pdf_link, message=msg, source="TGA", error_type=error_type
-                    )
-                    if created:
-                        logger.warning(f"Created ParsingError {parsing_error}")
-                    else:
-                        logger.info(f"ParsingError {parsing_error} already exists")
-                except PDFParseException as e:
-                    # Typically "Failed to parse pdf with both methods"
-                    logger.warning(self.style.ERROR(repr(e)))
-                    msg = str(repr(e))
-                    parsing_error, created = ParsingError.objects.get_or_create(
-                        url=pdf_link, message=msg, source="TGA", error_type="pdf_error"
-                    )
-                except ValueError as e:
-                    logger.warning(self.style.WARNING(repr(e)))
-                    # TODO see what errors these are to create ParsingErrors for them
-                except Exception as e:
-                    logger.error(self.style.ERROR(repr(e)))
-                    # TODO see what errors these are to create ParsingErrors for them
-                # increment this regardless of success, still takes time
-                self.processed_with_current_cookies += 1
+                batch = []
+                for row in rows[batch_start : batch_start + self.concurrency]:
+                    # Get the PDF link
+                    pdf_link = None
+                    try:
+                        pdf_link = TGA_BASE_URL + row.find_all("td")[1].find("a")["href"]
+                    except IndexError:
+                        # Not saving to ParsingErrors, no URL to track down?
+                        logger.warning(
+                            "IndexError - could not generate PDF link to check if possible existing labels have been recently updated"
+                        )
+                    if pdf_link and self.should_skip_label(pdf_link):
+                        continue
+                    batch.append((row, pdf_link))
+
+                self.prefetch_pdfs([pdf_link for _, pdf_link in batch if pdf_link])
+                for row, pdf_link in batch:
+                    self.process_row(soup, row, pdf_link)
+                    # increment this regardless of success, still takes time
+                    self.processed_with_current_cookies += 1
 
             for url in self.error_urls.keys():
                 logger.warning(self.style.WARNING(f"error parsing url: {url}"))
 
+        if self._driver is not None:
+            self._driver.quit()
         logger.info(f"num_drug_labels_parsed: {self.num_drug_labels_parsed}")
         logger.info(self.style.SUCCESS("process complete"))
         return
 
+    def should_skip_label(self, pdf_link):
+        """Skip labels with a known parsing error, or that have been parsed recently"""
+        # first see if it's a label with a known error; if so, skip
+        # TODO does version_date come into play here at all?
+        if self.skip_errors:
+            existing_errors = ParsingError.objects.filter(source="TGA", url=pdf_link)
+            if existing_errors.count() >= 1:
+                logger.warning(
+                    self.style.WARNING(
+                        f"Label skipped. Known error: {existing_errors[0].error_type}"
+                    )
+                )
+                return True
+
+        # next, see if it's a label that's been recently updated; if so, skip
+        # possibly multiple DLs with the same link (versions), so get the newest
+        existing_labels = DrugLabel.objects.filter(source="TGA", link=pdf_link).order_by(
+            "-updated_at"
+        )
+        if existing_labels.count() >= 1:
+            existing_label = existing_labels[0]
+            if check_recently_updated(
+                dl=existing_label, skip_timeframe=self.skip_labels_updated_within_span
+            ):
+                last_updated_ago = (
+                    datetime.datetime.now(datetime.timezone.utc) - existing_label.updated_at
+                )
+                logger.warning(
+                    self.style.WARNING(
+                        f"Label skipped. Updated {strfdelta(last_updated_ago)} ago, less than {self.skip_labels_updated_within_span}"
+                    )
+                )
+                return True
+        else:
+            logger.info("No existing labels with this PDF link, continuing parsing")
+        return False
+
+    def prefetch_pdfs(self, pdf_urls):
+        """Download a batch of PDFs in parallel; get_and_parse_pdf picks them up from prefetched_pdfs.
+        Failed downloads are not stored, get_and_parse_pdf retries them with a backoff.
+        """
+        pdf_requests = ({"method": "GET", "url": url, "cookies": self.cookies} for url in pdf_urls)
+        for kwargs, response in fetch_in_order(self.session, pdf_requests, self.concurrency):
+            if isinstance(response, Exception) or not response.ok:
+                logger.warning(self.style.WARNING(f"prefetch failed for {kwargs['url']}"))
+                continue
+            self.prefetched_pdfs[kwargs["url"]] = response
+
+    def process_row(self, soup, row, pdf_link):
+        try:
+            dl, label_text = self.get_drug_label_from_row(soup, row, self.cookies)
+            logger.debug(repr(dl))
+            # dl.link is url of pdf
+            # for now, assume only one LabelProduct per DrugLabel
+            lp = LabelProduct(drug_label=dl)
+            lp.save()
+            self.save_product_sections(lp, label_text)
+            self.num_drug_labels_parsed += 1
+            label_ingested.send(sender=self.__class__, drug_label=dl)
+        except IntegrityError as e:
+            logger.warning(self.style.WARNING("Label already in db"))
+            logger.debug(e, exc_info=True)
+        except AttributeError as e:
+            # Typically: 'Failed to parse for version date () ...'
+            logger.warning(self.style.ERROR(repr(e)))
+            msg = str(repr(e))
+            # TODO make error type parsing a function
+            error_type = None
+            if (
+                "Failed to parse for version date ()" in msg
+                or "Failed to parse for version date( )" in msg
+            ):
+                error_type = "version_date_empty"
+            elif "Failed to parse for version date" in msg:
+                error_type = "version_date_parse"
+
+            parsing_error, created = ParsingError.objects.get_or_create(
+                url=pdf_link, message=msg, source="TGA", error_type=error_type
+            )
+            if created:
+                logger.warning(f"Created ParsingError {parsing_error}")
+            else:
+                logger.info(f"ParsingError {parsing_error} already exists")
+        except PDFParseException as e:
+            # Typically "Failed to parse pdf with both methods"
+            logger.warning(self.style.ERROR(repr(e)))
+            msg = str(repr(e))
+            parsing_error, created = ParsingError.objects.get_or_create(
+                url=pdf_link, message=msg, source="TGA", error_type="pdf_error"
+            )
+        except ValueError as e:
+            logger.warning(self.style.WARNING(repr(e)))
+            # TODO see what errors these are to create ParsingErrors for them
+        except Exception as e:
+            logger.error(self.style.ERROR(repr(e)))
+            # TODO see what errors these are to create ParsingErrors for them
+        finally:
+            # don't hold on to PDFs that weren't used, e.g. if the row failed before downloading
+            self.prefetched_pdfs.pop(pdf_link, None)
+
     def get_drug_label_from_row(self, soup, row, cookies):
         dl = DrugLabel()  # empty object to populate as we go
         dl.source = "TGA"
@@ -310,7 +425,9 @@ class Command(BaseCommand):
         dl.generic_name = columns[2].text.strip()
 
         # get version date from the pdf
-        dl.raw_text, label_text = self.get_and_parse_pdf(dl.link, dl.source_product_number, cookies)
+        dl.raw_text, label_text = self.get_and_parse_pdf(
+            dl.link, dl.source_product_number, cookies, dl=dl
+        )
         parsed_date = None
         date_string = ""
         # First to look for date of revision, if it exists and contains a valid date, then store that date
@@ -354,18 +471,21 @@ class Command(BaseCommand):
         for i in range(tries - 1):
             yield 2**i + random.uniform(0, 1)
 
-    def get_and_parse_pdf(self, pdf_url, source_product_number, cookies):
-        # have a backoff time for pulling the pdf from the website
-        for t in self.get_backoff_time(5):
-            try:
-                logger.info(f"time to sleep: {t}")
-                time.sleep(t)
-                response = requests.get(pdf_url, cookies=cookies)
-                break  # no Exception means we were successful
-            except (ValueError, ChunkedEncodingError) as e:
-                logger.error(self.style.ERROR(f"caught error: {e.__class__.__name__}"))
-                logger.warning(self.style.WARNING("Unable to read url, may continue"))
-                response = None
+    def get_and_parse_pdf(self, pdf_url, source_product_number, cookies, dl=None):
+        # the PDF may already have been downloaded with the rest of its batch
+        response = self.prefetched_pdfs.pop(pdf_url, None)
+        if response is None:
+            # have a backoff time for pulling the pdf from the website
+            for t in self.get_backoff_time(5):
+                try:
+                    logger.info(f"time to sleep: {t}")
+                    time.sleep(t)
+                    response = self.session.get(pdf_url, cookies=cookies, timeout=REQUEST_TIMEOUT)
+                    break  # no Exception means we were successful
+                except (ValueError, ChunkedEncodingError, requests.Timeout) as e:
+                    logger.error(self.style.ERROR(f"caught error: {e.__class__.__name__}"))
+                    logger.warning(self.style.WARNING("Unable to read url, may continue"))
+                    response = None
         if not response:
             logger.error(self.style.ERROR("unable to grab url contents"))
             self.error_urls[pdf_url] = True
@@ -376,7 +496,9 @@ class Command(BaseCommand):
         )
         logger.info(f"saved {pdf_url} file to: {filename}")
         tga_file = settings.MEDIA_ROOT / filename
-        raw_text, label_text = self.process_tga_pdf_file(tga_file, source_product_number, pdf_url)
+        raw_text, label_text = self.process_tga_pdf_file(
+            tga_file, source_product_number, pdf_url, dl=dl
+        )
         # delete the file when done
         default_storage.delete(filename)
 
@@ -385,120 +507,61 @@ class Command(BaseCommand):
         return raw_text, label_text
 
     def get_pdf_sections_with_format(self, text, section_format):
-        idx, headers, sections = [], [], []
-        start_idx = 0
-        for section in section_format:
-            for i, line in enumerate(text[start_idx:], start=start_idx):
-                if re.match(section, line):
-                    start_idx = i + 1  # +1 to start at next line
-                    idx += [i]
-                    headers += [line.strip()]
-
-        for n, h in enumerate(headers):
-            if (n + 1) < len(headers):
-                contents = text[idx[n] + 1 : idx[n + 1]]
-            else:
-                contents = text[idx[n] + 1 :]
-            sections += ["\n".join(contents)]
-
-        return headers, sections
-
-    centers = [
-        "Clinical Particulars",
-        "Contraindications",
-        "Date Of First Approval",
-        "Date Of Revision",
-        "Effects On Ability To Drive And Use Machines",
-        "Fertility, Pregnancy And Lactation",
-        "Incompatibilities",
-        "Interaction With Other Medicinal Products And Other Forms Of Interaction",
-        "List Of Excipients",
-        "Marketing Authorisation Holder",
-        "Marketing Authorisation Number",
-        "Name Of The Medicinal Product",
-        "Nature And Contents Of Container",
-        "Overdose",
-        "Pharmaceutical Form",
-        "Pharmaceutical Particulars",
-        "Pharmacodynamic Properties",
-        "Pharmacokinetic Properties",
-        "Pharmacological Properties",
-        "Posology And Method Of Administration",
-        "Preclinical Safety Data",
-        "Pregnancy And Lactation",
-        "Qualitative And Quantitative Composition",
-        "Shelf Life",
-        "Special Precautions For Disposal",
-        "Special Precautions For Disposal And Other Handling",
-        "Special Precautions For Storage",
-        "Special Warnings And Precautions For Use",
-        "Therapeutic Indications",
-        "Undesirable Effects",
-        "Description",
-        "Pharmacology",
-        "Indications",
-        "Precautions",
-        "Interaction With Other Medicines",
-        "Name and address of the sponsor",
-        "Correction to the Medicine Schedule",
-        "Dosage and Administration",
-        "Date Of Most Recent Amendment",
-    ]
-    # note: maybe we should manually merge these pairs:
-    #   FERTILITY, PREGNANCY AND LACTATION
-    #   PREGNANCY AND LACTATION
-    #   SPECIAL PRECAUTIONS FOR DISPOSAL AND OTHER HANDLING
-    #   SPECIAL PRECAUTIONS FOR DISPOSAL
-    # but not doing so lets the similarity computation do its thing
+        # every line matching a pattern after the previous pattern's headers is a header
+        return get_pdf_sections_with_format(text, section_format)
 
     # improved initial text parsing step so this clustering problem wasn't so messy
     def get_fixed_header(self, text):
-        # return center with the lowest edit distance,
-        #   or placeholder (last entry) if no there's good match
-        dists = [levdistance(text.lower(), c.lower()) for c in self.centers]
-        # ix = np.argmin(dists)
-        ix = dists.index(min(dists))
-        if dists[ix] > 0.6 * len(text):
-            return None
-        else:
-            return self.centers[ix]
+        # return the section name with the lowest edit distance, or None if there's no good match
+        return TGA_SECTION_MATCHER.match(text)
+
+    def get_label_text(self, text):
+        """Split the text of a PDF into sections
+        Returns: the sections' text by section name; form: {section name: [text, ...]}
+        """
+        label_text = {}
+        # joined once for both parsing methods
+        joined_text = JoinedText(text)
+
+        headers, sections = get_pdf_sections(joined_text, pattern=r"^[0-9]+\.?[0-9]*\s+[A-Z].*")
+
+        # With the above method, it should at least find 20 sections, if less than that,
+        #  then parse it with other method
+        if len(headers) < 20:
+            logger.info("Failed to parse. Using another method...")
+            headers, sections = self.get_pdf_sections_with_format(
+                joined_text, OTHER_FORMATTED_SECTIONS
+            )
+            if len(headers) == 0:
+                # Not seeing this saved
+                raise PDFParseException("Failed to parse pdf with both methods")
+        for h, s in zip(headers, sections):
+            header = self.get_fixed_header(h)
+            if (header is not None) and (len(s) > 0):
+                logger.info(f"Found original header ({h}) fixed to {header}")
+                if header not in label_text.keys():
+                    label_text[header] = [s]
+                else:
+                    label_text[header].append(s)
+        return label_text
 
     def process_tga_pdf_file(
-        self, tga_file, source_product_number="", pdf_url="", my_label_id=None
+        self, tga_file, source_product_number="", pdf_url="", my_label_id=None, dl=None
     ):
         raw_text = []
         label_text = {}  # next level = product page w/ metadata
 
         try:
-            raw_text = read_pdf(tga_file, no_annex=False)
+            raw_text, sha256 = read_pdf_cached(tga_file, no_annex=False)
+            if dl is not None:
+                dl.pdf_sha256 = sha256
             info = {}
             if my_label_id is None:
                 product_code = source_product_number
             # row = self.df[self.df["Product number"] == product_code]
             # info["metadata"] = row.iloc[0].apply(str).to_dict()
 
-            headers, sections = [], []
-
-            headers, sections = get_pdf_sections(raw_text, pattern=r"^[0-9]+\.?[0-9]*\s+[A-Z].*")
-
-            # With the above method, it should at least find 20 sections, if less than that,
-            #  then parse it with other method
-            if len(headers) < 20:
-                logger.info("Failed to parse. Using another method...")
-                headers, sections = self.get_pdf_sections_with_format(
-                    raw_text, OTHER_FORMATTED_SECTIONS
-                )
-                if len(headers) == 0:
-                    # Not seeing this saved
-                    raise PDFParseException("Failed to parse pdf with both methods")
-            for h, s in zip(headers, sections):
-                header = self.get_fixed_header(h)
-                if (header is not None) and (len(s) > 0):
-                    logger.info(f"Found original header ({h}) fixed to {header}")
-                    if header not in label_text.keys():
-                        label_text[header] = [s]
-                    else:
-                        label_text[header].append(s)
+            label_text = self.get_label_text(raw_text)
 
             info["Label Text"] = label_text
             if my_label_id is None:
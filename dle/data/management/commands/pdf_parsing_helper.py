@@ -1,8 +1,125 @@
+import gzip
+import hashlib
+import inspect
+import json
+import logging
+import os
 import re
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+
+from django.conf import settings
 
 import pdfplumber
 
 
+logger = logging.getLogger(__name__)
+
+
+# matched per line, like the other header patterns
+ANNEX_PATTERN = r".*ANNEX\s+I.*"
+
+
+@lru_cache(maxsize=None)
+def compile_line_patterns(patterns: tuple[str, ...]) -> re.Pattern:
+    """Compile per line patterns into one regex that finds the lines matching any of them in joined text.
+    Each match starts with the newline before the line: a literal prefix lets the regex engine skip
+    straight from one line to the next, rather than trying the patterns at every character.
+    """
+    return re.compile("\\n(?:" + "|".join(f"(?:{p})" for p in patterns) + ")", re.MULTILINE)
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+class JoinedText:
+    """The lines of a PDF's text (as returned by read_pdf) joined into one string.
+    Header patterns are run over the whole text with a single compiled regex, rather than calling
+    re.match on every line, and sections are sliced out of the joined text by offset.
+    Patterns have the same meaning as with re.match on each line: each candidate the joined regex
+    finds is checked against its line, so a pattern matching across a line break (e.g. with \\s+) is
+    not a match.
+    """
+
+    def __init__(self, lines: list[str]):
+        self.lines = lines
+        self.text = "\n".join(lines)
+        # offset of the start of each line in text, and of the end of text + 1
+        self.offsets = list(accumulate((len(line) + 1 for line in lines), initial=0))
+        self._scanned = None
+        self._upper = None
+
+    @classmethod
+    def of(cls, text):
+        return text if isinstance(text, cls) else cls(text)
+
+    @property
+    def upper(self):
+        """The upper cased lines, joined. Upper casing can change the length of a line (e.g. ß)"""
+        if self._upper is None:
+            self._upper = JoinedText([line.upper() for line in self.lines])
+        return self._upper
+
+    def candidate_lines(self, regex: re.Pattern):
+        """Yield the index of each line the regex (from compile_line_patterns) matches at the start of"""
+        if not self.lines:
+            return
+        if self._scanned is None:
+            # line i starts after the newline at offsets[i]
+            self._scanned = "\n" + self.text
+        pos = 0
+        while (m := regex.search(self._scanned, pos)) is not None:
+            i = bisect_left(self.offsets, m.start())
+            yield i
+            # carry on from the next line, whatever the match covered
+            if i + 1 >= len(self.lines):
+                break
+            pos = self.offsets[i + 1]
+
+    def match_lines(self, pattern: str, upper=False, limit=None) -> list[int]:
+        """Indices of the lines for which re.match(pattern, line) matches, at most limit of them"""
+        text = self.upper if upper else self
+        regex = compile_pattern(pattern)
+        idx = []
+        for i in text.candidate_lines(compile_line_patterns((pattern,))):
+            if regex.match(text.lines[i]):
+                idx.append(i)
+                if limit is not None and len(idx) >= limit:
+                    break
+        return idx
+
+    def match_lines_any(self, patterns: list[str], upper=False) -> list[tuple[int, set[int]]]:
+        """For each line matching any of the patterns, its index and the indices of the patterns it matches"""
+        text = self.upper if upper else self
+        regexes = [compile_pattern(p) for p in patterns]
+        matches = []
+        for i in text.candidate_lines(compile_line_patterns(tuple(patterns))):
+            matched = {k for k, regex in enumerate(regexes) if regex.match(text.lines[i])}
+            if matched:
+                matches.append((i, matched))
+        return matches
+
+    def span(self, start: int, end: int) -> tuple[int, int]:
+        """Offsets in text of lines[start:end]"""
+        end = min(end, len(self.lines))
+        if end <= start:
+            return 0, 0
+        return self.offsets[start], self.offsets[end] - 1
+
+    def section_spans(self, idx: list[int]) -> list[tuple[int, int]]:
+        """Offsets in text of the lines between each header line in idx and the next one"""
+        ends = idx[1:] + [len(self.lines)]
+        return [self.span(i + 1, end) for i, end in zip(idx, ends)]
+
+    def sections(self, idx: list[int]) -> list[str]:
+        return [self.text[start:end] for start, end in self.section_spans(idx)]
+
+
 # Function to filter invalid headers
 # 1. Headers must not end in punctuation
 # 2. All the dots ('.') must be from the section numbers
@@ -29,44 +146,85 @@ def filter_headers(idx, headers):
     return idx_valid, headers_valid
 
 
+# function: input joined text, output list of section headers and the offsets of their content
+def get_pdf_section_spans(text: JoinedText, pattern, headers_filter=True):
+    idx = text.match_lines(pattern)
+    headers = [text.lines[i].strip() for i in idx]
+
+    if headers_filter and len(headers) != 0:
+        idx, headers = filter_headers(idx, headers)
+
+    return headers, text.section_spans(idx)
+
+
 # function: input text, output list of section headers and content
+# text is a list of lines, or a JoinedText to reuse with other calls
 def get_pdf_sections(text, pattern, headers_filter=True):
-    idx, headers, sections = [], [], []
-    for i, line in enumerate(text):
-        if re.match(pattern, line):
-            idx += [i]
-            headers += [line.strip()]
+    text = JoinedText.of(text)
+    headers, spans = get_pdf_section_spans(text, pattern, headers_filter=headers_filter)
+    return headers, [text.text[start:end] for start, end in spans]
+
+
+# function: input text and header patterns in the order the sections should appear,
+# output list of section headers and content
+# all_matches: every line matching a pattern after the previous header is a header,
+#  otherwise only the first one
+# upper: match the upper cased lines
+def get_pdf_sections_with_format(
+    text, section_format, all_matches=True, upper=False, headers_filter=False
+):
+    text = JoinedText.of(text)
+    matches = text.match_lines_any(section_format, upper=upper)
+    idx = []
+    start = 0
+    for k in range(len(section_format)):
+        for n in range(start, len(matches)):
+            i, matched = matches[n]
+            if k in matched:
+                start = n + 1  # +1 to start at next line
+                idx += [i]
+                if not all_matches:
+                    break
+    headers = [text.lines[i].strip() for i in idx]
 
     if headers_filter and len(headers) != 0:
         idx, headers = filter_headers(idx, headers)
 
-    for n, h in enumerate(headers):
-        if (n + 1) < len(headers):
-            contents = text[idx[n] + 1 : idx[n + 1]]
-        else:
-            contents = text[idx[n] + 1 :]
-        sections += ["\n".join(contents)]
+    return headers, text.sections(idx)
+
+
+# bands between the sorted tops and bottoms of the bboxes, with the bboxes that cover each band
+# so finding the bboxes an object is in is a bisect, instead of checking every bbox
+def index_bboxes(bboxes):
+    ys = sorted({y for _, top, _, bottom in bboxes for y in (top, bottom)})
+    # band i is [ys[i], ys[i + 1])
+    bands = [[bbox for bbox in bboxes if bbox[1] <= y < bbox[3]] for y in ys]
+    return ys, bands
+
 
-    return headers, sections
+def in_bboxes(obj, ys, bands):
+    # See https://github.com/jsvine/pdfplumber/blob/stable/pdfplumber/table.py#L404
+    v_mid = (obj["top"] + obj["bottom"]) / 2
+    i = bisect_right(ys, v_mid) - 1
+    if i < 0 or not bands[i]:
+        return False
+    h_mid = (obj["x0"] + obj["x1"]) / 2
+    return any((h_mid >= x0) and (h_mid < x1) for x0, _, x1, _ in bands[i])
 
 
 # helper function for pdfplumber
 def remove_tables(page):
+    # tables are found from the ruling lines, a page without both vertical and horizontal ones has no tables
+    if not page.vertical_edges or not page.horizontal_edges:
+        return page
+
     ts = {"vertical_strategy": "lines", "horizontal_strategy": "lines"}
     bboxes = [table.bbox for table in page.find_tables(table_settings=ts)]
+    if not bboxes:
+        return page
 
-    def not_within_bboxes(obj):
-        # Check if the object is in any of the table's bbox.
-        def obj_in_bbox(_bbox):
-            # See https://github.com/jsvine/pdfplumber/blob/stable/pdfplumber/table.py#L404
-            v_mid = (obj["top"] + obj["bottom"]) / 2
-            h_mid = (obj["x0"] + obj["x1"]) / 2
-            x0, top, x1, bottom = _bbox
-            return (h_mid >= x0) and (h_mid < x1) and (v_mid >= top) and (v_mid < bottom)
-
-        return not any(obj_in_bbox(__bbox) for __bbox in bboxes)
-
-    return page.filter(not_within_bboxes)
+    ys, bands = index_bboxes(bboxes)
+    return page.filter(lambda obj: not in_bboxes(obj, ys, bands))
 
 
 # helper function for pdfplumber
@@ -78,27 +236,143 @@ def remove_margins(page, dpi=72, size=0.7):
     return page.crop((0, (size) * dpi, w * dpi, (h - size) * dpi))
 
 
+# helper function for pdfplumber
+def extract_page_text(page, no_margins=True, no_tables=False):
+    if no_margins:
+        page = remove_margins(page)
+
+    if no_tables:
+        page = remove_tables(page)
+
+    return page.extract_text().split("\n")
+
+
 # function: input file, output text of annex 1
-def read_pdf(filename, no_margins=True, no_blanks=False, no_tables=False, no_annex=True):
+# lazy_annex: with no_annex, stop extracting at the page with the end of annex 1 rather than
+#  extracting the whole file, the text is the same
+# stats: optional dict, filled with the number of pages, pages extracted and seconds taken,
+#  and the seconds taken by each page
+def read_pdf(
+    filename,
+    no_margins=True,
+    no_blanks=False,
+    no_tables=True,
+    no_annex=True,
+    lazy_annex=True,
+    stats=None,
+):
+    start = time.perf_counter()
     text = []
+    annex_index = []
     with pdfplumber.open(filename) as pdf:
+        num_pages = len(pdf.pages)
+        num_extracted = 0
+        page_seconds = []
         for page in pdf.pages:
-            if no_margins:
-                page = remove_margins(page)
-
-            if no_tables:
-                page = remove_tables(page)
+            page_start = time.perf_counter()
+            page_text = extract_page_text(page, no_margins=no_margins, no_tables=no_tables)
+            page_seconds.append(time.perf_counter() - page_start)
+            num_extracted += 1
 
-            page_text = page.extract_text().split("\n")
+            if no_annex and len(annex_index) < 2:
+                # only the first 2 ANNEX I lines count, later pages are dropped anyway
+                idx = JoinedText(page_text).match_lines(ANNEX_PATTERN, limit=2 - len(annex_index))
+                annex_index += [len(text) + i for i in idx]
             text += page_text
+            if no_annex and lazy_annex and len(annex_index) > 1:
+                break
 
     if no_annex:
-        annex_lines = [re.match(r".*ANNEX\s+I.*", line) is not None for line in text]
-        annex_index = [i for i, v in enumerate(annex_lines) if v]
         if len(annex_index) > 1:
             text = text[annex_index[0] : annex_index[1]]
 
     if no_blanks:
         text = [line for line in text if not line.isspace()]
 
+    if stats is not None:
+        stats["pages"] = num_pages
+        stats["pages_extracted"] = num_extracted
+        stats["seconds"] = time.perf_counter() - start
+        stats["page_seconds"] = page_seconds
+
     return text
+
+
+READ_PDF_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(read_pdf).parameters.items()
+    if parameter.default is not inspect.Parameter.empty and name != "stats"
+}
+
+
+def file_sha256(filename) -> str:
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def pdf_cache_path(sha256):
+    return settings.PDF_CACHE_DIR / sha256[:2] / f"{sha256}.json.gz"
+
+
+def load_pdf_artifact(sha256):
+    """The cached output of read_pdf for a PDF, or None if it isn't cached
+    Returns: dict with the sha256, the read_pdf options, its stats and the lines of text
+    """
+    if not sha256:
+        return None
+    try:
+        with gzip.open(pdf_cache_path(sha256), "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable PDF cache entry {sha256}: {repr(e)}")
+        return None
+
+
+def save_pdf_artifact(sha256, options, stats, lines):
+    path = pdf_cache_path(sha256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    artifact = {"sha256": sha256, "options": options, "stats": stats, "lines": lines}
+    # write to a temporary file first, so a concurrent reader never sees half an entry
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+            json.dump(artifact, f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# function: input file, output text of annex 1 and the sha256 of the file
+# same as read_pdf, but the text is cached on disk under the sha256 of the file (see settings.PDF_CACHE_DIR)
+# so the same PDF is only extracted once, and `reparse` can re-run the section parsing without it
+def read_pdf_cached(filename, stats=None, **options):
+    # with the defaults filled in, so the cache is not used if a default changes
+    options = {**READ_PDF_DEFAULTS, **options}
+    sha256 = file_sha256(filename)
+    if settings.PDF_CACHE:
+        start = time.perf_counter()
+        artifact = load_pdf_artifact(sha256)
+        if artifact is not None and artifact["options"] == options:
+            logger.info(f"Using cached text for {filename} ({sha256})")
+            if stats is not None:
+                stats.update(artifact["stats"])
+                stats["seconds"] = time.perf_counter() - start
+            return artifact["lines"], sha256
+
+    pdf_stats = {}
+    lines = read_pdf(filename, stats=pdf_stats, **options)
+    if stats is not None:
+        stats.update(pdf_stats)
+    if settings.PDF_CACHE:
+        try:
+            save_pdf_artifact(sha256, options, pdf_stats, lines)
+        except OSError as e:
+            logger.warning(f"Failed to cache the text of {filename}: {repr(e)}")
+    return lines, sha256
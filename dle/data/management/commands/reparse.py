@@ -0,0 +1,143 @@
+import logging
+from distutils.util import strtobool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from data.models import DrugLabel, LabelProduct, ProductSection
+from search.utils.provision_es import delete_sections
+
+from . import load_ema_data, load_hc_data, load_tga_data
+from .pdf_parsing_helper import load_pdf_artifact
+
+
+logger = logging.getLogger(__name__)
+
+# the loaders that parse PDFs, their `get_label_text` splits the cached text into sections
+LOADERS = {
+    "EMA": load_ema_data.Command,
+    "TGA": load_tga_data.Command,
+    "HC": load_hc_data.Command,
+}
+
+
+# runs with `python manage.py reparse`
+# add `--agencies EMA,TGA` to only reparse the labels of some agencies
+# add `--ids 1,2,3` to only reparse some drug labels
+# add `--dry_run True` to only report the sections that would change
+# add `--verbosity 2` for info output
+# add `--verbosity 3` for debug output
+class Command(BaseCommand):
+    """Re-runs the section splitting and header fixing of the loaders on the text cached when a label's PDF
+    was first parsed (see `read_pdf_cached`), so parser changes don't need the PDFs downloaded and extracted again.
+    The replaced sections are deleted from the productsection index. The new sections are not vectorized,
+    run `vectorize` or `ingest` afterwards to vectorize and index them.
+    """
+
+    help = "Re-parses the sections of labels from their cached PDF text"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--agencies",
+            type=str,
+            help="Comma separated agencies to reparse, e.g. 'EMA,TGA'. Default is all of them",
+            default=",".join(LOADERS.keys()),
+        )
+        parser.add_argument(
+            "--ids",
+            type=str,
+            help="Comma separated ids of the drug labels to reparse. Default is all of them",
+            default="",
+        )
+        parser.add_argument(
+            "--dry_run",
+            type=strtobool,
+            help="Report the labels whose sections would change without saving them. Default is False",
+            default=False,
+        )
+
+    def handle(self, *args, **options):
+        # basic logging config is in settings.py
+        # verbosity is 1 by default, gives critical, error and warning output
+        # `--verbosity 2` gives info output
+        # `--verbosity 3` gives debug output
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        agencies = [a.strip() for a in options["agencies"].split(",") if a.strip()]
+        for agency in agencies:
+            if agency not in LOADERS:
+                raise CommandError(f"'agencies' must be in {', '.join(LOADERS.keys())}")
+        loaders = {agency: LOADERS[agency]() for agency in agencies}
+        dry_run = bool(options["dry_run"])
+
+        labels = DrugLabel.objects.filter(source__in=agencies).exclude(pdf_sha256="")
+        if options["ids"]:
+            labels = labels.filter(id__in=[int(i) for i in options["ids"].split(",")])
+
+        logger.info(self.style.SUCCESS("start process"))
+        counts = {"reparsed": 0, "changed": 0, "not_cached": 0, "failed": 0}
+        replaced_section_ids = []
+        for dl in labels.order_by("id").iterator():
+            artifact = load_pdf_artifact(dl.pdf_sha256)
+            if artifact is None:
+                logger.warning(f"No cached text for {dl.id} ({dl.pdf_sha256})")
+                counts["not_cached"] += 1
+                continue
+            try:
+                label_text = loaders[dl.source].get_label_text(artifact["lines"])
+            except Exception as e:
+                logger.error(self.style.ERROR(f"Failed to reparse {dl.id}: {repr(e)}"))
+                counts["failed"] += 1
+                continue
+            sections = {name: "".join(texts) for name, texts in label_text.items()}
+            counts["reparsed"] += 1
+            if self.sections_changed(dl, sections):
+                counts["changed"] += 1
+                logger.info(f"sections changed for {dl.id}")
+                if not dry_run:
+                    replaced_section_ids += self.save_sections(dl, sections)
+
+        if replaced_section_ids:
+            # else search keeps returning the replaced sections, whose ids no longer exist
+            try:
+                delete_sections(replaced_section_ids)
+            except Exception as e:
+                logger.error(
+                    self.style.ERROR(
+                        f"Failed to delete {len(replaced_section_ids)} replaced sections from the "
+                        f"index, recreate it with `provision_elastic`: {repr(e)}"
+                    )
+                )
+        logger.info(f"counts: {counts}")
+        if counts["changed"] and not dry_run:
+            logger.info("run `vectorize` or `ingest` to vectorize and index the new sections")
+        logger.info(self.style.SUCCESS("process complete"))
+
+    def sections_changed(self, dl, sections):
+        current = ProductSection.objects.filter(label_product__drug_label=dl).values_list(
+            "section_name", "section_text"
+        )
+        return sorted(current) != sorted(sections.items())
+
+    @transaction.atomic
+    def save_sections(self, dl, sections):
+        """Replaces the label's sections, returns the ids of the ones it deleted"""
+        # for now, assume only one LabelProduct per DrugLabel, like the loaders
+        lp = LabelProduct.objects.filter(drug_label=dl).first()
+        if lp is None:
+            lp = LabelProduct.objects.create(drug_label=dl)
+        old_sections = ProductSection.objects.filter(label_product__drug_label=dl)
+        old_section_ids = list(old_sections.values_list("id", flat=True))
+        old_sections.delete()
+        ProductSection.objects.bulk_create(
+            ProductSection(label_product=lp, section_name=name, section_text=text)
+            for name, text in sections.items()
+        )
+        # the views cache a label's rendered sections until its updated_at changes
+        dl.save(update_fields=["updated_at"])
+        return old_section_ids
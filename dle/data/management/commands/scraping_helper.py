@@ -0,0 +1,59 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for a connection / a response before giving up on a request
+REQUEST_TIMEOUT = (10, 120)
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/112.0"
+
+
+def build_session(concurrency=4, retries=3):
+    """Build a requests.Session that can be shared by `concurrency` threads.
+    The connection pool is sized for the number of workers, and transient errors (429/5xx) are retried
+    with an exponential backoff that honours Retry-After, so callers do not need fixed sleeps.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+def fetch_in_order(session, requests_kwargs, concurrency=4):
+    """Fetch a sequence of requests on a bounded thread pool, yielding (kwargs, response) in input order.
+    At most `concurrency` requests are in flight, so a long sequence never buffers more than that
+    many responses. A request that raises yields the exception instead of a response.
+    requests_kwargs: iterable of dicts passed to session.request, e.g. {"method": "GET", "url": url}
+    """
+
+    def do_request(kwargs):
+        try:
+            return session.request(timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            return e
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for kwargs in requests_kwargs:
+            in_flight.append((kwargs, executor.submit(do_request, kwargs)))
+            if len(in_flight) >= concurrency:
+                kwargs, future = in_flight.popleft()
+                yield kwargs, future.result()
+        while in_flight:
+            kwargs, future = in_flight.popleft()
+            yield kwargs, future.result()
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 from datetime import datetime
 
@@ -7,7 +6,7 @@ from django.core.management.base import BaseCommand, CommandError
 
 from api.apps import ApiConfig
 from data.models import ProductSection
-from data.util import compute_section_embedding
+from data.util import vectorize_section
 
 
 logger = logging.getLogger(__name__)
@@ -38,9 +37,7 @@ class Command(BaseCommand):
 
     @background
     def compute_section_vector_wrapper(self, section):
-        vec = compute_section_embedding(text=section.section_text, model=self.model, normalize=True)
-        section.bert_vector = json.dumps(vec)
-        section.save()
+        vectorize_section(section, self.model)
 
     def handle(self, *args, **options):
         agency = options["agency"]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0016_ingestrun_ingeststage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='druglabel',
+            name='pdf_sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0017_druglabel_pdf_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index_name', models.CharField(max_length=100, unique=True)),
+                ('generation', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
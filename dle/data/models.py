@@ -1,6 +1,7 @@
 import json
 
 from django.db import models
+from django.utils import timezone
 
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
@@ -49,6 +50,8 @@ class DrugLabel(models.Model):
     # An external link to the source agency's website, typically to the PDF of the label but in some cases,
     # like OpenFDA, it may be to a higher-level overview of the label rather than the PDF itself.
     link = models.URLField()
+    # sha256 of the label's PDF, the key of its extracted text in the PDF cache (see `reparse`)
+    pdf_sha256 = models.CharField(max_length=64, blank=True, default="")
 
     class Meta:
         constraints = [
@@ -238,3 +241,75 @@ class ParsingError(models.Model):
 
     def __str__(self):
         return f"{self.url}: last parsed at {self.last_parsed.strftime('%m/%d/%Y, %H:%M:%S')}"
+
+
+INGEST_STATUSES = [
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+]
+
+
+class IngestRun(models.Model):
+    """Ledger for a run of the `ingest` command
+    - An `IngestRun` has one `IngestStage` per loader / pipeline stage
+    - A run that did not finish can be resumed with `ingest --resume True`, which skips the stages that are done
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=INGEST_STATUSES, default="running")
+    # the options the run was started with, re-used when it is resumed
+    options = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"IngestRun {self.id}: {self.status}, started at {self.created_at.strftime('%m/%d/%Y, %H:%M:%S')}"
+
+
+class IngestStage(models.Model):
+    """A stage of an `IngestRun`, e.g. `load_ema_data` or `vectorize`, with its timing"""
+
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name="stages")
+    name = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=INGEST_STATUSES, default="running")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # labels for the loaders, sections for vectorize and index
+    items_processed = models.IntegerField(default=0)
+    message = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run", "name"], name="unique_ingest_stage"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}: {self.status}, {self.items_processed} items in {self.duration}"
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class IndexGeneration(models.Model):
+    """Counts the changes to an Elasticsearch index: it goes up when the index is created or documents are
+    indexed into it, see search/utils/provision_es.py. The local vector index has one too, see build_vector_index.
+    Responses cached from the index are keyed by its generation, see api/msearch_cache.py
+    """
+
+    index_name = models.CharField(max_length=100, unique=True)
+    generation = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.index_name}: generation {self.generation}"
+
+    @classmethod
+    def bump(cls, index_name: str) -> None:
+        updated = cls.objects.filter(index_name=index_name).update(
+            generation=models.F("generation") + 1, updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(index_name=index_name, defaults={"generation": 1})
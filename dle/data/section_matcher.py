@@ -0,0 +1,69 @@
+import math
+from functools import lru_cache
+
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+from data.constants import (
+    EMA_SECTION_NAMES,
+    HC_SECTION_NAMES,
+    METACATEGORIES_MAP,
+    TGA_SECTION_NAMES,
+)
+
+
+class SectionNameMatcher:
+    """Fixes parsed header lines to the closest canonical section name.
+    Gives the same result as computing the Levenshtein distance (case insensitive) to every name and
+    taking the first one with the lowest distance, or None if that distance is more than 0.6 * len(text):
+    - exact (case insensitive) matches are a dict lookup
+    - otherwise RapidFuzz's extractOne with a score_cutoff, so names that can't match are dropped early
+    - results are cached, the same header lines come up in most labels of an agency
+    """
+
+    def __init__(self, names: list[str], cache_size: int = 4096):
+        self.names = list(names)
+        self.lower_names = [name.lower() for name in self.names]
+        self.exact = {}
+        for name in self.names:
+            # keep the first name on duplicates, like the linear scan
+            self.exact.setdefault(name.lower(), name)
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, text: str) -> str | None:
+        key = text.lower()
+        if key in self.exact:
+            return self.exact[key]
+        # distances are integers, so "> 0.6 * len(text)" is the same as "> floor(0.6 * len(text))"
+        max_distance = math.floor(0.6 * len(text))
+        result = process.extractOne(
+            key,
+            self.lower_names,
+            scorer=Levenshtein.distance,
+            processor=None,
+            score_cutoff=max_distance,
+        )
+        if result is None:
+            return None
+        _, _, ix = result
+        return self.names[ix]
+
+
+EMA_SECTION_MATCHER = SectionNameMatcher(EMA_SECTION_NAMES)
+TGA_SECTION_MATCHER = SectionNameMatcher(TGA_SECTION_NAMES)
+HC_SECTION_MATCHER = SectionNameMatcher(HC_SECTION_NAMES)
+
+
+def build_metacategory_lookup(metacategories_map: dict) -> dict[str, dict[str, str]]:
+    """Invert METACATEGORIES_MAP to {agency: {section name: metacategory}}
+    The first metacategory listing a section name wins, the same as scanning the map in order.
+    """
+    lookup = {}
+    for metacategory, lists in metacategories_map.items():
+        for agency, headers in lists.items():
+            for header in headers:
+                lookup.setdefault(agency, {}).setdefault(header, metacategory)
+    return lookup
+
+
+METACATEGORY_LOOKUP = build_metacategory_lookup(METACATEGORIES_MAP)
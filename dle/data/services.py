@@ -0,0 +1,110 @@
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.http import Http404
+
+from compare.util import SECTIONS_ORDER
+
+from .models import DrugLabel, LabelProduct, ProductSection
+
+
+# section fields the views use, the vectors are large and never shown
+SECTION_FIELDS = ("id", "label_product_id", "section_name", "section_text")
+
+
+def get_labels_or_404(drug_label_ids: Iterable) -> List[DrugLabel]:
+    """Fetches drug labels by id with one query.
+    Args:
+        drug_label_ids (Iterable): ids, e.g. from request.GET, may repeat
+    Raises:
+        Http404: if one of the labels doesn't exist
+    Returns:
+        List[DrugLabel]: the labels, in the order of drug_label_ids
+    """
+    drug_label_ids = [int(i) for i in drug_label_ids]
+    drug_labels = DrugLabel.objects.in_bulk(drug_label_ids)
+    for drug_label_id in drug_label_ids:
+        if drug_label_id not in drug_labels:
+            raise Http404(f"No DrugLabel matches the id {drug_label_id}")
+    return [drug_labels[i] for i in drug_label_ids]
+
+
+def get_label_sections(drug_labels: List[DrugLabel]) -> Dict[int, Dict[str, str]]:
+    """Fetches the sections of the first LabelProduct of each label.
+    The products and sections of all the labels are prefetched together, rather than one query per label.
+    Args:
+        drug_labels (List[DrugLabel]): the labels
+    Returns:
+        Dict[int, Dict[str, str]]: {drug_label_id: {section_name: section_text}}
+    """
+    products = LabelProduct.objects.order_by("id").prefetch_related(
+        Prefetch(
+            "productsection_set",
+            queryset=ProductSection.objects.only(*SECTION_FIELDS).order_by("id"),
+        )
+    )
+    labels = DrugLabel.objects.filter(id__in=[dl.id for dl in drug_labels]).prefetch_related(
+        Prefetch("labelproduct_set", queryset=products)
+    )
+
+    label_sections = {dl.id: {} for dl in drug_labels}
+    for dl in labels:
+        # for now, assume just one LabelProduct per DrugLabel, like the loaders
+        label_products = dl.labelproduct_set.all()
+        if label_products:
+            label_sections[dl.id] = {
+                section.section_name: section.section_text
+                for section in label_products[0].productsection_set.all()
+            }
+    return label_sections
+
+
+def section_cache_key(drug_label: DrugLabel, render_key: str) -> str:
+    """Changes with the label's updated_at, so saving a label invalidates its rendered sections"""
+    digest = hashlib.sha256(render_key.encode("utf-8")).hexdigest()[:16]
+    return f"label_sections:{drug_label.id}:{drug_label.updated_at.timestamp()}:{digest}"
+
+
+def get_rendered_sections(
+    drug_labels: List[DrugLabel],
+    render_key: str = "raw",
+    render: Optional[Callable[[DrugLabel, str], str]] = None,
+) -> Dict[int, Dict[str, str]]:
+    """The sections of each label passed through `render`, from the cache when possible.
+    Only the labels missing from the cache are fetched, with get_label_sections, and rendered.
+    Args:
+        drug_labels (List[DrugLabel]): the labels
+        render_key (str): identifies `render` and its arguments, e.g. the highlighted search text
+        render (Callable[[DrugLabel, str], str]): renders a section text of a label, None to keep the raw text
+    Returns:
+        Dict[int, Dict[str, str]]: {drug_label_id: {section_name: rendered text}}
+    """
+    keys = {dl.id: section_cache_key(dl, render_key) for dl in drug_labels}
+    cached = cache.get_many(keys.values()) if settings.LABEL_SECTION_CACHE_TIMEOUT else {}
+    missing = {dl.id: dl for dl in drug_labels if keys[dl.id] not in cached}
+
+    rendered = {}
+    if missing:
+        label_sections = get_label_sections(list(missing.values()))
+        for drug_label_id, sections in label_sections.items():
+            dl = missing[drug_label_id]
+            rendered[keys[drug_label_id]] = {
+                name: render(dl, text) if render else text for name, text in sections.items()
+            }
+        if settings.LABEL_SECTION_CACHE_TIMEOUT:
+            cache.set_many(rendered, timeout=settings.LABEL_SECTION_CACHE_TIMEOUT)
+
+    return {
+        dl.id: cached[keys[dl.id]] if keys[dl.id] in cached else rendered[keys[dl.id]]
+        for dl in drug_labels
+    }
+
+
+def order_sections(sections_dict: Dict[str, dict]) -> List[dict]:
+    """The values of a {section_name: section} dict, in SECTIONS_ORDER then in their own order"""
+    sections = [sections_dict[name] for name in SECTIONS_ORDER if name in sections_dict]
+    sections += [val for key, val in sections_dict.items() if key not in SECTIONS_ORDER]
+    return sections
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent by the load_*_data commands once a DrugLabel and its sections have been saved,
+# so later stages (e.g. the `ingest` command) can pick the label up straight away
+# kwargs: drug_label
+label_ingested = Signal()
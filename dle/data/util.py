@@ -1,22 +1,21 @@
-# import json
 import datetime
+import json
 import math
-import re
 from string import Formatter
 
 import dateparser
 import numpy as np
 from dateparser.search import search_dates
 
-from data.constants import INVERTED_SECTION_MAP, METACATEGORIES_MAP
+from data.constants import INVERTED_SECTION_MAP
+from data.highlighter import get_highlighter, get_query_terms
 from data.models import DrugLabel
+from data.section_matcher import METACATEGORY_LOOKUP
 
 
 def map_header_to_metacategory(country: str, header: str) -> str:
-    for metacategory, lists in METACATEGORIES_MAP.items():
-        if header in lists[country]:
-            return metacategory
-    return ""
+    # METACATEGORY_LOOKUP is METACATEGORIES_MAP inverted once at import
+    return METACATEGORY_LOOKUP[country].get(header, "")
 
 
 def map_header_to_inverted_meta(agency: str, header: str) -> str:
@@ -37,58 +36,10 @@ def highlight_query_string(text: str, qstring: str) -> str:
     Returns:
         str: A text with the query term highlighted (put b/n <span> tags)
     """
-    text_lower = text.lower()
-
-    # if qstring is empty, return text as is
-    if qstring == "":
-        return text
-
-    # if qstring in double quotes, find & highligh full query str
-    if qstring.startswith('"') and qstring.endswith('"'):
-        qlist = [qstring[1:-1]]
-
-    # if qstring in single quotes, find & highligh full query str
-    elif qstring.startswith("'") and qstring.endswith("'"):
-        qlist = [qstring[1:-1]]
-
-    # else highlight each word in the query str, separatly
-    else:
-        qlist = qstring.split()
-
-    # include upper, title, capitalized cases of the query strings
-    qlist += (
-        [qterm.upper() for qterm in qlist]
-        + [qterm.capitalize() for qterm in qlist]
-        + [qterm.title() for qterm in qlist]
-    )
-
-    # get (index, "qterm") tuples in the input text
-    positions = []
-    for qterm in set(qlist):
-        positions += [(_.start(), qterm) for _ in re.finditer(qterm, text_lower)]
-
-    if positions == []:
-        return text
-
-    positions.sort()
-    # iterate through positions and insert <span> tags in text
-    output_text = ""
-    length = len(positions)
-    start = 0
-    end = positions[0][0]
-
-    for i in range(length):
-        output_text += text[start:end]
-        output_text += "<span style='background-color:yellow'>"
-        output_text += positions[i][1]
-        output_text += "</span>"
-        start = end + len(positions[i][1])
-        if i < length - 1:
-            end = positions[i + 1][0]
-
-    output_text += text[start : len(text)]
-
-    return output_text
+    # the highlighter is compiled once per query, see data/highlighter.py
+    highlighter = get_highlighter(get_query_terms(qstring))
+    text, _ = highlighter.highlight(text, "<span style='background-color:yellow'>", "</span>")
+    return text
 
 
 def reformat_html_tags_in_raw_text(text: str) -> str:
@@ -133,6 +84,13 @@ def compute_section_embedding(text: str, model, word_count=256, normalize=True)
         return [x / m for x in avg_vec]
 
 
+def vectorize_section(section, model):
+    """Compute the section's embedding and store it, serialized with json.dumps(), in bert_vector"""
+    vec = compute_section_embedding(text=section.section_text, model=model, normalize=True)
+    section.bert_vector = json.dumps(vec)
+    section.save(update_fields=["bert_vector"])
+
+
 def convert_date_string(date_string: str) -> datetime.datetime | None:
     # for date_format in ("%d %B %Y", "%d %b %Y", "%d/%m/%Y"):
     #     try:
@@ -217,3 +175,7 @@ def strfdelta(tdelta, fmt="{D:02}d {H:02}h {M:02}m {S:02}s", inputtype="timedelt
 
 class PDFParseException(Exception):
     """Exception raised for errors parsing PDFs."""
+
+
+class ScrapingHandshakeException(Exception):
+    """Exception raised when a cookie/consent handshake cannot be replayed over plain HTTP."""
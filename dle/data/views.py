@@ -1,13 +1,14 @@
-from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.decorators.http import require_GET
 
 from django_htmx.middleware import HtmxDetails
 
+from compare.models import LabelMatch
 from compare.util import *
 
-from .models import DrugLabel, LabelProduct, ProductSection
+from .models import DrugLabel
+from .services import get_rendered_sections, order_sections
 from .util import *
 
 
@@ -21,38 +22,39 @@ def index(request):
     return HttpResponse(str)
 
 
+def render_single_label_section(search_text):
+    def render_section(drug_label, text):
+        # If navigating from search result to single label view
+        # highlight the search text within the single label section text
+        text = highlight_query_string(text, search_text)
+
+        # convert common xml tags to html tags
+        text = reformat_html_tags_in_raw_text(text)
+
+        if drug_label.source == "EMA":
+            return text.replace("\n", "<br>")
+        return text
+
+    return render_section
+
+
 def single_label_view(request, drug_label_id, search_text=""):
     drug_label = get_object_or_404(DrugLabel, pk=drug_label_id)
-    # for now, assume just one
-    try:
-        label_product = LabelProduct.objects.filter(drug_label_id=drug_label_id).get()
-        product_sections = ProductSection.objects.filter(label_product_id=label_product.id).all()
-        sections_dict = {}
-        section_names = []
-        for section in product_sections:
-            section_names.append(section.section_name)
-            sections_dict[section.section_name] = {"section_name": section.section_name}
-
-            # If navigating from search result to single label view
-            # highlight the search text within the single label section text
-            text = highlight_query_string(section.section_text, search_text)
-
-            # convert common xml tags to html tags
-            text = reformat_html_tags_in_raw_text(text)
-
-            if drug_label.source == "EMA":
-                sections_dict[section.section_name]["section_text"] = text.replace("\n", "<br>")
-            else:
-                sections_dict[section.section_name]["section_text"] = text
-
-    except ObjectDoesNotExist:
-        sections_dict = {}
-        section_names = []
+    # the highlighted sections are cached per label and search text
+    sections = get_rendered_sections(
+        [drug_label], f"single_label:{search_text}", render_single_label_section(search_text)
+    )[drug_label.id]
+    sections_dict = {
+        section_name: {"section_name": section_name, "section_text": text}
+        for section_name, text in sections.items()
+    }
+    section_names = list(sections_dict.keys())
 
     # get all drug labels with the same product_name and marketer
     drug_label_versions = (
         DrugLabel.objects.filter(product_name=drug_label.product_name)
         .filter(marketer=drug_label.marketer)
+        .only("id", "product_name", "source_product_number", "source", "version_date")
         .order_by("version_date")
     )
 
@@ -61,18 +63,11 @@ def single_label_view(request, drug_label_id, search_text=""):
     context = {
         "drug_label": drug_label,
         "drug_label_versions": drug_label_versions,
+        "label_matches": get_label_suggestions([drug_label]),
         "section_names": section_names,
-        "sections": [],
+        "sections": order_sections(sections_dict),
     }
 
-    for sec_name in SECTIONS_ORDER:
-        if sec_name in sections_dict.keys():
-            context["sections"].append(sections_dict[sec_name])
-
-    for key, val in sections_dict.items():
-        if key not in SECTIONS_ORDER:
-            context["sections"].append(val)
-
     return render(request, "data/single_label.html", context)
 
 
@@ -82,6 +77,21 @@ def visualizations(request):
 
 
 # Putting this in data because it's simple and it returns data as HTML rather than JSON - it's not an API endpoint
+def get_label_suggestions(labels, limit=10):
+    """The labels of other agencies precomputed to match any of the labels, best first,
+    see `precompute_label_matches`. My Labels are never suggested."""
+    matches = (
+        LabelMatch.objects.filter(drug_label__in=labels, match__mylabel__isnull=True)
+        .exclude(match__in=labels)
+        .select_related("match")
+        .order_by("-score")
+    )
+    suggestions = {}
+    for label_match in matches[: limit * 5]:
+        suggestions.setdefault(label_match.match_id, label_match)
+    return list(suggestions.values())[:limit]
+
+
 @require_GET
 def search_label_htmx(request: HtmxHttpRequest) -> HttpResponse:
     """Searches Django for a DrugLabel and returns an HTMX response.
@@ -92,12 +102,14 @@ def search_label_htmx(request: HtmxHttpRequest) -> HttpResponse:
         q = request.GET.get("query", "")
         if q:
             labels = DrugLabel.objects.filter(product_name__iexact=q).order_by("version_date")[:10]
+            suggestions = get_label_suggestions(labels)
 
         else:
             print("No query string")
             labels = []
+            suggestions = []
         return render(
             request=request,
             template_name="data/_label_search_results.html",
-            context={"labels": labels},
+            context={"labels": labels, "suggestions": suggestions},
         )
@@ -35,6 +35,61 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 
 MEDIA_ROOT = BASE_DIR / "media"
 
+# the text extracted from label PDFs is cached here, keyed by the PDF's sha256, see `reparse`
+PDF_CACHE = env.bool("PDF_CACHE", True)
+PDF_CACHE_DIR = Path(env.str("PDF_CACHE_DIR", str(MEDIA_ROOT / "pdf_cache")))
+
+# `compare_versions` serves section diffs from the SectionDiff table, see `precompute_version_diffs`
+COMPARE_DIFF_CACHE = env.bool("COMPARE_DIFF_CACHE", True)
+# seconds diff_match_patch spends on a section pair before settling for a coarser diff, 0 for no limit
+COMPARE_DIFF_TIMEOUT = env.float("COMPARE_DIFF_TIMEOUT", 1.0)
+# seconds the label views keep a label's rendered sections in the cache, see data/services.py,
+# and search results keep a section's sanitized text, 0 to not cache them
+LABEL_SECTION_CACHE_TIMEOUT = env.int("LABEL_SECTION_CACHE_TIMEOUT", 60 * 60)
+# cut and highlight the snippets of the legacy search results with ts_headline in Postgres, rather than in Python
+SEARCH_HEADLINES = env.bool("SEARCH_HEADLINES", False)
+
+# the searchkit endpoint forwards the msearch body to Elasticsearch and streams the response back unparsed,
+# rather than going through the elasticsearch client, see api/proxy.py and `benchmark_searchkit`
+SEARCHKIT_PROXY = env.bool("SEARCHKIT_PROXY", True)
+# indices the searchkit endpoint can search, and the largest msearch body it accepts, in bytes
+SEARCHKIT_INDICES = env.list("SEARCHKIT_INDICES", default=["productsection"])
+SEARCHKIT_MAX_BODY_SIZE = env.int("SEARCHKIT_MAX_BODY_SIZE", 256 * 1024)
+# connections to Elasticsearch each worker process keeps open for the searchkit endpoint, and their timeouts
+SEARCHKIT_POOL_SIZE = env.int("SEARCHKIT_POOL_SIZE", 10)
+SEARCHKIT_CONNECT_TIMEOUT = env.float("SEARCHKIT_CONNECT_TIMEOUT", 5.0)
+SEARCHKIT_READ_TIMEOUT = env.float("SEARCHKIT_READ_TIMEOUT", 30.0)
+# seconds each worker process keeps a searchkit response for identical requests, 0 to not cache them
+# a cached response isn't served once documents have been indexed into its index since, see IndexGeneration
+SEARCHKIT_CACHE_TTL = env.float("SEARCHKIT_CACHE_TTL", 30.0)
+# bytes of responses cached per worker process before the least recently used are evicted, and the largest
+# response cached
+SEARCHKIT_CACHE_MAX_BYTES = env.int("SEARCHKIT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+SEARCHKIT_CACHE_MAX_ENTRY_BYTES = env.int("SEARCHKIT_CACHE_MAX_ENTRY_BYTES", 2 * 1024 * 1024)
+# the vectorize endpoint encodes at most VECTORIZE_WORKERS texts at a time per worker process, and answers
+# 503 once VECTORIZE_QUEUE_SIZE texts are waiting or being encoded
+VECTORIZE_WORKERS = env.int("VECTORIZE_WORKERS", 2)
+VECTORIZE_QUEUE_SIZE = env.int("VECTORIZE_QUEUE_SIZE", 16)
+
+# also keep a druglabel Elasticsearch index, one document per label, so facet counts can be computed over
+# labels rather than sections, see `provision_elastic --label_index` and `benchmark_facets`
+# for now only `benchmark_facets` reads it, the search page's facets still count productsection documents
+ES_LABEL_INDEX = env.bool("ES_LABEL_INDEX", False)
+# how new indices index text_embedding: hnsw (floats) or int8_hnsw (bytes, Elasticsearch 8.12+), and the HNSW
+# graph's links per node (m) and candidates per insert (ef_construction), see `benchmark_knn` for their recall
+ES_VECTOR_INDEX_TYPE = env.str("ES_VECTOR_INDEX_TYPE", "hnsw")
+ES_HNSW_M = env.int("ES_HNSW_M", 16)
+ES_HNSW_EF_CONSTRUCTION = env.int("ES_HNSW_EF_CONSTRUCTION", 100)
+
+# where the semantic search of /api/v1/search finds its nearest sections: elasticsearch, or local for the
+# memory-mapped index `python manage.py build_vector_index` writes to LOCAL_VECTOR_INDEX_DIR, which needs no
+# Elasticsearch (development, CI, outages). With an IVF index, LOCAL_VECTOR_INDEX_N_PROBE lists are searched
+VECTOR_SEARCH_BACKEND = env.str("VECTOR_SEARCH_BACKEND", "elasticsearch")
+LOCAL_VECTOR_INDEX_DIR = Path(env.str("LOCAL_VECTOR_INDEX_DIR", str(MEDIA_ROOT / "vector_index")))
+LOCAL_VECTOR_INDEX_N_PROBE = env.int("LOCAL_VECTOR_INDEX_N_PROBE", 16)
+# seconds /api/v1/sections/<id>/similar keeps a section's similar sections in the cache, 0 to not cache them
+SIMILAR_SECTIONS_CACHE_TIMEOUT = env.int("SIMILAR_SECTIONS_CACHE_TIMEOUT", 60 * 60)
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.0/howto/static-files/
 
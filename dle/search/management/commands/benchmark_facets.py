@@ -0,0 +1,77 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from elasticsearch_django.settings import get_client
+
+from data.models import SOURCES
+from search.search_constants import FACET_FIELDS
+
+
+logger = logging.getLogger(__name__)
+
+
+def facet_query(source: str | None, size: int) -> dict:
+    """The facet aggregations es_search.js asks for, for all documents or the ones of an agency"""
+    query = {"term": {"drug_label_source": source}} if source else {"match_all": {}}
+    return {
+        "query": query,
+        "aggs": {field: {"terms": {"field": field, "size": size}} for field in FACET_FIELDS},
+        "size": 0,
+    }
+
+
+# runs with `python manage.py benchmark_facets`
+# the druglabel index is provisioned with `python manage.py provision_elastic --label_index True`
+# add `--repeat 20` to run each facet query more times
+# add `--size 50` to ask for more buckets per facet
+class Command(BaseCommand):
+    help = "Compares the facet aggregations over the productsection and druglabel indices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat", type=int, help="Times each facet query is run. Default is 5", default=5
+        )
+        parser.add_argument("--size", type=int, help="Buckets per facet. Default is 10", default=10)
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        es = get_client()
+        indices = [
+            index for index in ["productsection", "druglabel"] if es.indices.exists(index=index)
+        ]
+        if not indices:
+            raise CommandError("Neither the productsection nor the druglabel index exist")
+
+        for index in indices:
+            docs = es.count(index=index)["count"]
+            took_total, wall_total, runs = 0, 0.0, 0
+            for source in [None] + [source for source, _ in SOURCES]:
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    # the shard request cache would answer the repeats without aggregating
+                    res = es.search(
+                        index=index, request_cache=False, **facet_query(source, options["size"])
+                    )
+                    wall = time.perf_counter() - start
+                    took_total += res["took"]
+                    wall_total += wall
+                    runs += 1
+                buckets = {
+                    field: len(res["aggregations"][field]["buckets"]) for field in FACET_FIELDS
+                }
+                logger.info(
+                    f"{index} {source or 'all'}: {res['hits']['total']['value']} docs, took {res['took']}ms, "
+                    f"{wall * 1000:.0f}ms, buckets {buckets}"
+                )
+            self.stdout.write(
+                f"{index}: {docs} docs, {runs} facet queries, "
+                f"took {took_total / runs:.1f}ms, {wall_total * 1000 / runs:.1f}ms per query"
+            )
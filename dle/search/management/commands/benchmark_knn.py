@@ -0,0 +1,132 @@
+import logging
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from elasticsearch_django.settings import get_client
+
+from data.models import AGENCY_CHOICES, ProductSection
+from search.utils.knn import exact_knn, parse_vectors, recall, vector_batches
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py benchmark_knn`
+# provision the configs to compare side by side first, e.g.
+# `python manage.py provision_elastic --index productsection_int8 --vector_index_type int8_hnsw --hnsw_m 16`
+# then `python manage.py benchmark_knn --index productsection_int8`
+# add `--queries 500` for a larger sample of query sections
+# add `--num_candidates 20,50,100` to measure other num_candidates
+class Command(BaseCommand):
+    help = "Measures the recall and latency of the kNN search of an index against brute force cosine similarity"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--index",
+            type=str,
+            help="Index to search. Default is productsection",
+            default="productsection",
+        )
+        parser.add_argument(
+            "--agency",
+            type=str,
+            help="'TGA', 'FDA', 'EMA', or 'all', the agency the index was provisioned with",
+            default="all",
+        )
+        parser.add_argument(
+            "--queries",
+            type=int,
+            help="Sections whose vectors are the queries. Default is 100",
+            default=100,
+        )
+        parser.add_argument("--k", type=int, help="Neighbours per query. Default is 10", default=10)
+        parser.add_argument(
+            "--num_candidates",
+            type=str,
+            help="Comma separated num_candidates to measure. Default is 20,50,100,500",
+            default="20,50,100,500",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Seed of the query sample. Default is 0", default=0
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        index, k = options["index"], options["k"]
+        num_candidates = [int(n) for n in options["num_candidates"].split(",")]
+        if min(num_candidates) <= k:
+            raise CommandError("num_candidates must be more than k")
+
+        # the sections populate_index put in the index
+        sections = ProductSection.objects.filter(bert_vector__isnull=False)
+        if options["agency"] != "all":
+            if options["agency"] not in [choice[0] for choice in AGENCY_CHOICES]:
+                raise CommandError(f"{options['agency']} is not a valid agency")
+            sections = sections.filter(label_product__drug_label__source=options["agency"])
+        section_ids = list(sections.values_list("id", flat=True))
+        if not section_ids:
+            raise CommandError("There are no vectorized sections")
+        query_ids = random.Random(options["seed"]).sample(
+            section_ids, min(options["queries"], len(section_ids))
+        )
+        queries = ProductSection.objects.in_bulk(query_ids)
+        query_vectors = parse_vectors(queries[section_id].bert_vector for section_id in query_ids)
+
+        # one neighbour more than k, the query section is its own nearest neighbour and is left out
+        start = time.perf_counter()
+        _, exact_ids = exact_knn(query_vectors, vector_batches(sections), k + 1)
+        exact = [
+            [i for i in ids if i != query_id][:k]
+            for query_id, ids in zip(query_ids, exact_ids.tolist())
+        ]
+        self.stdout.write(
+            f"brute force: {len(section_ids)} sections, {len(query_ids)} queries, "
+            f"{time.perf_counter() - start:.1f}s"
+        )
+
+        es = get_client()
+        mapping = es.indices.get_mapping(index=index)[index]["mappings"]["properties"][
+            "text_embedding"
+        ]
+        store = es.indices.stats(index=index, metric="store")["_all"]["primaries"]["store"]
+        self.stdout.write(
+            f"{index}: {es.count(index=index)['count']} docs, {store['size_in_bytes'] / 2**20:.0f}MB, "
+            f"index_options {mapping.get('index_options', 'default')}"
+        )
+
+        for candidates in num_candidates:
+            recalls, took, wall = [], [], []
+            for query_id, query_vector, exact_neighbours in zip(query_ids, query_vectors, exact):
+                start = time.perf_counter()
+                res = es.search(
+                    index=index,
+                    knn={
+                        "field": "text_embedding",
+                        "query_vector": query_vector.tolist(),
+                        "k": k + 1,
+                        "num_candidates": candidates,
+                    },
+                    size=k + 1,
+                    source=False,
+                )
+                wall.append(time.perf_counter() - start)
+                took.append(res["took"])
+                ids = [
+                    int(hit["_id"]) for hit in res["hits"]["hits"] if int(hit["_id"]) != query_id
+                ]
+                recalls.append(recall(ids[:k], exact_neighbours))
+            percentiles = statistics.quantiles(wall, n=100, method="inclusive")
+            self.stdout.write(
+                f"num_candidates {candidates}: recall@{k} {statistics.mean(recalls):.3f}, "
+                f"took {statistics.mean(took):.1f}ms, p50 {percentiles[49] * 1000:.1f}ms, "
+                f"p95 {percentiles[94] * 1000:.1f}ms"
+            )
@@ -0,0 +1,87 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from search.models import SearchRequest
+from search.services import build_search_result, process_search
+
+from .performance_tests import SEARCH_TEXTS_ONE_WORD
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py benchmark_search_snippets`
+# add `--queries kidney,heart` to search other words, comma separated
+# add `--all_label_versions True` to search all versions rather than the latest ones
+class Command(BaseCommand):
+    help = "Compares cutting the legacy search snippets in Python with ts_headline in Postgres"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queries",
+            type=str,
+            help="Comma separated search words. Default is the one word searches of performance_tests",
+            default=",".join(SEARCH_TEXTS_ONE_WORD),
+        )
+        parser.add_argument(
+            "--all_label_versions",
+            type=str,
+            help="'True' to search all label versions. Default is the latest versions only",
+            default="",
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        queries = [q.strip().lower() for q in options["queries"].split(",") if q.strip()]
+        if not queries:
+            raise CommandError("No queries to search")
+
+        totals = {}
+        for headlines in [False, True]:
+            mode = "postgres" if headlines else "python"
+            totals[mode] = {"query": 0.0, "snippets": 0.0, "results": 0, "chars": 0}
+            for query in queries:
+                search_request = SearchRequest(
+                    search_text=query,
+                    select_section="",
+                    all_label_versions=bool(options["all_label_versions"]),
+                )
+                start = time.perf_counter()
+                results = process_search(search_request, headlines=headlines)
+                query_time = time.perf_counter() - start
+
+                # text transferred from Postgres for the snippets
+                field = "headline" if headlines else "raw_text"
+                chars = sum(len(getattr(result, field) or "") for result in results)
+
+                # the sanitized text cache would hide the cost of the python mode on the second query
+                for result in results:
+                    result.section_id = None
+                start = time.perf_counter()
+                for result in results:
+                    build_search_result(result, query)
+                snippets_time = time.perf_counter() - start
+
+                logger.info(
+                    f"{mode} {query!r}: {len(results)} results, {chars} chars, "
+                    f"query {query_time:.3f}s, snippets {snippets_time:.3f}s"
+                )
+                totals[mode]["query"] += query_time
+                totals[mode]["snippets"] += snippets_time
+                totals[mode]["results"] += len(results)
+                totals[mode]["chars"] += chars
+
+        for mode, total in totals.items():
+            self.stdout.write(
+                f"{mode}: {total['results']} results, {total['chars']} chars from Postgres, "
+                f"query {total['query']:.2f}s, snippets {total['snippets']:.2f}s, "
+                f"total {total['query'] + total['snippets']:.2f}s"
+            )
@@ -0,0 +1,62 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from data.models import AGENCY_CHOICES, IndexGeneration, ProductSection
+from search.utils.knn import vector_batches
+from search.utils.vector_index import LOCAL_INDEX_NAME, build_vector_index
+
+
+logger = logging.getLogger(__name__)
+
+
+# runs with `python manage.py build_vector_index`
+# set VECTOR_SEARCH_BACKEND=local for /api/v1/search to search it, servers pick up a rebuilt index on their own
+# add `--n_lists 1024` for an IVF index, which only searches the LOCAL_VECTOR_INDEX_N_PROBE lists nearest a query
+# rather than every vector, e.g. about the square root of the number of sections
+# add `--agency FDA` to only index the sections of an agency
+class Command(BaseCommand):
+    help = "Writes the section vectors to the local vector index, for semantic search without Elasticsearch"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            type=str,
+            help="Directory of the index. Default is LOCAL_VECTOR_INDEX_DIR",
+            default=str(settings.LOCAL_VECTOR_INDEX_DIR),
+        )
+        parser.add_argument(
+            "--agency", type=str, help="'TGA', 'FDA', 'EMA', or 'all'", default="all"
+        )
+        parser.add_argument(
+            "--n_lists",
+            type=int,
+            help="IVF lists the vectors are clustered into, 0 for an exact index. Default is 0",
+            default=0,
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        sections = ProductSection.objects.filter(bert_vector__isnull=False).order_by("id")
+        if options["agency"] != "all":
+            if options["agency"] not in [choice[0] for choice in AGENCY_CHOICES]:
+                raise CommandError(f"{options['agency']} is not a valid agency")
+            sections = sections.filter(label_product__drug_label__source=options["agency"])
+
+        start = time.perf_counter()
+        index = build_vector_index(
+            options["path"], vector_batches(sections), sections.count(), n_lists=options["n_lists"]
+        )
+        # results cached before the rebuild, e.g. similar sections, are stale now
+        IndexGeneration.bump(LOCAL_INDEX_NAME)
+        self.stdout.write(
+            f"Indexed {len(index)} sections in {options['path']} in {time.perf_counter() - start:.1f}s"
+        )
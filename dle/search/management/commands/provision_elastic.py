@@ -1,11 +1,18 @@
 import logging
 from distutils.util import strtobool
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from elasticsearch import logger as es_logger
 
-from search.utils.provision_es import create_index, populate_index
+from search.utils.provision_es import (
+    VECTOR_INDEX_TYPES,
+    create_index,
+    populate_index,
+    populate_label_index,
+    vector_index_options,
+)
 
 
 es_logger.setLevel(logging.WARNING)
@@ -22,37 +29,94 @@ class Command(BaseCommand):
         parser.add_argument(
             "--agency", type=str, help="'TGA', 'FDA', 'EMA', or 'all'", default="all"
         )
+        parser.add_argument(
+            "--index",
+            type=str,
+            help="Name of the sections index, e.g. to compare vector configs side by side. "
+            "Default is productsection",
+            default="productsection",
+        )
         parser.add_argument(
             "--delete_and_recreate_index",
             type=strtobool,
             help="Whether to delete and recreate the productsection index",
             default=False,
         )
+        parser.add_argument(
+            "--vector_index_type",
+            type=str,
+            choices=VECTOR_INDEX_TYPES,
+            help="How text_embedding is indexed when the index is created. Default is ES_VECTOR_INDEX_TYPE",
+            default=settings.ES_VECTOR_INDEX_TYPE,
+        )
+        parser.add_argument(
+            "--hnsw_m",
+            type=int,
+            help="Links per node of the HNSW graph. Default is ES_HNSW_M",
+            default=settings.ES_HNSW_M,
+        )
+        parser.add_argument(
+            "--hnsw_ef_construction",
+            type=int,
+            help="Candidates considered per insert into the HNSW graph. Default is ES_HNSW_EF_CONSTRUCTION",
+            default=settings.ES_HNSW_EF_CONSTRUCTION,
+        )
         parser.add_argument(
             "--mapping_file",
             type=str,
             help="Path to the mapping file",
             default="/app/search/mappings/provision.json",
         )
+        parser.add_argument(
+            "--label_index",
+            type=strtobool,
+            help="Whether to also provision the druglabel index, for facet counts over labels. "
+            "Default is ES_LABEL_INDEX",
+            default=settings.ES_LABEL_INDEX,
+        )
+        parser.add_argument(
+            "--label_mapping_file",
+            type=str,
+            help="Path to the mapping file of the druglabel index",
+            default="/app/search/mappings/druglabel.json",
+        )
 
     def handle(self, *args, **options):
         agency = options["agency"]
         delete_and_recreate_index = options["delete_and_recreate_index"]
         mapping_file = options["mapping_file"]
+        index = options["index"]
+        vector_options = vector_index_options(
+            options["vector_index_type"], options["hnsw_m"], options["hnsw_ef_construction"]
+        )
 
         logger.info(
-            f"Provisioning index 'productsection' - agency: {agency} - delete_and_recreate_index: {delete_and_recreate_index}"
+            f"Provisioning index '{index}' - agency: {agency} - delete_and_recreate_index: {delete_and_recreate_index}"
         )
         # Index must exist to index documents
         res = create_index(
-            "productsection", mapping_file=mapping_file, recreate=delete_and_recreate_index
+            index,
+            mapping_file=mapping_file,
+            recreate=delete_and_recreate_index,
+            vector_options=vector_options,
         )
         if not res:
-            logger.warning("Did not create or delete/recreate index 'productsection'")
+            logger.warning(f"Did not create or delete/recreate index '{index}'")
         else:
             logger.info("Index creation response:")
             logger.info(res)
             logger.info(res.body)
 
         logger.info(f"Populating index with agency: {agency}")
-        populate_index(index_name="productsection", agency=agency)
+        populate_index(index_name=index, agency=agency)
+
+        if options["label_index"]:
+            res = create_index(
+                "druglabel",
+                mapping_file=options["label_mapping_file"],
+                recreate=delete_and_recreate_index,
+            )
+            if res:
+                logger.info(res.body)
+            logger.info(f"Populating label index with agency: {agency}")
+            populate_label_index(index_name="druglabel", agency=agency)
@@ -31,5 +31,32 @@ class SearchRequest(NamedTuple):
         return "".join([f"&{field}={search_request_dict[field]}" for field in cls._fields])
 
 
+class SearchCursor(NamedTuple):
+    """Position of a result in the ranked results, they are ordered by (rank, id) descending"""
+
+    rank: float
+    id: int
+
+    def __str__(self) -> str:
+        # repr of the float round trips, so the cursor compares equal to the rank stored in postgres
+        return f"{self.rank!r}_{self.id}"
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> Optional["SearchCursor"]:
+        """The cursor from a `after` / `before` query parameter, None if it is missing or malformed"""
+        try:
+            rank, id = value.split("_")
+            return cls(float(rank), int(id))
+        except (AttributeError, ValueError):
+            return None
+
+
+class SearchPage(NamedTuple):
+    results: list
+    "labels from process_search, with their rank"
+    previous_cursor: Optional[SearchCursor]
+    next_cursor: Optional[SearchCursor]
+
+
 class InvalidSearchRequest(Exception):
     pass
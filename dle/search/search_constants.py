@@ -1,3 +1,16 @@
 MAX_LENGTH_SEARCH_RESULT_DISPLAY = 300
 
+# ts_headline options for the snippets cut by Postgres, see SEARCH_HEADLINES
+# about MAX_LENGTH_SEARCH_RESULT_DISPLAY characters, highlighted like build_snippet
+HEADLINE_OPTIONS = "MaxFragments=1, MaxWords=45, MinWords=20, StartSel=<b>, StopSel=</b>"
+
 DRUG_LABEL_QUERY_TEMP_TABLE_NAME = "dl_matching_temp"
+
+# the fields es_search.js facets on, keyword fields with eager_global_ordinals in the mappings
+FACET_FIELDS = [
+    "drug_label_source",
+    "section_name.keyword",
+    "drug_label_product_name.keyword",
+    "drug_label_generic_name.keyword",
+    "drug_label_marketer.keyword",
+]
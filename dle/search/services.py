@@ -1,17 +1,24 @@
 import logging
 from typing import Dict, List, Optional, Tuple
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 from django.http import QueryDict
 
 import bleach
 
 from data.constants import LASTEST_DRUG_LABELS_TABLE
+from data.highlighter import get_highlighter
 from data.models import DrugLabel, ProductSection
 from users.models import User
 
-from .models import InvalidSearchRequest, SearchRequest
-from .search_constants import DRUG_LABEL_QUERY_TEMP_TABLE_NAME, MAX_LENGTH_SEARCH_RESULT_DISPLAY
+from .models import InvalidSearchRequest, SearchCursor, SearchPage, SearchRequest
+from .search_constants import (
+    DRUG_LABEL_QUERY_TEMP_TABLE_NAME,
+    HEADLINE_OPTIONS,
+    MAX_LENGTH_SEARCH_RESULT_DISPLAY,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -83,7 +90,39 @@ def build_match_sql(search_text: str) -> str:
     return f"to_tsvector(section_text) @@ to_tsquery(%(search_text)s)"  # noqa: F541
 
 
-def process_search(search_request: SearchRequest, user: Optional[User] = None) -> List[DrugLabel]:
+def build_headline_sql() -> str:
+    """ts_headline of the matched section, with the same tsquery as build_match_sql"""
+    return "ts_headline(section_text, to_tsquery(%(search_text)s), %(headline_options)s)"
+
+
+def build_rank_sql() -> str:
+    """ts_rank of the matched section, with the same tsvector and tsquery as build_match_sql"""
+    return "ts_rank(to_tsvector(section_text), to_tsquery(%(search_text)s))"
+
+
+def process_search(
+    search_request: SearchRequest,
+    user: Optional[User] = None,
+    headlines: bool = False,
+    limit: int = 100,
+    after: Optional[SearchCursor] = None,
+    before: Optional[SearchCursor] = None,
+) -> List[DrugLabel]:
+    """Finds the labels with a section matching the search text, ranked by their best matching section
+    Each label is returned once, with that section. Results are ordered by (rank, id) descending and paginated
+    with a keyset: a page starts after (or ends before) a cursor, so no page re-reads the ones before it.
+    Args:
+        search_request (SearchRequest): The validated search
+        user (User): The logged in user, whose My Labels are searched too
+        headlines (bool): Have Postgres cut and highlight the snippets with ts_headline, returned as `headline`,
+            rather than returning the full section text as `raw_text` for build_search_result to cut
+        limit (int): Maximum number of labels
+        after (SearchCursor): Only the labels ranked after this one
+        before (SearchCursor): Only the labels ranked before this one, the closest `limit` of them,
+            in ascending order
+    Returns:
+        List[DrugLabel]: The labels, with `rank` and `section_id`
+    """
     # first we get the list of drug_labels we want to look at
     run_dl_query(search_request, user)
 
@@ -91,8 +130,47 @@ def process_search(search_request: SearchRequest, user: Optional[User] = None) -
     sql_params = {
         "search_text": search_request.search_text,
         "section_name": search_request.select_section,
+        "limit": limit,
     }
+    section_filter_sql = ""
+    if search_request.select_section:
+        section_filter_sql = "AND LOWER(section_name) = %(section_name)s"
+
+    keyset_sql, order = "", "DESC"
+    if after is not None or before is not None:
+        cursor = after if after is not None else before
+        sql_params["cursor_rank"], sql_params["cursor_id"] = cursor
+        comparison = "<" if after is not None else ">"
+        keyset_sql = f"WHERE (rank, id) {comparison} (%(cursor_rank)s::real, %(cursor_id)s)"
+        order = "DESC" if after is not None else "ASC"
+
+    if headlines:
+        text_sql = f"{build_headline_sql()} as headline"
+        sql_params["headline_options"] = HEADLINE_OPTIONS
+    else:
+        text_sql = "ps.section_text as raw_text"
+
+    # best: the best ranked matching section of each label
+    # page: the labels of the page, only their section texts or headlines are read
     sql = f"""
+    WITH best AS (
+        SELECT DISTINCT ON (dl.id)
+            dl.id,
+            ps.id as section_id,
+            {build_rank_sql()} as rank
+        FROM data_productsection as ps
+        JOIN data_labelproduct as lp ON lp.id = ps.label_product_id
+        JOIN data_druglabel as dl ON lp.drug_label_id = dl.id
+        WHERE {match_sql}
+        AND dl.id IN (SELECT id FROM {DRUG_LABEL_QUERY_TEMP_TABLE_NAME})
+        {section_filter_sql}
+        ORDER BY dl.id, rank DESC, ps.id
+    ), page AS (
+        SELECT id, section_id, rank FROM best
+        {keyset_sql}
+        ORDER BY rank {order}, id {order}
+        LIMIT %(limit)s
+    )
     SELECT
         dl.id,
         dl.source,
@@ -100,24 +178,55 @@ def process_search(search_request: SearchRequest, user: Optional[User] = None) -
         dl.generic_name,
         dl.version_date,
         dl.source_product_number,
-        ps.section_text as raw_text,
+        {text_sql},
+        page.section_id,
+        page.rank,
         dl.marketer,
         dl.link
-    FROM data_productsection as ps
-    JOIN data_labelproduct as lp ON lp.id = ps.label_product_id
-    JOIN data_druglabel as dl ON lp.drug_label_id = dl.id
-    WHERE {match_sql}
-    AND dl.id IN (SELECT id FROM {DRUG_LABEL_QUERY_TEMP_TABLE_NAME})
+    FROM page
+    JOIN data_druglabel as dl ON dl.id = page.id
+    JOIN data_productsection as ps ON ps.id = page.section_id
+    ORDER BY page.rank {order}, page.id {order}
     """
 
-    if search_request.select_section:
-        sql += """ AND LOWER(section_name) = %(section_name)s"""
-
-    sql += " LIMIT 100"
     logger.debug(f"sql: {sql}")
     return [d for d in DrugLabel.objects.raw(sql, params=sql_params)]
 
 
+def search_page(
+    search_request: SearchRequest,
+    user: Optional[User] = None,
+    headlines: bool = False,
+    page_size: int = 20,
+    after: Optional[SearchCursor] = None,
+    before: Optional[SearchCursor] = None,
+) -> SearchPage:
+    """A page of process_search results, fetching one extra label to know if there is a page after it
+    Args:
+        after (SearchCursor): The page after this cursor, e.g. SearchPage.next_cursor, or the first page
+        before (SearchCursor): The page before this cursor, e.g. SearchPage.previous_cursor
+    Returns:
+        SearchPage: The results, in rank order, and the cursors of the pages around them
+    """
+    results = process_search(
+        search_request, user, headlines, limit=page_size + 1, after=after, before=before
+    )
+    more = len(results) > page_size
+    results = results[:page_size]
+    if before is not None:
+        results.reverse()
+        has_previous, has_next = more, True
+    else:
+        has_previous, has_next = after is not None, more
+
+    previous_cursor = next_cursor = None
+    if results and has_previous:
+        previous_cursor = SearchCursor(results[0].rank, results[0].id)
+    if results and has_next:
+        next_cursor = SearchCursor(results[-1].rank, results[-1].id)
+    return SearchPage(results, previous_cursor, next_cursor)
+
+
 def highlight_text_by_term(text: str, search_term: str) -> Tuple[str, bool]:
     """Builds the highlighted texted for a given string.
     Args:
@@ -128,35 +237,71 @@ def highlight_text_by_term(text: str, search_term: str) -> Tuple[str, bool]:
     """
     if not text:
         return "", False
-    tokens = text.split()
-    comparison_token = set(search_term.lower().split())
-    highlighted = False
+    return get_highlighter(tuple(search_term.split())).highlight_tokens(text, "<b>", "</b>")
 
-    for index, token in enumerate(tokens):
-        lower_token = token.lower()
-        for comp in comparison_token:
-            if lower_token == comp:
-                tokens[index] = "<b>" + tokens[index] + "</b>"
-                highlighted = True
 
-    return " ".join(tokens), highlighted
+def get_sanitized_section_text(section_id: Optional[int], text: str) -> str:
+    """bleach.clean of a section text, cached by section id so it is cleaned once rather than on each search
+    Args:
+        section_id (int): The ProductSection id, None to not cache
+        text (str): The section text
+    Returns:
+        str: The text without html
+    """
+    key = f"sanitized_section:{section_id}"
+    if section_id is not None and settings.LABEL_SECTION_CACHE_TIMEOUT:
+        naked_text = cache.get(key)
+        if naked_text is None:
+            naked_text = bleach.clean(text, strip=True)
+            cache.set(key, naked_text, timeout=settings.LABEL_SECTION_CACHE_TIMEOUT)
+        return naked_text
+    return bleach.clean(text, strip=True)
+
+
+def build_snippet(
+    text: str, search_term: str, length: int = MAX_LENGTH_SEARCH_RESULT_DISPLAY
+) -> Tuple[str, bool]:
+    """Cuts the text around the first token matching the search term and highlights the matches in it.
+    The match is found with one scan of the text, only the snippet is split and highlighted.
+    Args:
+        text (str): Text without html
+        search_term (str): The search text to highlight
+        length (int): Maximum length of the snippet
+    Returns:
+        Tuple[str, bool]: The highlighted snippet and True if the search term was found,
+            else the start of the text and False
+    """
+    highlighter = get_highlighter(tuple(search_term.split()))
+    match = highlighter.find_token(text)
+    if match is None:
+        return text[:length], False
+
+    match_start, match_end = match
+    # show some text before the match, without cutting a word
+    start = max(0, match_start - length // 3)
+    while 0 < start < match_start and not text[start - 1].isspace():
+        start += 1
+    end = max(start + length, match_end)
+    while match_end < end < len(text) and not text[end].isspace():
+        end -= 1
+    return highlighter.highlight_tokens(text[start:end], "<b>", "</b>")
 
 
 def build_search_result(search_result: DrugLabel, search_term: str) -> Tuple[DrugLabel, str]:
     """Returns search result objects with highlighted text
     Args:
-        search_result (MockDrugLabel): A fake label that is used until we have a dataset
+        search_result (DrugLabel): A label from process_search, with the matching section's text as raw_text,
+            or its ts_headline as headline
         search_term (str): The search text to highlight
     Returns:
-        Tuple[MockDrugLabel, str]: Tuple object with the full drug label object and a truncated version of its text
+        Tuple[DrugLabel, str]: Tuple object with the full drug label object and a snippet of its text
     """
-    start, end, step = (
-        0,
-        len(search_result.raw_text),
-        MAX_LENGTH_SEARCH_RESULT_DISPLAY,
-    )
-    # remove any html that might ruin styling
-    naked_text = bleach.clean(search_result.raw_text, strip=True)
+    headline = getattr(search_result, "headline", None)
+    if headline is None:
+        # remove any html that might ruin styling
+        naked_text = get_sanitized_section_text(
+            getattr(search_result, "section_id", None), search_result.raw_text
+        )
 
     # title-casing
     title_cased_product_name = " ".join(
@@ -168,15 +313,12 @@ def build_search_result(search_result: DrugLabel, search_term: str) -> Tuple[Dru
     search_result.product_name = title_cased_product_name
     search_result.generic_name = title_cased_generic_name
 
-    # sliding window approach to mimic google's truncation
-    for i in range(start, end, step):
-        text = naked_text[i : i + step]
-        search_term_no_quotes = search_term.strip('"')
-        highlighted_text, did_highlight = highlight_text_by_term(text, search_term_no_quotes)
-        if did_highlight:
-            return search_result, highlighted_text
-
-    return search_result, naked_text[start:step]
+    if headline is None:
+        snippet, _ = build_snippet(naked_text, search_term.strip('"'))
+    else:
+        # ts_headline keeps the html of the section text, only its own <b> highlighting is kept
+        snippet = bleach.clean(headline, tags=["b"], attributes={}, strip=True)
+    return search_result, snippet
 
 
 def get_type_ahead_mapping() -> Dict[str, List[str]]:
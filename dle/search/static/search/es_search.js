@@ -6,6 +6,7 @@
 var globalSearchTerm = '';
 var queryType = 'match'; // knn, simpleQueryString, match
 var searchkit_ready = false;
+var collapseLabels = false; // one hit per label rather than per section
 
 const sk = new Searchkit({
     connection: {
@@ -158,7 +159,28 @@ const client = SearchkitInstantsearchClient(sk, {
             var query = uiRequest.request.params.query
             console.log(`beforeSearch: ${query}`)
             if (!query | !(queryType=='knn')) {
-                return searchRequests;
+                if (!collapseLabels) {
+                    return searchRequests;
+                }
+                // Elasticsearch collapses the sections of a label into its best one, the next best ones
+                // come back in the hit's inner_hits. Not for knn, which our Elasticsearch version can't collapse
+                return searchRequests.map((sr) => {
+                    return {
+                        ...sr,
+                        body: {
+                            ...sr.body,
+                            collapse: {
+                                field: "drug_label_id",
+                                inner_hits: {
+                                    name: "sections",
+                                    size: 3,
+                                    _source: false,
+                                    fields: ["section_name"]
+                                }
+                            }
+                        }
+                    }
+                })
             }
 
             const vectorizationRes = await vectorizeText(query);
@@ -180,6 +202,15 @@ const client = SearchkitInstantsearchClient(sk, {
     }
 })
 
+// The names of the other matching sections of a collapsed hit
+function otherSections(hit) {
+    if (!hit.inner_hits) {
+        return '';
+    }
+    const names = hit.inner_hits.sections.hits.hits.slice(1).map((section) => section.fields.section_name[0]);
+    return names.length ? `Also matches: ${names.join(', ')}<br />` : '';
+}
+
 const search = instantsearch({
   indexName: "productsection",
   searchClient: client,
@@ -277,6 +308,7 @@ search.addWidgets([
                       Agency Product Number: ${hit.drug_label_source_product_number}<br />
                       Source Link: <a href="${hit.drug_label_link}">${hit.drug_label_link}</a><br />
                       <p>${components.Snippet({ attribute: 'section_text', hit })}</p>
+                      ${otherSections(hit)}
                       `;
       }
     }
@@ -326,3 +358,9 @@ radioGroup.forEach(function(radio) {
         search.refresh();
     });
 })
+
+// One hit per label when the checkbox is checked
+document.getElementById("collapse-labels").addEventListener("change", function() {
+    collapseLabels = this.checked;
+    search.refresh();
+});
@@ -0,0 +1,87 @@
+import json
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length, so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def parse_vectors(bert_vectors: Iterable[str]) -> np.ndarray:
+    """The float32 matrix of ProductSection.bert_vector values, which are stored as JSON arrays"""
+    return np.array([json.loads(vector) for vector in bert_vectors], dtype=np.float32)
+
+
+def top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The k highest scores of each row and their ids, best first
+    Args:
+        scores: (queries, candidates) similarities
+        ids: (candidates,) or (queries, candidates) ids of the candidates
+    """
+    if ids.ndim == 1:
+        ids = np.broadcast_to(ids, scores.shape)
+    k = min(k, scores.shape[1])
+    # argpartition finds the k best in linear time, only those k are sorted
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best = np.take_along_axis(best, order, axis=1)
+    return np.take_along_axis(scores, best, axis=1), np.take_along_axis(ids, best, axis=1)
+
+
+def vector_batches(sections, batch_size: int = 5000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """(ids, vectors) batches of the bert_vectors of a ProductSection queryset, for exact_knn"""
+    ids, vectors = [], []
+    for section_id, bert_vector in sections.values_list("id", "bert_vector").iterator(
+        chunk_size=batch_size
+    ):
+        ids.append(section_id)
+        vectors.append(bert_vector)
+        if len(ids) == batch_size:
+            yield np.array(ids, dtype=np.int64), parse_vectors(vectors)
+            ids, vectors = [], []
+    if ids:
+        yield np.array(ids, dtype=np.int64), parse_vectors(vectors)
+
+
+def exact_knn(
+    queries: np.ndarray,
+    batches: Iterable[Tuple[np.ndarray, np.ndarray]],
+    k: int,
+    cosine: bool = True,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Brute force similarity search, the ground truth the approximate kNN is measured against
+    The candidates are scored a batch at a time, so they never need to be in memory all at once.
+    Args:
+        queries: (queries, dims) query vectors
+        batches: (ids, vectors) pairs, the ids (n,) of n candidate vectors (n, dims)
+        k: neighbours per query
+        cosine: cosine similarity, else dot product, which is the same for the unit length bert_vectors
+    Returns:
+        the (queries, k) scores and ids of the nearest candidates, best first
+    """
+    queries = queries.astype(np.float32)
+    if cosine:
+        queries = normalize(queries)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for ids, vectors in batches:
+        vectors = vectors.astype(np.float32, copy=False)
+        scores = queries @ (normalize(vectors) if cosine else vectors).T
+        best_scores, best_ids = top_k(
+            np.concatenate([best_scores, scores], axis=1),
+            np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1),
+            k,
+        )
+    return best_scores, best_ids
+
+
+def recall(approximate_ids: Iterable, exact_ids: Iterable) -> float:
+    """Share of the exact neighbours the approximate search found"""
+    exact_ids = set(exact_ids)
+    if not exact_ids:
+        return 1.0
+    return len(exact_ids.intersection(approximate_ids)) / len(exact_ids)
@@ -1,12 +1,16 @@
 import json
 import logging
 
+from django.conf import settings
+from django.db.models import Prefetch
+
 import elastic_transport
+from elasticsearch import BadRequestError, NotFoundError
 from elasticsearch.helpers import streaming_bulk
 from elasticsearch_django.settings import get_client
 from tqdm import tqdm
 
-from data.models import AGENCY_CHOICES, ProductSection
+from data.models import AGENCY_CHOICES, DrugLabel, IndexGeneration, LabelProduct, ProductSection
 
 
 # Set elasticsearch logger to WARNING, otherwise it logs every batch of PUT requests
@@ -15,13 +19,46 @@ logging.getLogger("elastic_transport.transport").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
+VECTOR_INDEX_TYPES = ["hnsw", "int8_hnsw"]
+
+
+def vector_index_options(
+    index_type: str | None = None, m: int | None = None, ef_construction: int | None = None
+) -> dict:
+    """The index_options of the dense_vector fields, by default ES_VECTOR_INDEX_TYPE, ES_HNSW_M and
+    ES_HNSW_EF_CONSTRUCTION
+    int8_hnsw keeps the vectors in the HNSW graph as bytes, about a quarter of the memory of floats
+    """
+    index_type = index_type or settings.ES_VECTOR_INDEX_TYPE
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(
+            f"{index_type} is not a valid vector index type. Please use one of {VECTOR_INDEX_TYPES}"
+        )
+    return {
+        "type": index_type,
+        "m": m or settings.ES_HNSW_M,
+        "ef_construction": ef_construction or settings.ES_HNSW_EF_CONSTRUCTION,
+    }
+
+
 def create_index(
-    index_name: str, mapping_file: str, recreate: bool = False
+    index_name: str,
+    mapping_file: str,
+    recreate: bool = False,
+    vector_options: dict | None = None,
 ) -> elastic_transport.ObjectApiResponse | None:
+    """Creates the index with the mapping file, its dense_vector fields indexed with vector_options
+    (vector_index_options() by default)
+    """
     es = get_client()
     # open mapping_file
     with open(mapping_file, "r") as f:
         mapping = json.load(f)
+    vector_fields = [
+        name for name, field in mapping["properties"].items() if field.get("type") == "dense_vector"
+    ]
+    for name in vector_fields:
+        mapping["properties"][name]["index_options"] = vector_options or vector_index_options()
 
     # Index gets created if it doesn't exist, or if recreate is True
     if recreate and es.indices.exists(index=index_name):
@@ -30,6 +67,7 @@ def create_index(
         logger.info(f"Delete response: {del_res}")
         logger.info(del_res.body)
         res = es.indices.create(index=index_name, mappings=mapping)
+        IndexGeneration.bump(index_name)
         return res
     elif not es.indices.exists(index=index_name):
         logger.info(
@@ -37,8 +75,21 @@ def create_index(
         )
         settings = {"index": {"routing.allocation.total_shards_per_node": 5}}
         res = es.indices.create(index=index_name, mappings=mapping, settings=settings)
+        IndexGeneration.bump(index_name)
         return res
     else:
+        # the field parameters that can change on an existing index, like eager_global_ordinals on the facet
+        # fields, are brought in line with the mapping file; the others only change when it's recreated,
+        # including the vector index options
+        properties = {
+            name: field
+            for name, field in mapping["properties"].items()
+            if name not in vector_fields
+        }
+        try:
+            es.indices.put_mapping(index=index_name, properties=properties)
+        except BadRequestError as e:
+            logger.warning(f"Mapping of {index_name} differs from {mapping_file}: {e}")
         return None
 
 
@@ -58,24 +109,124 @@ def populate_index(index_name: str = "productsection", agency: str = "all"):
             label_product__drug_label__source=agency
         ).filter(bert_vector__isnull=False)
 
+    logger.info(f"Ingesting {sections_w_vectors.count()} sections with vectors into Elasticsearch")
+    index_sections(sections_w_vectors, index_name=index_name)
+
+
+def populate_label_index(index_name: str = "druglabel", agency: str = "all"):
+    """Populate the label index with the given agency's labels, using drug_label.id as the doc._id
+    The search page still facets on productsection, for now only `benchmark_facets` queries this index.
+    """
+    drug_labels = DrugLabel.objects.all()
+    if agency != "all":
+        if agency not in [choice[0] for choice in AGENCY_CHOICES]:
+            raise ValueError(f"{agency} is not a valid agency. Please use one of {AGENCY_CHOICES}")
+        drug_labels = drug_labels.filter(source=agency)
+
+    logger.info(f"Ingesting {drug_labels.count()} labels into Elasticsearch")
+    index_labels(drug_labels, index_name=index_name)
+
+
+def index_sections(sections, index_name: str = "productsection", progress_bar: bool = True) -> int:
+    """Bulk index a queryset of (vectorized) sections
+    Returns: the number of documents indexed successfully
+    """
+
     def generate_actions():
-        """For each agency's section that has a BERT vector, yield a document"""
-        # Only ingest ProductSections with existing vector representations
+        """For each section, yield a document"""
         # Use iterator to avoid loading all sections into memory which was causing the job to get killed
-        for section in sections_w_vectors.iterator():
+        for section in sections.iterator():
             doc = section.as_search_document()
             doc["_id"] = section.id
             yield doc
 
-    logger.info(f"Ingesting {sections_w_vectors.count()} sections with vectors into Elasticsearch")
+    return bulk_index(generate_actions(), sections.count(), index_name, progress_bar)
+
+
+def delete_sections(
+    section_ids: list, index_name: str = "productsection", batch_size: int = 10000
+) -> int:
+    """Deletes the documents of sections that no longer exist, e.g. the ones `reparse` replaced
+    Returns: the number of documents deleted
+    """
+    es = get_client()
+    deleted = 0
+    for start in range(0, len(section_ids), batch_size):
+        try:
+            res = es.delete_by_query(
+                index=index_name,
+                query={
+                    "ids": {"values": [str(i) for i in section_ids[start : start + batch_size]]}
+                },
+                conflicts="proceed",
+                refresh=True,
+            )
+        except NotFoundError:
+            # the index doesn't exist yet, there's nothing to delete
+            return deleted
+        deleted += res["deleted"]
+    logger.info(f"Deleted {deleted} out of {len(section_ids)} documents from {index_name}")
+    if deleted:
+        # responses cached while these documents were in the index are stale now
+        IndexGeneration.bump(index_name)
+    return deleted
+
+
+def label_document(drug_label: DrugLabel) -> dict:
+    """A DrugLabel as a document of the label index, with the drug_label_* fields of its section documents
+    so the same facets work on both indices, and the names of its sections.
+    Expects the sections to be prefetched, see index_labels.
+    """
+    section_names = set()
+    for label_product in drug_label.labelproduct_set.all():
+        section_names.update(
+            section.section_name for section in label_product.productsection_set.all()
+        )
+    return {
+        "_id": drug_label.id,
+        "id": drug_label.id,
+        "drug_label_id": drug_label.id,
+        "drug_label_product_name": drug_label.product_name,
+        "drug_label_source": drug_label.source,
+        "drug_label_generic_name": drug_label.generic_name,
+        "drug_label_version_date": drug_label.version_date,
+        "drug_label_source_product_number": drug_label.source_product_number,
+        "drug_label_marketer": drug_label.marketer,
+        "drug_label_link": drug_label.link,
+        "section_name": sorted(section_names),
+    }
+
+
+def index_labels(drug_labels, index_name: str = "druglabel", progress_bar: bool = True) -> int:
+    """Bulk index a queryset of labels into the label index, one document per label rather than per section,
+    so facet counts are computed over labels
+    Returns: the number of documents indexed successfully
+    """
+    products = LabelProduct.objects.prefetch_related(
+        Prefetch(
+            "productsection_set",
+            queryset=ProductSection.objects.only("id", "label_product_id", "section_name"),
+        )
+    )
+    labels = drug_labels.defer("raw_text").prefetch_related(
+        Prefetch("labelproduct_set", queryset=products)
+    )
+    actions = (label_document(drug_label) for drug_label in labels.iterator(chunk_size=500))
+    return bulk_index(actions, drug_labels.count(), index_name, progress_bar)
+
+
+def bulk_index(actions, total: int, index_name: str, progress_bar: bool = True) -> int:
+    """Bulk index documents, logging the ones that fail
+    Returns: the number of documents indexed successfully
+    """
     es = get_client()
 
-    progress = tqdm(unit="docs", total=sections_w_vectors.count())
+    progress = tqdm(unit="docs", total=total, disable=not progress_bar)
     successes = 0
     for ok, action in streaming_bulk(
         client=es,
         index=index_name,
-        actions=generate_actions(),
+        actions=actions,
         chunk_size=1000,
         max_retries=3,
         max_backoff=60,
@@ -86,4 +237,8 @@ def populate_index(index_name: str = "productsection", agency: str = "all"):
             logger.error(f"Failed to index document: {action}")
         progress.update(1)
         successes += ok
-    logger.info((f"Indexed {successes} out of {sections_w_vectors.count()} documents"))
+    logger.info((f"Indexed {successes} out of {total} documents"))
+    if successes:
+        # responses cached before these documents were indexed are stale now
+        IndexGeneration.bump(index_name)
+    return successes
@@ -0,0 +1,194 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from search.utils.knn import exact_knn, top_k
+
+
+logger = logging.getLogger(__name__)
+
+# the IndexGeneration of the local index, bumped by `build_vector_index`
+LOCAL_INDEX_NAME = "local_vector_index"
+
+
+class LocalVectorIndex:
+    """The section vectors as memory-mapped float32 NumPy files, searched by dot product without Elasticsearch
+    The files are written by `build_vector_index` into a directory:
+    - vectors.npy: (sections, dims) vectors, grouped by list if the index has an IVF quantizer
+    - ids.npy: (sections,) ProductSection ids of the vectors
+    - centroids.npy, offsets.npy: the IVF lists' centroids, and where each list's rows start in vectors.npy
+    Without the IVF files every vector is scored, with them only the lists nearest the query are.
+    The operating system pages the vectors in as they are read, so an index larger than memory can be
+    searched, and the worker processes of a server share the pages.
+    """
+
+    def __init__(self, path: Path | str, batch_size: int = 16384):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        self.centroids, self.offsets = None, None
+        if (self.path / "centroids.npy").exists():
+            self.centroids = np.load(self.path / "centroids.npy")
+            self.offsets = np.load(self.path / "offsets.npy")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def batches(
+        self, start: int, end: int, allowed_ids: Optional[np.ndarray] = None
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """(ids, vectors) batches of rows start to end, without the ids that aren't in allowed_ids"""
+        for batch_start in range(start, end, self.batch_size):
+            batch_end = min(batch_start + self.batch_size, end)
+            ids = self.ids[batch_start:batch_end]
+            vectors = self.vectors[batch_start:batch_end]
+            if allowed_ids is not None:
+                allowed = np.isin(ids, allowed_ids)
+                ids, vectors = ids[allowed], vectors[allowed]
+            if len(ids):
+                yield ids, vectors
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        n_probe: Optional[int] = None,
+        allowed_ids: Optional[Iterable[int]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """The k sections with the highest dot product with each query, best first
+        Args:
+            queries: (queries, dims) query vectors
+            k: neighbours per query
+            n_probe: IVF lists searched per query, all of them if None or if the index has no IVF quantizer
+            allowed_ids: only these sections are searched, e.g. the ones matching the filters
+        Returns:
+            (id, score) pairs per query
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if allowed_ids is not None:
+            allowed_ids = np.fromiter(allowed_ids, dtype=np.int64)
+        if self.centroids is None or not n_probe or n_probe >= len(self.centroids):
+            # every query scores the same rows, so they share each batch's matrix multiplication
+            scores, ids = exact_knn(
+                queries, self.batches(0, len(self), allowed_ids), k, cosine=False
+            )
+            return [
+                list(zip(row_ids.tolist(), row_scores.tolist()))
+                for row_ids, row_scores in zip(ids, scores)
+            ]
+
+        results = []
+        _, lists = top_k(queries @ self.centroids.T, np.arange(len(self.centroids)), n_probe)
+        for query, query_lists in zip(queries, lists):
+            batches = (
+                batch
+                for i in query_lists
+                for batch in self.batches(self.offsets[i], self.offsets[i + 1], allowed_ids)
+            )
+            scores, ids = exact_knn(query[np.newaxis], batches, k, cosine=False)
+            results.append(list(zip(ids[0].tolist(), scores[0].tolist())))
+        return results
+
+
+def train_centroids(
+    sample: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """Spherical k-means: n_lists unit length centroids of the sample vectors, by dot product"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = sample[assignments == i]
+            # a list nothing was assigned to keeps its centroid
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[i] = centroid / (np.linalg.norm(centroid) or 1)
+    return centroids
+
+
+def build_vector_index(
+    path: Path | str,
+    batches: Iterable[Tuple[np.ndarray, np.ndarray]],
+    count: int,
+    dims: int = 768,
+    n_lists: int = 0,
+    sample_size: int = 100000,
+    seed: int = 0,
+) -> LocalVectorIndex:
+    """Writes the vectors of the batches to a LocalVectorIndex directory, replacing the one at path
+    The index is built next to it and moved into place once it's complete, servers that have the old one
+    mapped keep reading it until they reload.
+    Args:
+        batches: (ids, vectors) batches of at most count vectors, see search.utils.knn.vector_batches
+        count: the number of vectors, the files are allocated up front
+        n_lists: the number of IVF lists, 0 for an exact index
+        sample_size: the vectors the IVF centroids are trained on
+    """
+    path = Path(path)
+    build_path = path.with_name(path.name + ".build")
+    shutil.rmtree(build_path, ignore_errors=True)
+    build_path.mkdir(parents=True)
+
+    # the vectors are streamed into a staging file, in the order of the batches
+    staged_vectors = open_memmap(
+        build_path / "staged.npy", mode="w+", dtype=np.float32, shape=(count, dims)
+    )
+    staged_ids = np.empty(count, dtype=np.int64)
+    n = 0
+    for ids, vectors in batches:
+        batch = min(len(ids), count - n)
+        staged_vectors[n : n + batch] = vectors[:batch]
+        staged_ids[n : n + batch] = ids[:batch]
+        n += batch
+    logger.info(f"Staged {n} vectors")
+
+    order = np.arange(n)
+    n_lists = min(n_lists, n)
+    if n_lists:
+        rng = np.random.default_rng(seed)
+        sample = staged_vectors[
+            np.sort(rng.choice(n, size=max(min(sample_size, n), n_lists), replace=False))
+        ]
+        centroids = train_centroids(sample, n_lists, seed=seed)
+        assignments = np.concatenate(
+            [
+                np.argmax(staged_vectors[start : start + 16384] @ centroids.T, axis=1)
+                for start in range(0, n, 16384)
+            ]
+        )
+        # the rows of a list are stored together, so probing a list reads one contiguous slice
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        np.save(build_path / "centroids.npy", centroids)
+        np.save(build_path / "offsets.npy", offsets)
+
+    if n == count and not n_lists:
+        # already in order, the staging file is the index
+        staged_vectors.flush()
+        del staged_vectors
+        os.replace(build_path / "staged.npy", build_path / "vectors.npy")
+    else:
+        vectors = open_memmap(
+            build_path / "vectors.npy", mode="w+", dtype=np.float32, shape=(n, dims)
+        )
+        for start in range(0, n, 16384):
+            vectors[start : start + 16384] = staged_vectors[order[start : start + 16384]]
+        vectors.flush()
+        del vectors, staged_vectors
+        os.remove(build_path / "staged.npy")
+    np.save(build_path / "ids.npy", staged_ids[:n][order])
+
+    old_path = path.with_name(path.name + ".old")
+    shutil.rmtree(old_path, ignore_errors=True)
+    if path.exists():
+        os.replace(path, old_path)
+    os.replace(build_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return LocalVectorIndex(path)
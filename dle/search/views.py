@@ -1,13 +1,10 @@
-from typing import List, Set, Tuple
-
-from django.core.paginator import Paginator
+from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.views.decorators.cache import cache_page
 
-from data.models import DrugLabel
-from search.models import SearchRequest
+from search.models import SearchCursor, SearchRequest
 from users.forms import SavedSearchForm
 from users.models import MyLabel
 
@@ -61,22 +58,25 @@ def list_search_results_impl(request: HttpRequest) -> HttpResponse:
     """
     search_request_object = SearchService.validate_search(request.GET)
     search_query_url = SearchRequest.build_url_query(search_request=search_request_object)
-    results = SearchService.process_search(search_request_object, request.user)
-    processed_labels: Set[int] = set()
-    search_results_to_display: List[Tuple[DrugLabel, str]] = []
-    for result in results:
-        if result.id not in processed_labels:
-            search_results_to_display.append(
-                SearchService.build_search_result(result, search_request_object.search_text)
-            )
-            processed_labels.add(result.id)
+    # keyset pagination, see SearchService.process_search
+    page = SearchService.search_page(
+        search_request_object,
+        request.user,
+        headlines=settings.SEARCH_HEADLINES,
+        page_size=20,
+        after=SearchCursor.parse(request.GET.get("after")),
+        before=SearchCursor.parse(request.GET.get("before")),
+    )
+    page_obj = [
+        SearchService.build_search_result(result, search_request_object.search_text)
+        for result in page.results
+    ]
 
     TYPE_AHEAD_MAPPING = get_type_ahead_mapping()
-    paginator = Paginator(search_results_to_display, 20)  # show 20 results per pagination
-    page_number = request.GET.get("page", "1")
-    page_obj = paginator.get_page(page_number)
     context = {
         "page_obj": page_obj,
+        "previous_cursor": page.previous_cursor,
+        "next_cursor": page.next_cursor,
         "search_query_url": search_query_url,
         "search_request_object": search_request_object,
         "type_ahead_manufacturer": TYPE_AHEAD_MAPPING["manufacturers"],
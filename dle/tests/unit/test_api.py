@@ -0,0 +1,118 @@
+import io
+import json
+import time
+
+import pytest
+import urllib3
+
+from api.knn import similar_sections_cache_key
+from api.msearch_cache import ResponseCache, caching_stream, msearch_cache_key
+from api.proxy import MsearchRejected, stream_response, validate_msearch
+from data.models import ProductSection
+
+
+def msearch_body(*headers):
+    lines = []
+    for header in headers:
+        lines += [json.dumps(header), json.dumps({"query": {"match_all": {}}})]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_validate_msearch_accepts_allowed_indices():
+    body = msearch_body({"index": "productsection"}, {"index": ["productsection"]})
+    assert validate_msearch(body, ["productsection"], 1024) == {"productsection"}
+
+
+@pytest.mark.parametrize(
+    "body, status",
+    [
+        (msearch_body({"index": "productsection"}), 413),
+        (msearch_body({"index": ".security"}), 400),
+        (msearch_body({"index": "productsection,.security"}), 400),
+        (msearch_body({}), 400),
+        (b'{"index": "productsection"}\n', 400),
+        (b"not json\n{}\n", 400),
+    ],
+)
+def test_validate_msearch_rejects(body, status):
+    max_size = 10 if status == 413 else 1024
+    with pytest.raises(MsearchRejected) as e:
+        validate_msearch(body, ["productsection"], max_size)
+    assert e.value.status == status
+
+
+def test_stream_response_passes_bytes_through():
+    content = b'{"responses": [{"hits": {"hits": []}}]}' * 1000
+    response = urllib3.HTTPResponse(
+        body=io.BytesIO(content),
+        headers={"Content-Type": "application/json"},
+        preload_content=False,
+    )
+    assert b"".join(stream_response(response, chunk_size=1024)) == content
+
+
+def test_msearch_cache_key_ignores_key_order_and_whitespace():
+    body = b'{"index": "productsection"}\n{"size": 20, "query": {"match_all": {}}}\n'
+    same = b'{"index":"productsection"}\n\n{"query":{"match_all":{}},"size":20}'
+    generations = {"productsection": 3}
+    key = msearch_cache_key(body, generations, gzip=False)
+    assert msearch_cache_key(same, generations, gzip=False) == key
+    assert msearch_cache_key(body, {"productsection": 4}, gzip=False) != key
+    assert msearch_cache_key(body, generations, gzip=True) != key
+
+
+def test_response_cache_evicts_least_recently_used_and_expired():
+    cache = ResponseCache(ttl=60, max_bytes=10, max_entry_bytes=8)
+    cache.set("a", 200, "application/json", None, b"aaaa")
+    cache.set("b", 200, "application/json", None, b"bbbb")
+    assert cache.get("a").content == b"aaaa"
+    cache.set("c", 200, "application/json", None, b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    cache.set("d", 200, "application/json", None, b"d" * 9)
+    assert cache.get("d") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 2, 1)
+    assert (stats["entries"], stats["bytes"]) == (2, 8)
+
+    cache.ttl = 0
+    cache.set("e", 200, "application/json", None, b"e")
+    time.sleep(0.001)
+    assert cache.get("e") is None
+
+
+def test_caching_stream_caches_complete_responses_only():
+    cache = ResponseCache(ttl=60, max_bytes=100, max_entry_bytes=10)
+    chunks = [b"abc", b"def"]
+    assert (
+        list(caching_stream((c for c in chunks), cache, "k", 200, "application/json", "gzip"))
+        == chunks
+    )
+    cached = cache.get("k")
+    assert (cached.content, cached.content_encoding) == (b"abcdef", "gzip")
+
+    stream = caching_stream((c for c in chunks), cache, "partial", 200, "application/json", None)
+    next(stream)
+    stream.close()
+    assert cache.get("partial") is None
+
+    large = [b"x" * 6, b"x" * 6]
+    assert (
+        list(caching_stream((c for c in large), cache, "large", 200, "application/json", None))
+        == large
+    )
+    assert cache.get("large") is None
+
+
+def test_similar_sections_cache_key_changes_with_the_vector_and_generation():
+    section = ProductSection(id=8, bert_vector="[0.6, 0.8]")
+    filters = [["section_name.keyword", "Indications"]]
+    excludes = [["drug_label_id", 2]]
+    key = similar_sections_cache_key(section, 3, filters, excludes, 10)
+
+    assert similar_sections_cache_key(section, 3, filters, excludes, 10) == key
+    assert similar_sections_cache_key(section, 4, filters, excludes, 10) != key
+    assert similar_sections_cache_key(section, 3, [], excludes, 10) != key
+    section.bert_vector = "[0.8, 0.6]"
+    assert similar_sections_cache_key(section, 3, filters, excludes, 10) != key
@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+
+from compare.label_matches import (
+    MatchLabel,
+    normalize_generic_name,
+    refresh_label_matches,
+    score_matches,
+)
+from compare.management.commands.benchmark_compare_products import legacy_get_diff_for_diff_products
+from compare.models import LabelMatch
+from compare.util import (
+    diff_texts_match,
+    get_diff_for_diff_products,
+    get_diff_for_diff_versions,
+    pack_diff,
+    unpack_diff,
+)
+from data.models import DrugLabel, LabelProduct, ProductSection
+from data.services import get_rendered_sections
+from data.views import get_label_suggestions
+from users.models import MyLabel, User
+
+
+@pytest.mark.parametrize(
+    "text1, text2",
+    [
+        ("", ""),
+        ("nausea and headache", "nausea and headache"),
+        (
+            "The most common adverse reactions are nausea and headache in patients",
+            "Common adverse reactions in patients are headache and nausea",
+        ),
+        (
+            "rash of the skin of the  face and rash of the skin",
+            "the skin of the face rash of the skin of the hands",
+        ),
+        ("of the of the of the", "the of the of"),
+    ],
+)
+def test_diff_for_diff_products_matches_previous_implementation(text1, text2):
+    assert get_diff_for_diff_products(text1, text2) == legacy_get_diff_for_diff_products(
+        text1, text2
+    )
+
+
+def test_pack_diff_round_trip(settings):
+    settings.COMPARE_DIFF_TIMEOUT = 0
+    diff1, diff2 = get_diff_for_diff_versions(
+        "Take one tablet <b>daily</b>.", "Take two tablets daily."
+    )
+    assert unpack_diff(pack_diff(diff1, diff2)) == (diff1, diff2)
+    assert not diff_texts_match(diff1, diff2)
+    assert diff_texts_match(*get_diff_for_diff_versions("same text", "same text"))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rendered_sections_are_cached_until_label_is_saved(client, http_service):
+    dl = DrugLabel.objects.create(
+        source="EMA",
+        product_name="Diffusia",
+        generic_name="lorem ipsem",
+        version_date="2022-03-15",
+        source_product_number="ABC-123-DO-RE-ME",
+        marketer="Landau Pharma",
+    )
+    lp = LabelProduct.objects.create(drug_label=dl)
+    section = ProductSection.objects.create(
+        label_product=lp, section_name="INDICATIONS", section_text="Fake section text"
+    )
+
+    def render(drug_label, text):
+        return text.upper()
+
+    sections = get_rendered_sections([dl], "upper", render)
+    assert sections == {dl.id: {"INDICATIONS": "FAKE SECTION TEXT"}}
+
+    section.section_text = "New section text"
+    section.save()
+    assert get_rendered_sections([dl], "upper", render) == sections
+
+    dl.save()
+    sections = get_rendered_sections([dl], "upper", render)
+    assert sections == {dl.id: {"INDICATIONS": "NEW SECTION TEXT"}}
+
+
+@pytest.mark.parametrize(
+    "generic_name, tokens",
+    [
+        ("Metformin Hydrochloride 500 mg", ("metformin",)),
+        ("PARACETAMOL", ("acetaminophen",)),
+        ("Amlodipine besilate / Valsartan", ("amlodipine", "valsartan")),
+        ("valsartan and amlodipine", ("amlodipine", "valsartan")),
+        ("Potassium Chloride", ("chloride", "potassium")),
+        ("Insulin glargine (rDNA origin)", ("glargine", "insulin")),
+    ],
+)
+def test_normalize_generic_name(generic_name, tokens):
+    assert normalize_generic_name(generic_name) == tokens
+
+
+def test_score_matches():
+    def label(id, source, generic_name):
+        return MatchLabel(id, source, frozenset(normalize_generic_name(generic_name)))
+
+    target = label(1, "FDA", "acetaminophen")
+    candidates = [
+        label(2, "EMA", "Paracetamol"),
+        # same indications under another name
+        label(3, "TGA", "panadol"),
+        # same agency
+        label(4, "FDA", "acetaminophen"),
+        label(5, "HC", "ibuprofen"),
+    ]
+    vectors = {
+        1: np.array([1.0, 0.0]),
+        3: np.array([0.96, 0.28]),
+        4: np.array([1.0, 0.0]),
+        5: np.array([0.0, 1.0]),
+    }
+    matches = score_matches([target], candidates, vectors, k=3, min_score=0.35)
+    assert [(match_id, name, vector) for match_id, name, vector, _ in matches[1]] == [
+        (2, 1.0, None),
+        (3, 0.0, pytest.approx(0.96)),
+    ]
+    assert matches[1][0][3] == pytest.approx(0.6)
+    assert matches[1][1][3] == pytest.approx(0.384)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_my_labels_are_never_matched(client, http_service):
+    def create_label(source, source_product_number):
+        return DrugLabel.objects.create(
+            source=source,
+            product_name="Paracetamol",
+            generic_name="paracetamol",
+            version_date="2022-03-15",
+            source_product_number=source_product_number,
+            marketer="Landau Pharma",
+        )
+
+    fda_label = create_label("FDA", "ABC-123")
+    ema_label = create_label("EMA", "DEF-456")
+    my_label = create_label("TGA", "my_label_1")
+    user = User.objects.create_user(username="label-matcher", password="secret")
+    MyLabel.objects.create(user=user, drug_label=my_label, name="my paracetamol")
+    # stored before the label was known to be a My Label
+    LabelMatch.objects.create(drug_label=fda_label, match=my_label, name_score=1.0, score=0.6)
+
+    refresh_label_matches(DrugLabel.objects.values_list("id", flat=True), min_score=0.5)
+    assert set(LabelMatch.objects.values_list("drug_label_id", "match_id")) == {
+        (fda_label.id, ema_label.id),
+        (ema_label.id, fda_label.id),
+    }
+    assert [m.match_id for m in get_label_suggestions([fda_label])] == [ema_label.id]
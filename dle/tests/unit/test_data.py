@@ -1,9 +1,28 @@
+import queue
+import threading
+
 from django.core import management
 from django.db import IntegrityError
 
 import pytest
 
-from data.models import DrugLabel, LabelProduct, ProductSection
+from data.constants import EMA_SECTION_NAMES, HC_SECTION_NAMES, TGA_SECTION_NAMES
+from data.management.commands import pdf_parsing_helper
+from data.management.commands.benchmark_highlight import legacy_highlight_text_by_term
+from data.management.commands.benchmark_pdf_sections import CASES as PDF_SECTION_CASES
+from data.management.commands.benchmark_section_matcher import legacy_fixed_header
+from data.management.commands.pdf_parsing_helper import (
+    JoinedText,
+    in_bboxes,
+    index_bboxes,
+    load_pdf_artifact,
+    read_pdf,
+    save_pdf_artifact,
+)
+from data.models import DrugLabel, IngestRun, LabelProduct, ProductSection
+from data.section_matcher import SectionNameMatcher
+from data.util import highlight_query_string
+from search.services import build_search_result, build_snippet, highlight_text_by_term
 
 
 @pytest.mark.django_db(transaction=True)
@@ -168,6 +187,186 @@ def test_load_hc_data(client, http_service):
     assert num_new_dl_entries > num_dl_entries
 
 
+@pytest.mark.django_db(transaction=True)
+def test_ingest_records_run(client, http_service):
+    """The ingest command should record each stage of the run in the ledger"""
+    management.call_command(
+        "ingest", type="test", agencies="EMA", vectorize=False, index=False
+    )
+    run = IngestRun.objects.order_by("-created_at").first()
+    assert run.status == "done"
+    stages = {stage.name: stage for stage in run.stages.all()}
+    assert set(stages.keys()) == {
+        "load_ema_data",
+        "update_latest_drug_labels",
+        "precompute_version_diffs",
+        "precompute_label_matches",
+    }
+    # the 3 test labels were passed on from the loader
+    assert stages["load_ema_data"].items_processed == 3
+    assert stages["load_ema_data"].duration is not None
+
+
+def test_ingest_index_stage_finishes_when_vectorize_fails(monkeypatch):
+    """A failed vectorize stage should still pass DONE on, so the index stage and the run can finish"""
+    # imported here, the ingest command loads the sentence transformer model on import
+    from data.management.commands.ingest import DONE
+    from data.management.commands.ingest import Command as IngestCommand
+
+    command = IngestCommand()
+    command.vectorize_queue = queue.Queue()
+    command.index_queue = queue.Queue()
+    indexed = []
+
+    def index_worker():
+        while (drug_label_id := command.index_queue.get()) is not DONE:
+            indexed.append(drug_label_id)
+
+    def vectorize_label(model, drug_label_id):
+        raise RuntimeError("model failed")
+
+    monkeypatch.setattr(command, "vectorize_label", vectorize_label)
+    command.index_thread = threading.Thread(target=index_worker, daemon=True)
+    command.index_thread.start()
+    command.vectorize_queue.put(1)
+    with pytest.raises(RuntimeError):
+        command.vectorize_worker()
+    command.index_thread.join(timeout=5)
+    assert not command.index_thread.is_alive()
+    assert indexed == []
+
+
+@pytest.mark.parametrize("names", [EMA_SECTION_NAMES, TGA_SECTION_NAMES, HC_SECTION_NAMES])
+def test_section_matcher_matches_linear_scan(names):
+    matcher = SectionNameMatcher(names)
+    headers = ["", "x", "4.1 Therapeutic indications", "Zzzz qqqq wwww", "BOXED WARNING"]
+    for n, name in enumerate(names, 1):
+        headers += [name, name.upper(), f"{n}. {name}", f"{n}.1 {name.upper()}"]
+        headers.append(name[: len(name) // 2])
+    for header in headers:
+        assert matcher.match(header) == legacy_fixed_header(names, header)
+
+
+@pytest.mark.parametrize("case", PDF_SECTION_CASES.keys())
+def test_pdf_sections_match_line_by_line(case):
+    legacy, new, kwargs = PDF_SECTION_CASES[case]
+    text = [
+        "ANNEX I",
+        "1. NAME OF THE MEDICINAL PRODUCT",
+        "Diffusia 10 mg tablets",
+        "4.1 Therapeutic indications",
+        "DESCRIPTION",
+        "",
+        "Precautions",
+        "4.",
+        "  WARNINGS AND PRECAUTIONS",
+        "WARNINGS AND PRECAUTIONS",
+        "10 OVERDOSAGE",
+        "see 4.2 for details.",
+        "ANNEX  II",
+        "PRECAUTIONS",
+        "",
+    ]
+    assert new(JoinedText(text), **kwargs) == legacy(text, **kwargs)
+
+
+@pytest.mark.parametrize("lazy_annex, pages_extracted", [(True, 3), (False, 5)])
+def test_read_pdf_stops_after_second_annex(monkeypatch, lazy_annex, pages_extracted):
+    """With lazy_annex, no page after the one with the second ANNEX line is extracted"""
+    pages = [
+        ["ANNEX I", "SUMMARY OF PRODUCT CHARACTERISTICS"],
+        ["4.1 Therapeutic indications", "Fake section text"],
+        ["ANNEX II", "MANUFACTURER"],
+        ["ANNEX III", "LABELLING"],
+        ["ANNEX IV", "PACKAGE LEAFLET"],
+    ]
+
+    class FakePdf:
+        def __init__(self, filename):
+            self.pages = pages
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+    monkeypatch.setattr(pdf_parsing_helper.pdfplumber, "open", FakePdf)
+    monkeypatch.setattr(
+        pdf_parsing_helper, "extract_page_text", lambda page, **kwargs: list(page)
+    )
+    stats = {}
+    text = read_pdf("label.pdf", lazy_annex=lazy_annex, stats=stats)
+    assert text == [
+        "ANNEX I",
+        "SUMMARY OF PRODUCT CHARACTERISTICS",
+        "4.1 Therapeutic indications",
+        "Fake section text",
+    ]
+    assert stats["pages"] == 5
+    assert stats["pages_extracted"] == pages_extracted
+    assert len(stats["page_seconds"]) == pages_extracted
+
+
+def test_pdf_cache_round_trip(settings, tmp_path):
+    settings.PDF_CACHE_DIR = tmp_path
+    sha256 = "ab" * 32
+    assert load_pdf_artifact(sha256) is None
+    lines = ["ANNEX I", "1. NAME OF THE MEDICINAL PRODUCT", "Diffusia 10 mg tablets"]
+    save_pdf_artifact(sha256, {"no_annex": False}, {"pages": 1}, lines)
+    artifact = load_pdf_artifact(sha256)
+    assert artifact["lines"] == lines
+    assert artifact["options"] == {"no_annex": False}
+
+
+def test_in_bboxes_matches_linear_check():
+    # two tables side by side, one below them and one overlapping it
+    bboxes = [(50, 100, 250, 300), (300, 100, 500, 250), (50, 400, 500, 600), (400, 550, 550, 700)]
+    ys, bands = index_bboxes(bboxes)
+    for x in range(0, 600, 7):
+        for y in range(0, 800, 7):
+            obj = {"x0": x - 2, "x1": x + 2, "top": y - 3, "bottom": y + 3}
+            expected = any(x0 <= x < x1 and top <= y < bottom for x0, top, x1, bottom in bboxes)
+            assert in_bboxes(obj, ys, bands) == expected
+
+
+def test_highlight_query_string():
+    span = "<span style='background-color:yellow'>"
+    # matched text keeps its case, metacharacters are literal
+    assert highlight_query_string("Nausea (rare), 1x5 mg", "nausea (rare)") == (
+        f"{span}Nausea</span> {span}(rare)</span>, 1x5 mg"
+    )
+    assert highlight_query_string("Take 1.5 mg", "'1.5 mg'") == f"Take {span}1.5 mg</span>"
+    # overlapping matches are highlighted once
+    assert highlight_query_string("abcabc", "bca cab") == f"a{span}bcab</span>c"
+    assert highlight_query_string("text", "") == "text"
+
+
+@pytest.mark.parametrize("search_term", ["nausea", "Nausea headache", "and nausea", "none"])
+def test_highlight_text_by_term_matches_token_comparison(search_term):
+    text = "Nausea  and\nnausea, NAUSEA headache (headache) nausea"
+    assert highlight_text_by_term(text, search_term) == legacy_highlight_text_by_term(
+        text, search_term
+    )
+
+
+def test_build_snippet_cuts_around_first_match():
+    text = " ".join(f"word{i}" for i in range(200)) + " Nausea\nand headache " + "end " * 200
+    snippet, found = build_snippet(text, "nausea headache", length=60)
+    assert found
+    # a third of the snippet is before the match, without cutting a word
+    assert snippet.startswith("word198 word199 <b>Nausea</b> and <b>headache</b> end")
+    assert len(snippet) <= 60 + len("<b></b>") * 2
+    assert build_snippet(text, "vomiting", length=60) == (text[:60], False)
+
+
+def test_build_search_result_keeps_only_headline_highlighting():
+    dl = DrugLabel(product_name="DIFFUSIA", generic_name="lorem ipsem")
+    dl.headline = '<paragraph styleCode="x">Risk of <b>nausea</b> in <i>adults</i></paragraph>'
+    result, snippet = build_search_result(dl, "nausea")
+    assert snippet == "Risk of <b>nausea</b> in adults"
+    assert result.product_name == "Diffusia"
+
 
 #     # def test_load_ema_data_full(self):
 #     #     num_dl_entries = DrugLabel.objects.count()
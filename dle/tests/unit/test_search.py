@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from elasticsearch import NotFoundError
+
+from data.models import DrugLabel, IndexGeneration
+from search import services
+from search.models import SearchCursor, SearchRequest
+from search.utils import knn, provision_es, vector_index
+
+
+def ranked_labels(n):
+    """n labels as process_search returns them, ranked by (rank, id) descending"""
+    labels = []
+    for i in range(n):
+        dl = DrugLabel(id=1000 - i)
+        dl.rank = 0.5 - (i // 3) * 0.01
+        labels.append(dl)
+    return labels
+
+
+@pytest.fixture
+def fake_process_search(monkeypatch):
+    labels = ranked_labels(50)
+
+    def process_search(search_request, user, headlines, limit, after=None, before=None):
+        key = lambda dl: (dl.rank, dl.id)  # noqa: E731
+        if after is not None:
+            return [dl for dl in labels if key(dl) < tuple(after)][:limit]
+        if before is not None:
+            return [dl for dl in reversed(labels) if key(dl) > tuple(before)][:limit]
+        return labels[:limit]
+
+    monkeypatch.setattr(services, "process_search", process_search)
+    return labels
+
+
+def test_search_cursor_round_trip():
+    cursor = SearchCursor(0.0607927, 12)
+    assert SearchCursor.parse(str(cursor)) == cursor
+    assert SearchCursor.parse(None) is None
+    assert SearchCursor.parse("not a cursor") is None
+
+
+def test_search_page_walks_forward_and_back(fake_process_search):
+    search_request = SearchRequest(search_text="nausea", select_section="")
+
+    pages = [services.search_page(search_request, page_size=20)]
+    while pages[-1].next_cursor is not None:
+        pages.append(
+            services.search_page(search_request, page_size=20, after=pages[-1].next_cursor)
+        )
+    assert [len(page.results) for page in pages] == [20, 20, 10]
+    assert [dl for page in pages for dl in page.results] == fake_process_search
+    assert pages[0].previous_cursor is None
+
+    back = services.search_page(search_request, page_size=20, before=pages[2].previous_cursor)
+    assert back.results == pages[1].results
+    first = services.search_page(search_request, page_size=20, before=back.previous_cursor)
+    assert first.results == pages[0].results
+    assert first.previous_cursor is None
+    assert first.next_cursor == pages[0].next_cursor
+
+
+def test_exact_knn_matches_full_sort_across_batches():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(230, 16)).astype(np.float32)
+    ids = np.arange(1000, 1230)
+    queries = rng.normal(size=(5, 16)).astype(np.float32)
+
+    batches = [(ids[i : i + 50], vectors[i : i + 50]) for i in range(0, len(ids), 50)]
+    scores, neighbours = knn.exact_knn(queries, batches, k=7)
+
+    expected = knn.normalize(queries) @ knn.normalize(vectors).T
+    for row in range(len(queries)):
+        order = np.argsort(-expected[row])[:7]
+        assert neighbours[row].tolist() == ids[order].tolist()
+        assert np.allclose(scores[row], expected[row][order], atol=1e-6)
+
+
+def test_recall():
+    assert knn.recall([1, 2, 3, 4], [1, 2, 5, 6]) == 0.5
+    assert knn.recall([], []) == 1.0
+
+
+def test_local_vector_index_matches_exact_knn(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = knn.normalize(rng.normal(size=(300, 16)).astype(np.float32))
+    ids = np.arange(300, dtype=np.int64) * 2
+    queries = vectors[:4]
+    batches = [(ids[i : i + 64], vectors[i : i + 64]) for i in range(0, len(ids), 64)]
+    _, expected = knn.exact_knn(queries, batches, k=5)
+
+    # more rows counted than there are, as when sections are deleted during the build
+    index = vector_index.build_vector_index(tmp_path / "flat", iter(batches), 310, dims=16)
+    assert len(index) == 300
+    assert [[i for i, _ in row] for row in index.search(queries, 5)] == expected.tolist()
+
+    ivf = vector_index.build_vector_index(tmp_path / "ivf", iter(batches), 300, dims=16, n_lists=8)
+    assert ivf.offsets[-1] == 300
+    # probing every list is exact, each query's own vector is in the list nearest it
+    assert [[i for i, _ in row] for row in ivf.search(queries, 5, n_probe=8)] == expected.tolist()
+    assert [row[0][0] for row in ivf.search(queries, 5, n_probe=1)] == ids[:4].tolist()
+
+    allowed = ids[1::2]
+    results = ivf.search(queries, 5, n_probe=2, allowed_ids=allowed)
+    assert all(i in set(allowed.tolist()) for row in results for i, _ in row)
+
+
+def test_delete_sections_deletes_in_batches(monkeypatch):
+    requests = []
+    bumped = []
+
+    class FakeClient:
+        def delete_by_query(self, index, query, **kwargs):
+            requests.append((index, query["ids"]["values"]))
+            if index == "missing":
+                raise NotFoundError("index_not_found_exception", None, {})
+            return {"deleted": len(query["ids"]["values"])}
+
+    monkeypatch.setattr(provision_es, "get_client", FakeClient)
+    monkeypatch.setattr(IndexGeneration, "bump", bumped.append)
+    assert provision_es.delete_sections([1, 2, 3], batch_size=2) == 3
+    assert requests == [("productsection", ["1", "2"]), ("productsection", ["3"])]
+    assert bumped == ["productsection"]
+
+    # nothing to delete before the index is created
+    assert provision_es.delete_sections([4], index_name="missing") == 0
+    assert bumped == ["productsection"]
@@ -0,0 +1,178 @@
+import datetime
+import logging
+import os
+import time
+from distutils.util import strtobool
+
+from django.conf import settings
+from django.core import management
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from elasticsearch import logger as es_logger
+
+from api.apps import ApiConfig
+from data.constants import LASTEST_DRUG_LABELS_TABLE
+from data.models import DrugLabel, LabelProduct, ProductSection
+from data.util import vectorize_section
+from search.utils.provision_es import create_index, index_labels, index_sections
+from users.models import MyLabelJob
+
+
+es_logger.setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# the loader that parses an uploaded file, by DrugLabel.source
+MY_LABEL_LOADERS = {
+    "FDA": "load_fda_data",
+    "EMA": "load_ema_data",
+    "TGA": "load_tga_data",
+    "HC": "load_hc_data",
+}
+
+
+# runs with `python manage.py process_my_label_jobs`
+# add `--once True` to process the queued jobs and exit rather than keep polling
+# add `--verbosity 2` for info output
+# add `--verbosity 3` for debug output
+class Command(BaseCommand):
+    """Worker for the MyLabelJob queue.
+    Several workers can run at once, each job is claimed with SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+
+    help = "Processes uploaded MyLabels: parses, vectorizes and indexes them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            type=strtobool,
+            help="Exit once there are no queued jobs left. Default is False",
+            default=False,
+        )
+        parser.add_argument(
+            "--poll_interval",
+            type=float,
+            help="Seconds to wait before checking for new jobs. Default is 2",
+            default=2,
+        )
+        parser.add_argument(
+            "--max_attempts",
+            type=int,
+            help="Number of times a job is tried before it is marked as failed. Default is 3",
+            default=3,
+        )
+        parser.add_argument(
+            "--stale_after_minutes",
+            type=int,
+            help="Requeue jobs left running this long, e.g. by a worker that was killed. Default is 60",
+            default=60,
+        )
+        parser.add_argument(
+            "--mapping_file",
+            type=str,
+            help="Path to the mapping file, used if the index doesn't exist yet",
+            default="/app/search/mappings/provision.json",
+        )
+
+    def handle(self, *args, **options):
+        # basic logging config is in settings.py
+        # verbosity is 1 by default, gives critical, error and warning output
+        # `--verbosity 2` gives info output
+        # `--verbosity 3` gives debug output
+        self.verbosity = int(options["verbosity"])
+        root_logger = logging.getLogger("")
+        if self.verbosity == 2:
+            root_logger.setLevel(logging.INFO)
+        elif self.verbosity == 3:
+            root_logger.setLevel(logging.DEBUG)
+
+        self.max_attempts = options["max_attempts"]
+        self.mapping_file = options["mapping_file"]
+
+        stale_before = timezone.now() - datetime.timedelta(minutes=options["stale_after_minutes"])
+        num_stale = MyLabelJob.objects.filter(status="running", started_at__lt=stale_before).update(
+            status="queued"
+        )
+        if num_stale:
+            logger.warning(self.style.WARNING(f"Requeued {num_stale} stale jobs"))
+
+        logger.info(self.style.SUCCESS("waiting for jobs"))
+        while True:
+            job = self.claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+            self.process_job(job)
+        logger.info(self.style.SUCCESS("process complete"))
+
+    def claim_job(self):
+        """Mark the oldest queued job as running, skipping jobs other workers have locked"""
+        with transaction.atomic():
+            job = (
+                MyLabelJob.objects.select_for_update(skip_locked=True)
+                .filter(status="queued")
+                .order_by("created_at")
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = "running"
+            job.started_at = timezone.now()
+            job.attempts += 1
+            job.save()
+        return job
+
+    def process_job(self, job):
+        ml = job.my_label
+        dl = ml.drug_label
+        logger.info(f"processing {job}")
+        try:
+            if job.attempts > 1:
+                # the loader adds a new LabelProduct, so clear out what a failed attempt left behind
+                LabelProduct.objects.filter(drug_label=dl).delete()
+            command = MY_LABEL_LOADERS.get(dl.source, "load_ema_data")
+            management.call_command(
+                command, type="my_label", my_label_id=ml.id, verbosity=self.verbosity
+            )
+            job.message = self.vectorize_and_index(dl)
+
+            # add to latest_drug_labels
+            sql = f"INSERT INTO {LASTEST_DRUG_LABELS_TABLE} VALUES (%s)"
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [dl.id])
+            job.status = "done"
+        except Exception as e:
+            logger.error(self.style.ERROR(f"{job} failed: {repr(e)}"))
+            logger.debug(e, exc_info=True)
+            job.message = repr(e)
+            job.status = "queued" if job.attempts < self.max_attempts else "failed"
+        job.finished_at = timezone.now()
+        job.save()
+        logger.info(f"finished {job}")
+
+    def vectorize_and_index(self, dl) -> str:
+        """Vectorize and index the label's sections so it shows up in search straight away
+        Returns: a message for the job, the label is still usable if indexing fails
+        """
+        sections = ProductSection.objects.filter(label_product__drug_label=dl)
+        for section in sections.filter(bert_vector__isnull=True):
+            vectorize_section(section, ApiConfig.pubmedbert_model)
+        try:
+            # Index must exist to index documents
+            create_index("productsection", mapping_file=self.mapping_file)
+            num_indexed = index_sections(
+                sections.filter(bert_vector__isnull=False), progress_bar=False
+            )
+            if settings.ES_LABEL_INDEX:
+                label_mapping_file = os.path.join(
+                    os.path.dirname(self.mapping_file), "druglabel.json"
+                )
+                create_index("druglabel", mapping_file=label_mapping_file)
+                index_labels(DrugLabel.objects.filter(id=dl.id), progress_bar=False)
+        except Exception as e:
+            logger.error(self.style.ERROR(f"Failed to index {dl.id}: {repr(e)}"))
+            return f"Parsed, but not indexed for search: {repr(e)}"
+        return f"Parsed and indexed {num_indexed} sections"
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 23:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_savedsearch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MyLabelJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('my_label', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='users.mylabel')),
+            ],
+        ),
+    ]
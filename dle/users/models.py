@@ -26,8 +26,42 @@ class MyLabel(models.Model):
             f"is_successfully_parsed: {self.is_successfully_parsed}"
         )
 
+    @property
+    def latest_job(self):
+        # uses the prefetched jobs when the view prefetches them
+        return max(self.jobs.all(), key=lambda job: job.created_at, default=None)
+
 
 class SavedSearch(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     url = models.TextField()
     name = models.CharField(max_length=255, db_index=True)
+
+
+JOB_STATUSES = [
+    ("queued", "Queued"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+]
+
+
+class MyLabelJob(models.Model):
+    """Processing of an uploaded MyLabel file, picked up by `process_my_label_jobs`
+    The job parses the file, vectorizes and indexes the sections and adds the label to latest_drug_labels
+    """
+
+    my_label = models.ForeignKey(MyLabel, on_delete=models.CASCADE, related_name="jobs")
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default="queued", db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    message = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"MyLabelJob: {self.id}, my_label: {self.my_label_id}, status: {self.status}, attempts: {self.attempts}"
+
+    @property
+    def is_finished(self):
+        return self.status in ["done", "failed"]
@@ -1,9 +1,10 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db import IntegrityError
 from django.test import Client, TestCase
 
 from data.models import DrugLabel
 
-from .models import MyLabel, User
+from .models import MyLabel, MyLabelJob, User
 
 
 class UserTests(TestCase):
@@ -95,3 +96,31 @@ class MyLabelModelTests(TestCase):
         self.logout_user()
         response = self.client.get("/users/my_labels/")
         self.assertEqual(response.status_code, 302)
+
+    def test_upload_queues_my_label_job(self):
+        response = self.client.post(
+            "/users/my_labels/create/",
+            {
+                "name": "Diffusia upload",
+                "file": SimpleUploadedFile("diffusia.pdf", b"%PDF-1.4", "application/pdf"),
+                "source": "EMA",
+                "product_name": "Diffusia",
+                "generic_name": "lorem ipsem",
+                "product_number": "ABC-123",
+                "marketer": "Landau Pharma",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        # the file is only parsed by the worker, the request just queues it
+        ml = MyLabel.objects.get(name="Diffusia upload")
+        self.assertFalse(ml.is_successfully_parsed)
+        self.assertEqual(ml.jobs.get().status, "queued")
+
+        response = self.client.get(f"/users/my_labels/{ml.id}/status/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "users/_my_label_status.html")
+        self.assertContains(response, 'hx-trigger="every 2s"')
+
+        MyLabelJob.objects.filter(my_label=ml).update(status="done")
+        response = self.client.get(f"/users/my_labels/{ml.id}/status/")
+        self.assertNotContains(response, "hx-trigger")
@@ -11,5 +11,10 @@ urlpatterns = [
     path("register/", views.register, name="register"),
     path("my_labels/", views.my_labels_view, name="my_labels"),
     path("my_labels/create/", views.create_my_label, name="create_my_label"),
+    path(
+        "my_labels/<int:my_label_id>/status/",
+        views.my_label_status_htmx,
+        name="my_label_status_htmx",
+    ),
     path("saved_searches/create/", views.create_saved_search, name="create_my_saved_search"),
 ]
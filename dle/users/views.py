@@ -1,8 +1,7 @@
 import datetime as dt
 
-from django.core import management
-from django.db import IntegrityError, connection
-from django.shortcuts import redirect, render
+from django.db import IntegrityError
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
 from django.contrib.auth import authenticate, login, logout
@@ -11,7 +10,7 @@ from django.contrib.auth.decorators import login_required
 from data.models import DrugLabel
 
 from .forms import MyLabelForm, SavedSearchForm
-from .models import MyLabel, SavedSearch, User
+from .models import MyLabel, MyLabelJob, SavedSearch, User
 
 
 def login_view(request):
@@ -71,7 +70,7 @@ def my_labels_view(request, msg=None):
     form = MyLabelForm()
     # get a list of the user's MyLabels
     # note, could have performance issues if user has a "lot" of labels
-    my_labels = MyLabel.objects.filter(user=request.user).all()
+    my_labels = MyLabel.objects.filter(user=request.user).prefetch_related("jobs").all()
     saved_searches = SavedSearch.objects.filter(user=request.user).all()
 
     context = {
@@ -148,15 +147,21 @@ def create_my_label(request):
             )
             ml.save()
 
-            # process the file
-            # send to load_fda_data or load_ema_data
-            # --type my_label --my_label_id ml.id
-            command = "load_fda_data" if form.cleaned_data["source"] == "FDA" else "load_ema_data"
-            management.call_command(command, type="my_label", my_label_id=ml.id)
-
-            # add to latest_drug_labels
-            sql = f"INSERT INTO latest_drug_labels VALUES ({dl.id})"
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
+            # queue the file to be processed by `process_my_label_jobs`, which parses it,
+            # vectorizes and indexes it, and adds it to latest_drug_labels
+            MyLabelJob.objects.create(my_label=ml)
 
     return redirect(reverse("users:my_labels"))
+
+
+@login_required
+def my_label_status_htmx(request, my_label_id):
+    """Returns the processing status of a MyLabel; the partial keeps polling until the job finishes"""
+    my_label = get_object_or_404(
+        MyLabel.objects.prefetch_related("jobs"), pk=my_label_id, user=request.user
+    )
+    return render(
+        request=request,
+        template_name="users/_my_label_status.html",
+        context={"my_label": my_label},
+    )